@@ -0,0 +1,120 @@
+# -*- encoding:utf-8 -*-
+# ==============================================
+# Description: The cache of the parent chains sent with the widget info
+# ==============================================
+# Walking the parents of a deeply nested widget, and getting their object names, costs a few Python-level
+# Qt calls per level on every hover. The chain of each widget is computed once and linked to the chain of
+# its parent, so that siblings (and all the widgets of a dialog) share the common prefix.
+import functools
+import threading
+import typing
+
+from PyQtInspect._pqi_bundle.pqi_monkey_qt_props import _PQI_HANDLE_ATTR, _PQI_NAME_WATCHED_ATTR, get_own_attr
+from PyQtInspect._pqi_bundle.pqi_qt_tools import get_widget_parent, get_widget_class_name, get_widget_object_name
+from PyQtInspect._pqi_bundle.pqi_widget_registry import WidgetRegistry
+
+__all__ = [
+    'AncestryCache',
+]
+
+
+class _Ancestry:
+    """ A widget and its ancestors, as a linked list shared by the descendants of the widget. """
+    __slots__ = ('entry', 'parent', 'is_valid')
+
+    def __init__(self, entry: tuple, parent: typing.Optional['_Ancestry']):
+        self.entry = entry  # (class name, handle, object name)
+        self.parent = parent
+        self.is_valid = True
+
+    def is_chain_valid(self) -> bool:
+        node = self
+        while node is not None:
+            if not node.is_valid:
+                return False
+            node = node.parent
+        return True
+
+    def __iter__(self):
+        node = self
+        while node is not None:
+            yield node.entry
+            node = node.parent
+
+
+class AncestryCache:
+    """ Memoize the (class name, handle, object name) of the ancestors of the widgets, keyed by handle.
+
+    The node of a widget is invalidated when its parent changes (`notify_parent_changed`, called for
+    ``QEvent.ParentChange``) or when its object name changes (``objectNameChanged``).
+    The chains of its descendants go through it, so they are rebuilt from there at their next lookup.
+
+    The ancestors are registered: the wrapper of an ancestor created by C++ is kept by the registry,
+    so its handle (and the mark of its watched name) lasts as long as the widget, and the server can resolve it.
+    """
+    # Cleared when it holds more nodes, the handles of the deleted widgets are never reused
+    MAX_SIZE = 10000
+
+    def __init__(self, registry: WidgetRegistry):
+        self._register = registry.register
+        self._lock = threading.RLock()  # the info is built in the GUI thread and in the reader thread
+        self._handle_to_node = {}  # type: typing.Dict[int, _Ancestry]
+
+    def get_parent_info(self, widget) -> typing.List[tuple]:
+        """ The (class name, handle, object name) of the ancestors of the widget, from its parent. """
+        with self._lock:
+            parent = self._get_parent(widget)
+            if parent is None:
+                return []
+            return list(self._node_of(parent))
+
+    def notify_parent_changed(self, obj):
+        # Cheap test first, it is called for every ParentChange event
+        handle = get_own_attr(obj, _PQI_HANDLE_ATTR)
+        if handle is not None and handle in self._handle_to_node:
+            self._invalidate(handle)
+
+    def _invalidate(self, handle: int, *args):
+        with self._lock:
+            node = self._handle_to_node.pop(handle, None)
+            if node is not None:
+                node.is_valid = False
+
+    @staticmethod
+    def _get_parent(widget):
+        try:
+            return get_widget_parent(widget)
+        except:
+            return None
+
+    def _node_of(self, widget) -> _Ancestry:
+        """ Called with the lock held. """
+        handle = self._register(widget)
+        node = self._handle_to_node.get(handle)
+        if node is not None and node.is_chain_valid():
+            return node
+
+        parent = self._get_parent(widget)
+        node = _Ancestry((get_widget_class_name(widget), handle, get_widget_object_name(widget)),
+                         self._node_of(parent) if parent is not None else None)
+        self._watch_name(widget, handle)
+        if len(self._handle_to_node) >= self.MAX_SIZE:
+            self._clear()
+        self._handle_to_node[handle] = node
+        return node
+
+    def _watch_name(self, widget, handle: int):
+        """ Invalidate the node when the object name changes, there is no event for it. Called once per object. """
+        if get_own_attr(widget, _PQI_NAME_WATCHED_ATTR, False):
+            return
+        try:
+            widget.objectNameChanged.connect(functools.partial(self._invalidate, handle))
+            setattr(widget, _PQI_NAME_WATCHED_ATTR, True)
+        except (AttributeError, TypeError, RuntimeError):
+            pass  # shadowed or not a QObject, the name is not refreshed
+
+    def _clear(self):
+        """ Called with the lock held. """
+        for node in self._handle_to_node.values():
+            node.is_valid = False
+        self._handle_to_node.clear()
@@ -1,8 +1,11 @@
 # -*- encoding:utf-8 -*-
 
+import collections
 import dataclasses
 
+import os
 import queue
+import struct
 import threading
 import time
 import socket
@@ -10,12 +13,15 @@ import typing
 from socket import socket, AF_INET, SOCK_STREAM, SHUT_RD, SHUT_WR, SOL_SOCKET, SO_REUSEADDR
 
 from PyQtInspect._pqi_bundle import pqi_log
+from PyQtInspect._pqi_bundle.pqi_compression import NO_COMPRESSION_FLAG, get_codec, get_codec_by_flag
+from PyQtInspect._pqi_bundle.pqi_connect_tools import Transport, get_local_socket_path, is_loopback_host, \
+    is_unix_socket_supported
 from PyQtInspect._pqi_bundle.pqi_contants import DebugInfoHolder, GlobalDebuggerHolder, get_global_debugger, \
     set_global_debugger
 from PyQtInspect._pqi_bundle.pqi_override import overrides
 import json
 
-from PyQtInspect._pqi_bundle.pqi_structures import QWidgetInfo, QWidgetChildrenInfo
+from PyQtInspect._pqi_bundle.pqi_structures import QWidgetInfo, QWidgetChildrenInfo, QWidgetHoverInfo
 from PyQtInspect._pqi_bundle.pqi_typing import OptionalDict
 
 try:
@@ -37,10 +43,13 @@ except:
 
 # CMD_XXX constants imported for backward compatibility
 from PyQtInspect._pqi_bundle.pqi_comm_constants import (
-    ID_TO_MEANING, CMD_EXIT, CMD_WIDGET_INFO, CMD_ENABLE_INSPECT,
+    ID_TO_MEANING, CMD_EXIT, CMD_PROTOCOL_OFFER, CMD_SWITCH_PROTOCOL, CMD_SET_COMPRESSION, CMD_SHARED_MEMORY_ATTACHED,
+    CMD_WIDGET_INFO,
+    CMD_ENABLE_INSPECT,
     CMD_DISABLE_INSPECT, CMD_INSPECT_FINISHED, CMD_EXEC_CODE, CMD_EXEC_CODE_ERROR, CMD_EXEC_CODE_RESULT,
     CMD_SET_WIDGET_HIGHLIGHT, CMD_SELECT_WIDGET, CMD_REQ_WIDGET_INFO, CMD_REQ_CHILDREN_INFO, CMD_CHILDREN_INFO,
     CMD_REQ_CONTROL_TREE, CMD_CONTROL_TREE, CMD_REQ_WIDGET_PROPS, CMD_WIDGET_PROPS, CMD_SETTINGS_CHANGED,
+    CMD_CANCEL_REQUEST, CMD_CONTROL_TREE_DELTA, CMD_ATTACH_PROGRESS, CMD_HOVER_WIDGET,
     # Keys
     TreeViewResultKeys
 )
@@ -50,6 +59,37 @@ MAX_IO_MSG_SIZE = 1000  # if the io is too big, we'll not send all (could make t
 
 VERSION_STRING = "@@BUILD_NUMBER@@"
 
+# Frame header of the binary protocol: cmd id, seq, compression flag and payload length (network byte order).
+# The payload (raw utf-8, NOT quoted, possibly compressed) follows the header directly.
+_BINARY_HEADER = struct.Struct('!IQBI')
+
+# Payloads smaller than this are never compressed, it would cost more time than it saves.
+COMPRESSION_MIN_SIZE = 16 * 1024
+
+# Set in the compression flag of a binary frame when the payload is in the shared-memory ring (local transport),
+# the frame then only carries its position and size.
+SHARED_MEMORY_FLAG = 0x80
+_SHARED_MEMORY_REF = struct.Struct('!QI')
+
+# Payloads smaller than this are sent inline even if a shared-memory ring is available.
+SHARED_MEMORY_MIN_SIZE = 64 * 1024
+
+# The largest command accepted from the peer (a binary frame payload or a quoted line), in bytes.
+# The length of a frame comes from its header: a corrupt or hostile one must not make the reader allocate gigabytes.
+MAX_FRAME_SIZE = 256 * 1024 * 1024
+
+
+class FrameTooLargeError(ConnectionError):
+    """ The peer has sent a command larger than `MAX_FRAME_SIZE`, the connection can't be trusted anymore.
+    A `ConnectionError` so that only the offending connection is closed, like when the peer resets it.
+    """
+
+
+class CoalesceKeys:
+    """The keys of the commands which only matter until a newer command of the same kind is queued."""
+    HOVER_WIDGET_INFO = 'hover-widget-info'
+    ATTACH_PROGRESS = 'attach-progress'
+
 
 class CommunicationRole:
     """The class that contains the constants of roles that `PyDB` can play in
@@ -134,11 +174,33 @@ def run_as_pydevd_daemon_thread(func, *args, **kwargs):
 class ReaderThread(PyDBDaemonThread):
     """ reader thread reads and dispatches commands in an infinite loop """
 
+    # Initial size of the receive buffer, it grows on demand to fit the largest binary frame.
+    READ_BUFFER_SIZE = 64 * 1024
+
     def __init__(self, sock):
         PyDBDaemonThread.__init__(self)
         self.sock = sock
         self.name = "pydevd.Reader"
         self.global_debugger_holder = GlobalDebuggerHolder
+        # The protocol used to decode the incoming stream,
+        # it is changed in place when the peer sends `CMD_SWITCH_PROTOCOL`.
+        self.protocol = NetCommand.QUOTED_LINE_PROTOCOL
+
+        # Receive buffer, the bytes in [_start, _end) are received but not processed yet.
+        self._buf = bytearray(self.READ_BUFFER_SIZE)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+        # For the quoted-line protocol: count of pending bytes already known to contain no line break,
+        # so that a long line received in many chunks is only scanned once.
+        self._scanned = 0
+
+        # The ring the peer puts its large payloads in (local transport only), see `SharedMemoryRing`.
+        self.shared_memory_ring = None
+
+        # The commands parsed from the current read, and the seqs of the requests cancelled by the peer in it.
+        self._received_commands = []
+        self._cancelled_seqs = set()
 
     def do_kill_pydev_thread(self):
         # We must close the socket so that it doesn't stay halted there.
@@ -151,47 +213,185 @@ class ReaderThread(PyDBDaemonThread):
 
     @overrides(PyDBDaemonThread._on_run)
     def _on_run(self):
-        read_buffer = ""
         try:
 
             while not self.killReceived:
                 try:
-                    r = self.sock.recv(1024)
+                    received = self._recv()
                 except:
                     if not self.killReceived:
                         traceback.print_exc()
                         self.handle_except()
                     return  # Finished communication.
 
-                # Note: the java backend is always expected to pass utf-8 encoded strings. We now work with unicode
-                # internally and thus, we may need to convert to the actual encoding where needed (i.e.: filenames
-                # on python 2 may need to be converted to the filesystem encoding).
-                if hasattr(r, 'decode'):
-                    r = r.decode('utf-8')
-
-                read_buffer += r
-                if DebugInfoHolder.DEBUG_RECORD_SOCKET_READS:
-                    pqi_log.debug('Received >>%s<<' % (read_buffer,))
-
-                if len(read_buffer) == 0:
+                if received == 0:
                     self.handle_except()
                     break
-                while read_buffer.find(u'\n') != -1:
-                    command, read_buffer = read_buffer.split(u'\n', 1)
 
-                    args = command.split(u'\t', 2)
-                    try:
-                        cmd_id = int(args[0])
-                        pqi_log.debug('Received command: %s %s\n' % (ID_TO_MEANING.get(str(cmd_id), '???'), command,))
-                        self.process_command(cmd_id, int(args[1]), args[2])
-                    except:
-                        traceback.print_exc()
-                        pqi_log.error("Can't process net command: %s" % command)
+                self._process_buffer()
 
         except:
             traceback.print_exc()
             self.handle_except()
 
+    def read_available(self) -> bool:
+        """ Receive what a non-blocking socket has and process the complete commands,
+        for an event loop which owns the socket instead of this thread.
+
+        :return: False if the peer has closed the connection.
+        """
+        try:
+            received = self._recv()
+        except (BlockingIOError, InterruptedError):
+            return True  # spurious wake-up
+        if received == 0:
+            return False
+        self._process_buffer()
+        return True
+
+    def _recv(self) -> int:
+        if self._end == len(self._buf):
+            self._reserve(self._end - self._start + 1)
+        received = self.sock.recv_into(self._view[self._end:])
+
+        if DebugInfoHolder.DEBUG_RECORD_SOCKET_READS:
+            pqi_log.debug('Received >>%s<<' % (bytes(self._view[self._end:self._end + received]),))
+
+        self._end += received
+        return received
+
+    def _reserve(self, size):
+        """ Make sure that ``size`` bytes from the first unprocessed byte fit in the receive buffer. """
+        if len(self._buf) - self._start >= size:
+            return
+
+        pending = self._end - self._start
+        if size <= len(self._buf):
+            # Enough room, just move the pending bytes to the front (memoryview assignment handles the overlap).
+            self._view[:pending] = self._view[self._start:self._end]
+        else:
+            new_buf = bytearray(max(size, len(self._buf) * 2))
+            new_buf[:pending] = self._view[self._start:self._end]
+            self._view.release()
+            self._buf = new_buf
+            self._view = memoryview(new_buf)
+        self._start, self._end = 0, pending
+
+    def _process_buffer(self):
+        # The protocol may change in the middle of the buffer (after `CMD_SWITCH_PROTOCOL`),
+        # so it is checked again for each command.
+        while self._start < self._end:
+            if self.protocol == NetCommand.BINARY_PROTOCOL:
+                processed = self._process_binary_frame()
+            else:
+                processed = self._process_quoted_line()
+            if not processed:
+                break
+
+        self._dispatch_received_commands()
+
+        if self._start == self._end:
+            self._start = self._end = self._scanned = 0
+
+    def _process_quoted_line(self) -> bool:
+        line_end = self._buf.find(b'\n', self._start + self._scanned, self._end)
+        if line_end == -1:
+            self._scanned = self._end - self._start
+            if self._scanned > MAX_FRAME_SIZE:
+                raise FrameTooLargeError('Received a line longer than %s bytes' % MAX_FRAME_SIZE)
+            return False
+
+        command = str(self._view[self._start:line_end], 'utf-8')
+        self._start = line_end + 1
+        self._scanned = 0
+
+        try:
+            args = command.split(u'\t', 2)
+            self._receive_command(int(args[0]), int(args[1]), unquote(args[2]))
+        except:
+            traceback.print_exc()
+            pqi_log.error("Can't process net command: %s" % command)
+        return True
+
+    def _process_binary_frame(self) -> bool:
+        header_size = _BINARY_HEADER.size
+        available = self._end - self._start
+        if available < header_size:
+            self._reserve(header_size)
+            return False
+
+        cmd_id, seq, compression_flag, length = _BINARY_HEADER.unpack_from(self._buf, self._start)
+        if length > MAX_FRAME_SIZE:
+            raise FrameTooLargeError('Received a frame of %s bytes (%s), the limit is %s bytes' % (
+                length, ID_TO_MEANING.get(str(cmd_id), cmd_id), MAX_FRAME_SIZE))
+        if available < header_size + length:
+            self._reserve(header_size + length)
+            return False
+
+        payload_start = self._start + header_size
+        self._start = payload_start + length
+
+        try:
+            payload = self._view[payload_start:self._start]
+            if compression_flag == SHARED_MEMORY_FLAG:
+                text = self._read_shared_memory(payload)
+            else:
+                if compression_flag != NO_COMPRESSION_FLAG:
+                    payload = self._decompress(cmd_id, compression_flag, payload)
+                text = str(payload, 'utf-8')
+            self._receive_command(cmd_id, seq, text)
+        except:
+            traceback.print_exc()
+            pqi_log.error("Can't process net command: %s (seq: %s)" % (ID_TO_MEANING.get(str(cmd_id), cmd_id), seq))
+        return True
+
+    def _read_shared_memory(self, ref) -> str:
+        pos, size = _SHARED_MEMORY_REF.unpack(ref)
+        view = self.shared_memory_ring.read(pos, size)
+        try:
+            return str(view, 'utf-8')
+        finally:
+            view.release()
+            self.shared_memory_ring.release(pos + size)
+
+    @staticmethod
+    def _decompress(cmd_id, compression_flag, payload) -> bytes:
+        codec = get_codec_by_flag(compression_flag)
+        begin = time.perf_counter()
+        decompressed = codec.decompress(payload)
+        pqi_log.debug('Decompressed %s with %s: %s -> %s bytes in %.2f ms' % (
+            ID_TO_MEANING.get(str(cmd_id), '???'), codec.name, len(payload), len(decompressed),
+            (time.perf_counter() - begin) * 1000))
+        return decompressed
+
+    def _receive_command(self, cmd_id, seq, text):
+        pqi_log.debug('Received command: %s, seq: %s, size: %s\n' % (ID_TO_MEANING.get(str(cmd_id), '???'), seq, len(text)))
+        if cmd_id == CMD_SWITCH_PROTOCOL:
+            # The peer encodes everything after this command with the new protocol.
+            self.protocol = text
+        elif cmd_id == CMD_CANCEL_REQUEST:
+            self._cancelled_seqs.add(int(text))
+            return
+        self._received_commands.append((cmd_id, seq, text))
+
+    def _dispatch_received_commands(self):
+        """ Process the commands parsed from the last read.
+
+        The whole read is parsed first, so a request which has been superseded in the meantime
+        (cancelled by a `CMD_CANCEL_REQUEST` received in the same read) is skipped before any work is done for it.
+        """
+        received, self._received_commands = self._received_commands, []
+        cancelled, self._cancelled_seqs = self._cancelled_seqs, set()
+        for cmd_id, seq, text in received:
+            if seq in cancelled:
+                pqi_log.debug('Skipping the cancelled command: %s, seq: %s' % (ID_TO_MEANING.get(str(cmd_id), '???'), seq))
+                continue
+            try:
+                self.process_command(cmd_id, seq, text)
+            except:
+                traceback.print_exc()
+                pqi_log.error("Can't process net command: %s (seq: %s)" % (ID_TO_MEANING.get(str(cmd_id), cmd_id), seq))
+
     def handle_except(self):
         self.global_debugger_holder.global_dbg.finish_debugging_session()
 
@@ -199,61 +399,268 @@ class ReaderThread(PyDBDaemonThread):
         self.process_net_command(self.global_debugger_holder.global_dbg, cmd_id, seq, text)
 
     def process_net_command(self, global_dbg, cmd_id, seq, text):
+        """ Process a command received from the server, ``text`` is already decoded. """
         if global_dbg is None:
             return
-        if cmd_id == CMD_ENABLE_INSPECT:
-            extra = json.loads(unquote(text))
+        if cmd_id == CMD_SWITCH_PROTOCOL:
+            global_dbg.on_protocol_switched(text)
+        elif cmd_id == CMD_SET_COMPRESSION:
+            global_dbg.on_compression_negotiated(text)
+        elif cmd_id == CMD_SHARED_MEMORY_ATTACHED:
+            global_dbg.on_shared_memory_attached(text)
+        elif cmd_id == CMD_ENABLE_INSPECT:
+            extra = json.loads(text)
             global_dbg.enable_inspect(extra)
         elif cmd_id == CMD_DISABLE_INSPECT:
             global_dbg.disable_inspect()
         elif cmd_id == CMD_EXEC_CODE:
-            code = unquote(text)
-            global_dbg.exec_code_in_selected_widget(code)
+            global_dbg.exec_code_in_selected_widget(text)
         elif cmd_id == CMD_SET_WIDGET_HIGHLIGHT:
-            jsonMsg = json.loads(unquote(text))
+            jsonMsg = json.loads(text)
             widget_id, is_highlight = jsonMsg['widget_id'], jsonMsg['is_highlight']
             global_dbg.set_widget_highlight_by_id(widget_id, is_highlight)
         elif cmd_id == CMD_SELECT_WIDGET:
-            widget_id = int(unquote(text))
+            widget_id = int(text)
             global_dbg.select_widget_by_id(widget_id)
+        # The replies to the requests echo their seq
         elif cmd_id == CMD_REQ_WIDGET_INFO:
-            jsonMsg = json.loads(unquote(text))
+            jsonMsg = json.loads(text)
             widget_id, extra = jsonMsg['widget_id'], jsonMsg['extra']
-            global_dbg.notify_widget_info(widget_id, extra)
+            global_dbg.notify_widget_info(widget_id, extra, seq)
         elif cmd_id == CMD_REQ_CHILDREN_INFO:
-            widget_id = int(unquote(text))
-            global_dbg.notify_children_info(widget_id)
+            widget_id = int(text)
+            global_dbg.notify_children_info(widget_id, seq)
         elif cmd_id == CMD_REQ_CONTROL_TREE:
-            extra = json.loads(unquote(text))
-            global_dbg.notify_control_tree(extra)
+            extra = json.loads(text)
+            global_dbg.notify_control_tree(extra, seq)
         elif cmd_id == CMD_REQ_WIDGET_PROPS:
-            widget_id = int(unquote(text))
-            global_dbg.notify_widget_props(widget_id)
+            widget_id = int(text)
+            global_dbg.notify_widget_props(widget_id, seq)
         elif cmd_id == CMD_SETTINGS_CHANGED:
-            settings = json.loads(unquote(text))
+            settings = json.loads(text)
             global_dbg.on_settings_changed(settings)
 
 
-
 # ----------------------------------------------------------------------------------- SOCKET UTILITIES - WRITER
 # =======================================================================================================================
 # WriterThread
 # =======================================================================================================================
+class DropPolicy:
+    """What `WriterThread.add_command` does when the command queue is full."""
+    # Discard the oldest queued command to make room for the new one.
+    DROP_OLDEST = 'drop-oldest'
+    # Discard the new command.
+    DROP_NEWEST = 'drop-newest'
+    # Wait until the writer makes room (never use it when commands are added from the GUI thread).
+    BLOCK = 'block'
+
+    ALL = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+
+def convert_drop_policy(policy: str) -> str:
+    """Validate a drop policy read from the command line."""
+    policy = policy.lower()
+    if policy not in DropPolicy.ALL:
+        raise ValueError(f'Invalid writer drop policy: {policy}, expected one of {DropPolicy.ALL}')
+    return policy
+
+
+# Commands which keep the connection itself working, or the tree of the server in sync with the client:
+# they are never dropped nor counted in the queue bound.
+_ESSENTIAL_COMMANDS = frozenset((CMD_EXIT, CMD_PROTOCOL_OFFER, CMD_SWITCH_PROTOCOL, CMD_SET_COMPRESSION,
+                                 CMD_SHARED_MEMORY_ATTACHED, CMD_CONTROL_TREE_DELTA))
+
+
+class _CommandQueue:
+    """A bounded FIFO of `NetCommand` which coalesces superseded commands.
+
+    When a command with a ``coalesce_key`` is added, a queued command with the same key
+    becomes stale and is skipped by `get`, so only the latest one of its kind is sent.
+    The stale commands are compacted away once they make up half of the queue,
+    so that the queue stays bounded when the socket stalls while the superseding commands keep coming.
+    """
+
+    # The stale commands are only compacted past this count, compacting a short queue isn't worth it
+    MIN_STALE_TO_COMPACT = 32
+
+    def __init__(self, maxsize: int, drop_policy: str):
+        self._maxsize = maxsize  # <= 0 means unbounded
+        self._drop_policy = drop_policy
+        self._commands = collections.deque()
+        self._latest_by_key = {}  # coalesce key -> latest queued command with this key
+        self._bounded_count = 0  # number of queued commands which are not essential
+        self._stale_count = 0  # number of queued commands superseded by a newer one, not removed yet
+        self._cond = threading.Condition(threading.Lock())
+
+        self.dropped_count = 0
+        self.coalesced_count = 0
+
+    def put(self, cmd):
+        with self._cond:
+            key = cmd.coalesce_key
+            superseded = self._latest_by_key.get(key) if key is not None else None
+            essential = cmd.id in _ESSENTIAL_COMMANDS
+            if superseded is not None:
+                # The superseded command stays in the deque but `get` skips it,
+                # the new command takes its slot.
+                self.coalesced_count += 1
+                self._stale_count += 1
+            elif not essential:
+                if 0 < self._maxsize <= self._bounded_count and not self._make_room():
+                    return
+                self._bounded_count += 1
+            if key is not None:
+                self._latest_by_key[key] = cmd
+            self._commands.append(cmd)
+            if self._stale_count > self.MIN_STALE_TO_COMPACT and self._stale_count * 2 > len(self._commands):
+                self._compact()
+            self._cond.notify()
+
+    def _compact(self):
+        """Called with the lock held, remove the stale commands."""
+        self._commands = collections.deque(cmd for cmd in self._commands if self._is_live(cmd))
+        self._stale_count = 0
+
+    def _make_room(self) -> bool:
+        """Called with the lock held when the queue is full, return whether the new command can be queued."""
+        if self._drop_policy == DropPolicy.BLOCK:
+            while 0 < self._maxsize <= self._bounded_count:
+                self._cond.wait()
+            return True
+
+        self.dropped_count += 1
+        if self._drop_policy == DropPolicy.DROP_NEWEST:
+            return False
+
+        # DROP_OLDEST: discard the oldest live command which is not essential
+        for i, cmd in enumerate(self._commands):
+            if cmd.id in _ESSENTIAL_COMMANDS or not self._is_live(cmd):
+                continue
+            del self._commands[i]
+            if cmd.coalesce_key is not None:
+                del self._latest_by_key[cmd.coalesce_key]
+            self._bounded_count -= 1
+            break
+        return True
+
+    def _is_live(self, cmd) -> bool:
+        return cmd.coalesce_key is None or self._latest_by_key.get(cmd.coalesce_key) is cmd
+
+    def get(self, timeout):
+        """Pop the next command to send, waiting at most ``timeout`` seconds, raise `queue.Empty` on timeout."""
+        with self._cond:
+            while True:
+                while self._commands:
+                    cmd = self._commands.popleft()
+                    if not self._is_live(cmd):
+                        self._stale_count -= 1
+                        continue  # superseded by a newer command of the same kind
+                    if cmd.coalesce_key is not None:
+                        del self._latest_by_key[cmd.coalesce_key]
+                    if cmd.id not in _ESSENTIAL_COMMANDS:
+                        self._bounded_count -= 1
+                        self._cond.notify()  # wake up a producer blocked by the `BLOCK` policy
+                    return cmd
+                if timeout is not None and timeout <= 0:
+                    raise queue.Empty
+                if not self._cond.wait(timeout):
+                    raise queue.Empty
+                timeout = 0  # woken up, don't wait again if the command has been taken by someone else
+
+    def get_nowait(self):
+        return self.get(0)
+
+    def empty(self) -> bool:
+        with self._cond:
+            return not any(self._is_live(cmd) for cmd in self._commands)
+
+
 class WriterThread(PyDBDaemonThread):
     """ writer thread writes out the commands in an infinite loop """
 
-    def __init__(self, sock):
+    # Default bound of the command queue, see `DropPolicy`.
+    DEFAULT_MAX_QUEUE_SIZE = 1024
+
+    # The commands queued at the same time are written with a single `sendall`,
+    # until the batch reaches this size.
+    MAX_BATCH_BYTES = 256 * 1024
+
+    def __init__(self, sock, max_queue_size=DEFAULT_MAX_QUEUE_SIZE, drop_policy=DropPolicy.DROP_OLDEST):
         PyDBDaemonThread.__init__(self)
         self.sock = sock
         self.name = "pydevd.Writer"
-        self.cmdQueue = queue.Queue()
-        self.timeout = 0
+        self.cmdQueue = _CommandQueue(max_queue_size, drop_policy)
+        # The protocol used to encode the outgoing commands, see `switch_protocol`.
+        self.protocol = NetCommand.QUOTED_LINE_PROTOCOL
+        self._requested_protocol = self.protocol
+        # The codec used to compress large payloads (binary protocol only), see `set_compression`.
+        self.compression_codec = None
+        # The ring to put large payloads in (binary protocol and local transport only), see `set_shared_memory`.
+        self.shared_memory_ring = None
 
     def add_command(self, cmd):
         """ cmd is NetCommand """
         if not self.killReceived:  # we don't take new data after everybody die
             self.cmdQueue.put(cmd)
 
+    def switch_protocol(self, protocol):
+        """ Switch the outgoing stream to ``protocol``.
+
+        A `CMD_SWITCH_PROTOCOL` command is queued (and still encoded with the current protocol),
+        the commands queued after it are encoded with the new protocol.
+        Calling it again with the same protocol is a no-op, so both peers can simply echo the switch.
+        """
+        if protocol == self._requested_protocol:
+            return
+        self._requested_protocol = protocol
+        self.add_command(NetCommand(CMD_SWITCH_PROTOCOL, 0, protocol))
+
+    def set_compression(self, compression):
+        """ Compress the large payloads with the negotiated ``compression`` from now on (None to disable).
+        Each binary frame carries its own compression flag, so the peer needs no synchronization point.
+        """
+        self.compression_codec = get_codec(compression)
+
+    def set_shared_memory(self, ring):
+        """ Put the large payloads in ``ring`` (a `SharedMemoryRing` the peer has attached to) from now on. """
+        self.shared_memory_ring = ring
+
+    def encode_queued(self):
+        """ Encode the queued commands without waiting, for an event loop which owns the socket instead of this thread.
+        :return: (the bytes to send, empty if nothing is queued, whether `CMD_EXIT` is encoded)
+        """
+        try:
+            cmd = self.cmdQueue.get_nowait()
+        except queue.Empty:
+            return b'', False
+        return self._encode_batch(cmd)
+
+    def _encode_batch(self, first_cmd):
+        """ Encode ``first_cmd`` and the commands already queued after it.
+        :return: (the bytes to send, whether `CMD_EXIT` is in the batch)
+        """
+        chunks = []
+        batch_size = 0
+        cmd = first_cmd
+        while True:
+            as_bytes = cmd.to_bytes(self.protocol, self.compression_codec, self.shared_memory_ring)
+            chunks.append(as_bytes)
+            batch_size += len(as_bytes)
+
+            if cmd.id == CMD_SWITCH_PROTOCOL:
+                # The following commands of the batch are encoded with the new protocol.
+                self.protocol = cmd.text
+            elif cmd.id == CMD_EXIT:
+                return b''.join(chunks), True
+
+            if batch_size >= self.MAX_BATCH_BYTES:
+                break
+            try:
+                cmd = self.cmdQueue.get_nowait()
+            except queue.Empty:
+                break
+        return b''.join(chunks), False
+
     @overrides(PyDBDaemonThread._on_run)
     def _on_run(self):
         """ just loop and write responses """
@@ -262,7 +669,7 @@ class WriterThread(PyDBDaemonThread):
             while True:
                 try:
                     try:
-                        cmd = self.cmdQueue.get(1, 0.1)
+                        cmd = self.cmdQueue.get(0.1)
                     except queue.Empty:
                         if self.killReceived:
                             try:
@@ -279,13 +686,13 @@ class WriterThread(PyDBDaemonThread):
                     # when liberating the thread here, we could have errors because we were shutting down
                     # but the thread was still not liberated
                     return
-                cmd.send(self.sock)
+                as_bytes, exit_requested = self._encode_batch(cmd)
+                self.sock.sendall(as_bytes)
 
-                if cmd.id == CMD_EXIT:
+                if exit_requested:
                     break
                 if time is None:
                     break  # interpreter shutdown
-                time.sleep(self.timeout)
         except Exception:
             GlobalDebuggerHolder.global_dbg.finish_debugging_session()
             pqi_log.error('Error in writer thread', exc_info=True)
@@ -293,14 +700,100 @@ class WriterThread(PyDBDaemonThread):
     def empty(self):
         return self.cmdQueue.empty()
 
+    @property
+    def dropped_count(self) -> int:
+        """ The number of commands dropped because the queue was full. """
+        return self.cmdQueue.dropped_count
+
+    @property
+    def coalesced_count(self) -> int:
+        """ The number of commands skipped because a newer command of the same kind was queued. """
+        return self.cmdQueue.coalesced_count
+
 
 # --------------------------------------------------- CREATING THE SOCKET THREADS
 
 # =======================================================================================================================
 # start_server
 # =======================================================================================================================
-def start_server(port, *, output_errors=True):
+# the (device, inode) of the paths bound by `create_local_server_socket`, to remove only our own
+_local_socket_path_ids = {}  # type: typing.Dict[str, typing.Tuple[int, int]]
+
+
+def _is_stale_local_socket_path(path) -> bool:
+    """ Whether ``path`` is left by a server which has not exited cleanly, i.e. nothing listens on it any more. """
+    from socket import AF_UNIX
+
+    with socket(AF_UNIX, SOCK_STREAM) as probe:
+        probe.settimeout(1)
+        try:
+            probe.connect(path)
+        except ConnectionRefusedError:
+            return True
+        except OSError:
+            return False  # e.g. a timeout: a server may still listen on it
+    return False
+
+
+def create_local_server_socket(port):
+    """ Create the Unix domain socket listening besides the TCP ``port`` (see `get_local_socket_path`).
+
+    A path left by a crashed server is replaced, but the path of a server still listening is left alone.
+    :return: the listening socket, or None if Unix domain sockets are not supported or the path can't be bound.
+    """
+    if not is_unix_socket_supported():
+        return None
+    from socket import AF_UNIX
+
+    path = get_local_socket_path(port)
+    if os.path.exists(path):
+        if not _is_stale_local_socket_path(path):
+            pqi_log.warning(f'{path} is used by another server, only TCP is available.')
+            return None
+        try:
+            os.unlink(path)
+        except OSError:
+            pass  # removed by another server in the meantime, `bind` tells whether it took the path
+    s = socket(AF_UNIX, SOCK_STREAM)
+    try:
+        s.bind(path)
+        s.listen(16)
+        stat = os.stat(path)
+    except OSError:
+        pqi_log.warning(f'Could not listen on {path}, only TCP is available.', exc_info=True)
+        s.close()
+        return None
+    _local_socket_path_ids[path] = (stat.st_dev, stat.st_ino)
+    pqi_log.info("Listening on " + path)
+    return s
+
+
+def close_local_server_socket(s):
+    """ Close a socket created by `create_local_server_socket` and remove its path,
+    unless the path has been replaced by another server since.
+    """
+    path = s.getsockname()
+    s.close()
+    path_id = _local_socket_path_ids.pop(path, None)
+    try:
+        stat = os.stat(path)
+        if (stat.st_dev, stat.st_ino) == path_id:
+            os.unlink(path)
+    except OSError:
+        pass
+
+
+def start_server(port, *, output_errors=True, transport=Transport.TCP):
     """ binds to a port, waits for the debugger to connect """
+    if transport == Transport.UNIX:
+        s = create_local_server_socket(port)
+        if s is None:
+            raise OSError(f'Could not listen on {get_local_socket_path(port)}')
+        newSock, _addr = s.accept()
+        pqi_log.info("Connection accepted")
+        close_local_server_socket(s)
+        return newSock
+
     s = socket(AF_INET, SOCK_STREAM)
     s.settimeout(None)
 
@@ -331,8 +824,49 @@ def start_server(port, *, output_errors=True):
 # =======================================================================================================================
 # start_client
 # =======================================================================================================================
-def start_client(host, port, *, output_errors=True):
-    """ connects to a host/port """
+def _start_local_client(port):
+    """ connects to the Unix domain socket of a server on the same host """
+    from socket import AF_UNIX
+
+    path = get_local_socket_path(port)
+    s = socket(AF_UNIX, SOCK_STREAM)
+    if hasattr(s, 'set_inheritable'):
+        s.set_inheritable(True)
+    try:
+        s.settimeout(10)
+        s.connect(path)
+        s.settimeout(None)
+    except:
+        s.close()
+        raise
+    pqi_log.info(f"Connected to {path}.")
+    return s
+
+
+def is_local_socket(s) -> bool:
+    """ Whether ``s`` is a Unix domain socket, i.e. the peer is on the same host. """
+    if not is_unix_socket_supported():
+        return False
+    from socket import AF_UNIX
+    return s.family == AF_UNIX
+
+
+def start_client(host, port, *, output_errors=True, transport=Transport.TCP):
+    """ connects to a host/port
+
+    With the `Transport.AUTO` transport, the Unix domain socket of a server on the same host is preferred,
+    falling back to TCP if the server doesn't listen on it (e.g. an older server).
+    """
+    if transport != Transport.TCP and is_loopback_host(host) and is_unix_socket_supported():
+        try:
+            return _start_local_client(port)
+        except:
+            if transport == Transport.UNIX:
+                if output_errors:
+                    pqi_log.error(f'Could not connect to {get_local_socket_path(port)}', exc_info=True)
+                raise
+            pqi_log.debug(f'Could not connect to {get_local_socket_path(port)}, falling back to TCP.')
+
     pqi_log.info(f"Connecting to {host}:{port}")
 
     s = socket(AF_INET, SOCK_STREAM)
@@ -378,6 +912,9 @@ class NetCommand:
     or one to be sent by daemon.
     """
     next_seq = 0  # sequence numbers
+    # The commands are created by several threads (GUI, readers, timeouts) and the seqs key the pending requests:
+    # a seq must never be handed out twice.
+    _seq_lock = threading.Lock()
 
     # Protocol where each line is a new message (text is quoted to prevent new lines).
     QUOTED_LINE_PROTOCOL = 'quoted-line'
@@ -386,44 +923,92 @@ class NetCommand:
     # i.e.: Content-Length:xxx\r\n\r\npayload
     HTTP_PROTOCOL = 'http'
 
+    # Length-prefixed frames: a fixed header (see `_BINARY_HEADER`) followed by the raw utf-8 payload.
+    # It must be negotiated after connecting (see `CMD_PROTOCOL_OFFER`).
+    BINARY_PROTOCOL = 'binary'
+
     protocol = QUOTED_LINE_PROTOCOL
 
     _showing_debug_info = 0
     _show_debug_info_lock = threading.RLock()
 
-    def __init__(self, cmd_id, seq, text):
+    def __init__(self, cmd_id, seq, text, coalesce_key=None):
         """
         If sequence is 0, new sequence will be generated (otherwise, this was the response
         to a command from the client).
+
+        :param coalesce_key: if not None, the command is skipped by the writer when a newer command
+            with the same key is queued before it is sent (e.g. the info of the hovered widget).
         """
         self.id = cmd_id
+        self.coalesce_key = coalesce_key
         if seq == 0:
-            NetCommand.next_seq += 2
-            seq = NetCommand.next_seq
+            with NetCommand._seq_lock:
+                NetCommand.next_seq += 2
+                seq = NetCommand.next_seq
         self.seq = seq
 
         assert isinstance(text, str)
+        self.text = text
 
         self._show_debug_info(cmd_id, seq, text)
 
-        if self.protocol == self.HTTP_PROTOCOL:
-            msg = '%s\t%s\t%s\n' % (cmd_id, seq, text)
-        else:
-            encoded = quote(str(text), '/<>_=" \t')
-            msg = '%s\t%s\t%s\n' % (cmd_id, seq, encoded)
+    def to_bytes(self, protocol=None, compression_codec=None, shared_memory_ring=None) -> bytes:
+        """ Encode the command with the given protocol (the class-level `protocol` by default).
+
+        :param compression_codec: if given, the payloads larger than `COMPRESSION_MIN_SIZE` are compressed with it.
+            Only the binary protocol supports compression.
+        :param shared_memory_ring: if given, the payloads larger than `SHARED_MEMORY_MIN_SIZE` are put in it
+            when it has room. Only the binary protocol supports it.
+        """
+        if protocol is None:
+            protocol = self.protocol
+
+        if protocol == self.BINARY_PROTOCOL:
+            payload = self.text.encode('utf-8')
+            if shared_memory_ring is not None and len(payload) >= SHARED_MEMORY_MIN_SIZE:
+                pos = shared_memory_ring.put(payload)
+                if pos is not None:
+                    ref = _SHARED_MEMORY_REF.pack(pos, len(payload))
+                    return b''.join((_BINARY_HEADER.pack(self.id, self.seq, SHARED_MEMORY_FLAG, len(ref)), ref))
+
+            compression_flag = NO_COMPRESSION_FLAG
+            if compression_codec is not None and len(payload) >= COMPRESSION_MIN_SIZE:
+                begin = time.perf_counter()
+                compressed = compression_codec.compress(payload)
+                pqi_log.debug('Compressed %s with %s: %s -> %s bytes (ratio %.2f) in %.2f ms' % (
+                    ID_TO_MEANING.get(str(self.id), 'UNKNOWN'), compression_codec.name, len(payload), len(compressed),
+                    len(payload) / max(len(compressed), 1), (time.perf_counter() - begin) * 1000))
+                if len(compressed) < len(payload):
+                    payload, compression_flag = compressed, compression_codec.flag
+            return b''.join((_BINARY_HEADER.pack(self.id, self.seq, compression_flag, len(payload)), payload))
+
+        if protocol == self.HTTP_PROTOCOL:
+            msg = ('%s\t%s\t%s\n' % (self.id, self.seq, self.text)).encode('utf-8')
+            return b''.join((('Content-Length: %s\r\n\r\n' % len(msg)).encode('ascii'), msg))
+
+        encoded = quote(self.text, '/<>_=" \t')
+        msg = '%s\t%s\t%s\n' % (self.id, self.seq, encoded)
+        return msg.encode('utf-8')
+
+    def send(self, sock, protocol=None, compression_codec=None, shared_memory_ring=None):
+        sock.sendall(self.to_bytes(protocol, compression_codec, shared_memory_ring))
 
-        if isinstance(msg, str):
-            msg = msg.encode('utf-8')
-        assert isinstance(msg, bytes)
-        as_bytes = msg
-        self._as_bytes = as_bytes
+    @classmethod
+    def use_odd_seqs(cls):
+        """ Generate odd seqs from now on, the peer generates even ones.
 
-    def send(self, sock):
-        as_bytes = self._as_bytes
-        if self.protocol == self.HTTP_PROTOCOL:
-            sock.sendall(('Content-Length: %s\r\n\r\n' % len(as_bytes)).encode('ascii'))
+        A reply echoes the seq of its request, so with disjoint seqs it can't be mistaken
+        for a command initiated by the peer. It is called by the server.
+        """
+        with cls._seq_lock:
+            if cls.next_seq % 2 == 0:
+                cls.next_seq += 1
 
-        sock.sendall(as_bytes)
+    @classmethod
+    def is_own_seq(cls, seq) -> bool:
+        """ Whether ``seq`` has been generated by this side. """
+        return seq % 2 == cls.next_seq % 2
 
     @classmethod
     def _show_debug_info(cls, cmd_id, seq, text):
@@ -451,6 +1036,20 @@ class NetCommand:
         #         cls._showing_debug_info -= 1
 
 
+# Protocols which can be negotiated after connecting, from the most preferred to the least preferred.
+NEGOTIABLE_PROTOCOLS = (NetCommand.BINARY_PROTOCOL, NetCommand.QUOTED_LINE_PROTOCOL)
+
+
+def choose_protocol(offered_protocols) -> str:
+    """ Choose the protocol to use from the protocols offered by the peer.
+    Falls back to the quoted-line protocol, which is always supported.
+    """
+    for protocol in NEGOTIABLE_PROTOCOLS:
+        if protocol in offered_protocols:
+            return protocol
+    return NetCommand.QUOTED_LINE_PROTOCOL
+
+
 # # =======================================================================================================================
 # # NetCommandFactory
 # # =======================================================================================================================
@@ -464,13 +1063,38 @@ class NetCommandFactory:
     def make_json(self, **kwargs):
         return self._dump_json(kwargs)
 
+    def make_protocol_offer_message(self, protocols: typing.Sequence[str] = NEGOTIABLE_PROTOCOLS,
+                                    compressions: typing.Sequence[str] = (),
+                                    shared_memory: typing.Optional[str] = None):
+        offer = self.make_dict(
+            protocols=list(protocols),
+            compressions=list(compressions),
+        )
+        if shared_memory is not None:
+            offer['shared_memory'] = shared_memory  # the name of the ring the large payloads may be put in
+        return NetCommand(CMD_PROTOCOL_OFFER, 0, self._dump_json(offer))
+
+    def make_set_compression_message(self, compression: str):
+        return NetCommand(CMD_SET_COMPRESSION, 0, compression)
+
+    def make_shared_memory_attached_message(self, name: str):
+        return NetCommand(CMD_SHARED_MEMORY_ATTACHED, 0, name)
+
     def make_widget_info_message(self,
-                                 widget_info: QWidgetInfo):
-        cmd = NetCommand(CMD_WIDGET_INFO, 0, self.make_json(
+                                 widget_info: QWidgetInfo,
+                                 coalesce_key: typing.Optional[str] = None,
+                                 seq: int = 0):
+        cmd = NetCommand(CMD_WIDGET_INFO, seq, self.make_json(
             **dataclasses.asdict(widget_info)
-        ))
+        ), coalesce_key)
         return cmd
 
+    def make_hover_widget_message(self, hover_info: QWidgetHoverInfo):
+        # Superseded by the next hovered widget, like the full info of a hovered widget
+        return NetCommand(CMD_HOVER_WIDGET, 0, self.make_json(
+            **dataclasses.asdict(hover_info)
+        ), CoalesceKeys.HOVER_WIDGET_INFO)
+
     def make_exec_code_message(self, code: str):
         cmd = NetCommand(CMD_EXEC_CODE, 0, code)
         return cmd
@@ -514,8 +1138,8 @@ class NetCommandFactory:
     def make_req_children_info_message(self, widget_id: int):
         return NetCommand(CMD_REQ_CHILDREN_INFO, 0, str(widget_id))
 
-    def make_children_info_message(self, children_info: QWidgetChildrenInfo):
-        return NetCommand(CMD_CHILDREN_INFO, 0, self.make_json(
+    def make_children_info_message(self, children_info: QWidgetChildrenInfo, seq: int = 0):
+        return NetCommand(CMD_CHILDREN_INFO, seq, self.make_json(
             **dataclasses.asdict(children_info)
         ))
 
@@ -524,21 +1148,35 @@ class NetCommandFactory:
             extra = {}
         return NetCommand(CMD_REQ_CONTROL_TREE, 0, self._dump_json(extra))
 
-    def make_control_tree_message(self, control_tree: typing.List[typing.Dict], extra: typing.Dict):
-        return NetCommand(CMD_CONTROL_TREE, 0, self._dump_json({
+    def make_control_tree_message(self, control_tree: typing.List[typing.Dict], extra: typing.Dict, seq: int = 0):
+        return NetCommand(CMD_CONTROL_TREE, seq, self._dump_json({
             TreeViewResultKeys.TREE_INFO_KEY: control_tree,
             TreeViewResultKeys.EXTRA_KEY: extra,
         }))
 
+    def make_control_tree_delta_message(self, ops: typing.List[list]):
+        return NetCommand(CMD_CONTROL_TREE_DELTA, 0, self._dump_json(ops))
+
     def make_req_widget_props_message(self, widget_id: int):
         return NetCommand(CMD_REQ_WIDGET_PROPS, 0, str(widget_id))
 
-    def make_widget_props_message(self, widget_props: typing.List[typing.Dict]):
-        return NetCommand(CMD_WIDGET_PROPS, 0, self._dump_json(widget_props))
+    def make_widget_props_message(self, widget_props: typing.List[typing.Dict], seq: int = 0):
+        return NetCommand(CMD_WIDGET_PROPS, seq, self._dump_json(widget_props))
 
     def make_settings_changed_message(self, settings: dict):
         return NetCommand(CMD_SETTINGS_CHANGED, 0, self._dump_json(settings))
 
+    def make_cancel_request_message(self, seq: int):
+        return NetCommand(CMD_CANCEL_REQUEST, 0, str(seq))
+
+    def make_attach_progress_message(self, pid: int, patched: int, total: int, done: bool):
+        return NetCommand(CMD_ATTACH_PROGRESS, 0, self.make_json(
+            pid=pid,
+            patched=patched,
+            total=total,
+            done=done,
+        ), CoalesceKeys.ATTACH_PROGRESS)
+
     def make_exit_message(self):
         return NetCommand(CMD_EXIT, 0, '')
 
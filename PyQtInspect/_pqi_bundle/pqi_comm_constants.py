@@ -8,6 +8,11 @@
 CMD_EXIT = 129
 
 CMD_PROCESS_CREATED = 149
+# Transport negotiation (always sent with the quoted-line protocol)
+CMD_PROTOCOL_OFFER = 150
+CMD_SWITCH_PROTOCOL = 151
+CMD_SET_COMPRESSION = 152
+CMD_SHARED_MEMORY_ATTACHED = 153
 
 # === QT PATCH SUCCESS ===
 CMD_QT_PATCH_SUCCESS = 1000
@@ -35,10 +40,26 @@ CMD_REQ_WIDGET_PROPS = 1016
 CMD_WIDGET_PROPS = 1017
 # === SETTINGS SYNC ===
 CMD_SETTINGS_CHANGED = 1018
+# === REQUESTS ===
+# Skip the request with the given seq if it has not been processed yet
+CMD_CANCEL_REQUEST = 1019
+# === CONTROL TREE CHANGES ===
+# The changes of the control tree sent to the server, pushed by the client
+CMD_CONTROL_TREE_DELTA = 1020
+# === ATTACH ===
+# The progress of patching the widgets existing when attached
+CMD_ATTACH_PROGRESS = 1021
+# === HOVER ===
+# The lightweight info of the widget under the cursor, sent while the cursor moves in inspect mode
+CMD_HOVER_WIDGET = 1022
 
 ID_TO_MEANING = {
     '129': 'CMD_EXIT',
     '149': 'CMD_PROCESS_CREATED',
+    '150': 'CMD_PROTOCOL_OFFER',
+    '151': 'CMD_SWITCH_PROTOCOL',
+    '152': 'CMD_SET_COMPRESSION',
+    '153': 'CMD_SHARED_MEMORY_ATTACHED',
     '1000': 'CMD_QT_PATCH_SUCCESS',
     '1001': 'CMD_WIDGET_INFO',
     '1002': 'CMD_ENABLE_INSPECT',
@@ -57,6 +78,10 @@ ID_TO_MEANING = {
     '1016': 'CMD_REQ_WIDGET_PROPS',
     '1017': 'CMD_WIDGET_PROPS',
     '1018': 'CMD_SETTINGS_CHANGED',
+    '1019': 'CMD_CANCEL_REQUEST',
+    '1020': 'CMD_CONTROL_TREE_DELTA',
+    '1021': 'CMD_ATTACH_PROGRESS',
+    '1022': 'CMD_HOVER_WIDGET',
 }
 
 # === Tree Views ===
@@ -64,8 +89,8 @@ class TreeViewKeys:
     OBJ_ID_KEY = 'i'
     OBJ_NAME_KEY = 'n'
     OBJ_CLS_NAME_KEY = 'c'
-    CHILDREN_KEY = 'ch'
-    CHILD_CNT_KEY = 'cc'
+    CHILDREN_KEY = 'ch'  # omitted if the children are not fetched yet
+    CHILD_CNT_KEY = 'cc'  # the number of direct children
 
 class TreeViewResultKeys:
     TREE_INFO_KEY = 't'
@@ -73,6 +98,15 @@ class TreeViewResultKeys:
 
 class TreeViewExtraKeys:
     CURRENT_WIDGET_ID = 'c'
+    ROOT_ID = 'r'  # the node whose subtree is requested, the whole tree if absent
+    DEPTH = 'd'  # the number of levels requested, all of them if absent
+
+class DeltaOps:
+    """ The operations of `CMD_CONTROL_TREE_DELTA`, applied in order. """
+    ADD = 'a'  # ['a', parent id, next sibling id, node info]
+    REMOVE = 'r'  # ['r', node id]
+    MOVE = 'm'  # ['m', node id, new parent id, next sibling id]
+    # The parent id is None for the top-level widgets, the next sibling id is None to append
 
 # === Widget Props ===
 class WidgetPropsKeys:
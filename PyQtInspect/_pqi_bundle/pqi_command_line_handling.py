@@ -4,6 +4,10 @@
 # Time: 2023/8/18 15:00
 # Description: 
 # ==============================================
+from PyQtInspect._pqi_bundle.pqi_comm import WriterThread, DropPolicy, convert_drop_policy
+from PyQtInspect._pqi_bundle.pqi_connect_tools import Transport, convert_transport
+from PyQtInspect._pqi_bundle.pqi_stack_tools import StackCaptureMode, convert_stack_capture_mode, \
+    convert_class_names
 from PyQtInspect._pqi_common.pqi_setup_holder import SetupHolder
 
 
@@ -109,6 +113,22 @@ ACCEPTED_ARG_HANDLERS = [
     ArgHandlerWithParam(SetupHolder.KEY_PORT, int, 19394),  # --port <client port=19394>
     ArgHandlerWithParam(SetupHolder.KEY_CLIENT, default_val='127.0.0.1'),  # --client <client ip=127.0.0.1>
     ArgHandlerWithParam(SetupHolder.KEY_STACK_MAX_DEPTH, int, 0),  # --stack-max-depth <depth=0>
+    ArgHandlerWithParam(SetupHolder.KEY_STACK_CAPTURE, convert_stack_capture_mode,
+                        StackCaptureMode.FULL),  # --stack-capture <full|fast|deferred>
+    ArgHandlerWithParam(SetupHolder.KEY_STACK_CLASSES, convert_class_names,
+                        ''),  # --stack-classes <QLabel,my.module.MyWidget,...>, only record the stacks of these classes
+    ArgHandlerWithParam(SetupHolder.KEY_STACK_EXCLUDED_CLASSES, convert_class_names,
+                        ''),  # --stack-excluded-classes <QLabel,...>
+    ArgHandlerWithParam(SetupHolder.KEY_STACK_FIRST_N, int, 0),  # --stack-first-n <count=0>, per class, 0 for no limit
+    ArgHandlerWithParam(SetupHolder.KEY_STACK_MAX_RATE, float, 0),  # --stack-max-rate <stacks per second=0>
+    ArgHandlerWithParam(SetupHolder.KEY_HOVER_INTERVAL, int,
+                        100),  # --hover-interval <ms=100>, the full info of the hovered widget is sent at most this often
+    ArgHandlerWithParam(SetupHolder.KEY_WRITER_QUEUE_SIZE, int,
+                        WriterThread.DEFAULT_MAX_QUEUE_SIZE),  # --writer-queue-size <size=1024>, 0 for unbounded
+    ArgHandlerWithParam(SetupHolder.KEY_WRITER_DROP_POLICY, convert_drop_policy,
+                        DropPolicy.DROP_OLDEST),  # --writer-drop-policy <drop-oldest|drop-newest|block>
+    ArgHandlerWithParam(SetupHolder.KEY_TRANSPORT, convert_transport,
+                        Transport.AUTO),  # --transport <auto|unix|tcp>
 
     ArgHandlerBool(SetupHolder.KEY_DIRECT),  # --direct
     ArgHandlerBool(SetupHolder.KEY_MULTIPROCESS),  # --multiprocess
@@ -116,6 +136,7 @@ ACCEPTED_ARG_HANDLERS = [
     ArgHandlerBool(SetupHolder.KEY_HELP),  # --help, print help and exit
     ArgHandlerBool(SetupHolder.KEY_SHOW_PQI_STACK),  # --show-pqi-stack
     ArgHandlerBool(SetupHolder.KEY_IS_DEBUG_MODE),  # --DEBUG
+    ArgHandlerBool(SetupHolder.KEY_SHARED_MEMORY),  # --shared-memory, put large payloads in shared memory (unix only)
 ]
 
 ARGV_REP_TO_HANDLER = {}
@@ -0,0 +1,121 @@
+# -*- encoding:utf-8 -*-
+# ==============================================
+# Description: Payload compression codecs for the binary protocol
+# ==============================================
+import typing
+import zlib
+
+__all__ = [
+    'NO_COMPRESSION_FLAG',
+    'available_compressions',
+    'choose_compression',
+    'get_codec',
+    'get_codec_by_flag',
+]
+
+# The codec flag in the binary frame header when the payload is not compressed.
+NO_COMPRESSION_FLAG = 0
+
+
+class _Codec:
+    """ A payload codec, identified on the wire by its ``flag`` in the binary frame header. """
+    name = ''
+    flag = NO_COMPRESSION_FLAG
+
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    def decompress(self, data) -> bytes:
+        raise NotImplementedError
+
+
+class _ZlibCodec(_Codec):
+    """ The stdlib fallback, always available. """
+    name = 'zlib'
+    flag = 1
+
+    # Favor speed, the JSON payloads compress well even with the fastest level.
+    LEVEL = 1
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data, self.LEVEL)
+
+    def decompress(self, data) -> bytes:
+        return zlib.decompress(data)
+
+
+class _ZstdCodec(_Codec):
+    """ Uses `compression.zstd` (Python 3.14+) or the third-party `zstandard` package. """
+    name = 'zstd'
+    flag = 2
+
+    LEVEL = 3
+
+    def __init__(self, compress_func, decompress_func):
+        self._compress = compress_func
+        self._decompress = decompress_func
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compress(data)
+
+    def decompress(self, data) -> bytes:
+        return self._decompress(data)
+
+    @classmethod
+    def create(cls) -> typing.Optional['_ZstdCodec']:
+        try:
+            from compression import zstd  # Python 3.14+
+        except ImportError:
+            pass
+        else:
+            return cls(lambda data: zstd.compress(data, level=cls.LEVEL), zstd.decompress)
+
+        try:
+            import zstandard
+        except ImportError:
+            return None
+        # The (de)compressor objects are not thread-safe, they are cheap enough to be created per payload.
+        return cls(lambda data: zstandard.ZstdCompressor(level=cls.LEVEL).compress(data),
+                   lambda data: zstandard.ZstdDecompressor().decompress(data))
+
+
+def _load_codecs() -> typing.List[_Codec]:
+    codecs = []
+    zstd_codec = _ZstdCodec.create()
+    if zstd_codec is not None:
+        codecs.append(zstd_codec)
+    codecs.append(_ZlibCodec())
+    return codecs
+
+
+# From the most preferred to the least preferred.
+_CODECS = _load_codecs()
+_NAME_TO_CODEC = {codec.name: codec for codec in _CODECS}
+_FLAG_TO_CODEC = {codec.flag: codec for codec in _CODECS}
+
+
+def available_compressions() -> typing.List[str]:
+    """ The names of the compressions supported by this process, from the most preferred. """
+    return [codec.name for codec in _CODECS]
+
+
+def choose_compression(offered_compressions) -> typing.Optional[str]:
+    """ Choose a compression among the ones offered by the peer, None if there is no common one. """
+    for codec in _CODECS:
+        if codec.name in offered_compressions:
+            return codec.name
+    return None
+
+
+def get_codec(name: typing.Optional[str]) -> typing.Optional[_Codec]:
+    if name is None:
+        return None
+    return _NAME_TO_CODEC.get(name)
+
+
+def get_codec_by_flag(flag: int) -> _Codec:
+    """ Get the codec of a received frame, raise ValueError if the flag is unknown. """
+    try:
+        return _FLAG_TO_CODEC[flag]
+    except KeyError:
+        raise ValueError(f'Unsupported compression flag: {flag}') from None
@@ -21,4 +21,52 @@ def random_port() -> int:
     except:
         return random_port()  # try again by recursion
     finally:
-        s.close()
\ No newline at end of file
+        s.close()
+
+
+def is_loopback_host(host: str) -> bool:
+    """
+    Check if the host refers to the local machine through the loopback interface
+    :param host: a host name or an IP address
+    """
+    if host in ('localhost', ''):
+        return True
+    import ipaddress
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class Transport:
+    """ The transports between the inspected process and the server. """
+    TCP = 'tcp'
+    # Unix domain socket, only for a server on the same host.
+    UNIX = 'unix'
+    # The Unix domain socket when the server is on the same host and listens on it, TCP otherwise.
+    AUTO = 'auto'
+
+    ALL = (TCP, UNIX, AUTO)
+
+
+def convert_transport(transport: str) -> str:
+    """ Validate a transport read from the command line. """
+    transport = transport.lower()
+    if transport not in Transport.ALL:
+        raise ValueError(f'Invalid transport: {transport}, expected one of {Transport.ALL}')
+    return transport
+
+
+def is_unix_socket_supported() -> bool:
+    import socket
+    return hasattr(socket, 'AF_UNIX')
+
+
+def get_local_socket_path(port: int) -> str:
+    """
+    Get the path of the Unix domain socket the server listens on besides the TCP port,
+    derived from the port so that `--port` selects the server for both transports
+    """
+    import tempfile
+    import os
+    return os.path.join(tempfile.gettempdir(), f'pqi-{port}.sock')
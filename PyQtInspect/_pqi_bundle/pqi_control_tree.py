@@ -0,0 +1,385 @@
+# -*- encoding:utf-8 -*-
+# ==============================================
+# Description: The control tree of the inspected process, and the shadow of the tree shown by the server
+# ==============================================
+# The server fetches the tree lazily (a few levels, then the children of the nodes it expands).
+# `ControlTree` remembers which nodes were sent and the children the server knows for each of them,
+# so that when `QEvent.ChildAdded`/`ChildRemoved`/`ParentChange` tell that the children of a widget have changed,
+# only the difference is sent as a compact list of operations (see `DeltaOps`).
+# The top-level widgets have no parent to get these events: they are tracked by their `QEvent.Show`
+# and their `destroyed` signal.
+import threading
+import typing
+
+from PyQtInspect._pqi_bundle import pqi_log
+from PyQtInspect._pqi_bundle.pqi_comm_constants import TreeViewKeys, DeltaOps
+from PyQtInspect._pqi_bundle.pqi_monkey_qt_props import _PQI_HIGHLIGHT_FG_NAME, _PQI_HANDLE_ATTR, \
+    _PQI_TOP_LEVEL_WATCHED_ATTR, get_own_attr
+from PyQtInspect._pqi_bundle.pqi_qt_tools import get_widget_object_name, get_parent_info, import_Qt, \
+    _get_full_class_name
+from PyQtInspect._pqi_bundle.pqi_widget_registry import WidgetRegistry
+
+__all__ = [
+    'ControlTree',
+]
+
+_ROOT_KEY = None  # the key of the (invisible) root, whose children are the top-level widgets
+
+
+class _FetchedNode:
+    __slots__ = ('is_layout', 'child_ids')
+
+    def __init__(self, is_layout: bool, child_ids: typing.List[int]):
+        self.is_layout = is_layout
+        self.child_ids = child_ids
+
+
+class ControlTree:
+    """ Build the control tree, and compute the changes of the part of it which was sent to the server.
+
+    The tree is built in the reader thread, the changes are computed in the GUI thread.
+    The commands must be queued with `lock` held, so that the server receives the changes
+    in the same order as they are applied to the shadow.
+    The shadow only holds the handles of the nodes, which are registered to be resolved by the registry.
+    """
+    # The changes are gathered during this interval before being sent
+    DELTA_INTERVAL_MS = 200
+
+    def __init__(self, send_delta: typing.Callable[[typing.List[list]], None], registry: WidgetRegistry):
+        """
+        :param send_delta: called with the operations to apply to the tree of the server
+        :param registry: gives the handles identifying the nodes
+        """
+        self._send_delta = send_delta
+        self._registry = registry
+        self._handle_of = registry.handle_of
+        self.lock = threading.RLock()
+        self._qt_widgets = None
+        self._qt_core = None
+
+        # The nodes sent whose children were not fetched yet
+        self._unfetched_ids = set()  # type: typing.Set[int]
+        # The ids of the spacer items of the fetched layouts, by position
+        self._key_to_spacer_ids = {}  # type: typing.Dict[typing.Optional[int], typing.List[int]]
+        # The nodes sent with their children, and the ids of these children
+        self._id_to_fetched = {}  # type: typing.Dict[typing.Optional[int], _FetchedNode]
+        # The keys of the fetched nodes whose children may have changed
+        self._dirty_keys = set()
+        self._is_delta_scheduled = False
+
+    def _ensure_qt(self):
+        if self._qt_widgets is None:
+            from PyQtInspect.pqi import SetupHolder
+
+            QtLib = import_Qt(SetupHolder.setup[SetupHolder.KEY_QT_SUPPORT])
+            self._qt_widgets, self._qt_core = QtLib.QtWidgets, QtLib.QtCore
+
+    # region Building the tree
+    def _get_object_identifier(self, obj):
+        """ Get the object identifier of the obj.
+        If the widget has an objectName, return it;
+        Otherwise, return the hex id of the widget.
+        """
+        if isinstance(obj, self._qt_widgets.QSpacerItem):
+            return 'Spacer'
+
+        objectName = get_widget_object_name(obj)
+        if objectName:
+            return objectName
+        return hex(id(obj))
+
+    def _iter_layout_items(self, parent_layout, visited_widgets):
+        """ Iterate the widgets, spacers and sub-layouts of the layout.
+        :param visited_widgets: the ids of the widgets already met, a widget is only listed once
+        """
+        QtWidgets = self._qt_widgets
+        for i in range(parent_layout.count()):
+            item = parent_layout.itemAt(i)
+            if isinstance(item, QtWidgets.QWidgetItem):
+                widget = item.widget()
+                if widget is None or id(widget) in visited_widgets:
+                    continue
+                visited_widgets.add(id(widget))
+                yield widget
+            elif isinstance(item, QtWidgets.QSpacerItem):
+                yield item
+            elif isinstance(item, QtWidgets.QLayoutItem):
+                layout = item.layout()
+                if layout is not None:
+                    yield layout
+
+    def _collect_layout_widgets(self, parent_layout, visited_widgets):
+        for item in self._iter_layout_items(parent_layout, visited_widgets):
+            if isinstance(item, self._qt_widgets.QLayout):
+                self._collect_layout_widgets(item, visited_widgets)
+
+    def _iter_children(self, obj):
+        """ Iterate the nodes under ``obj`` in the tree, the top-level widgets if it is None. """
+        QtWidgets = self._qt_widgets
+        if obj is None:
+            for widget in QtWidgets.QApplication.topLevelWidgets():
+                if widget.objectName() != _PQI_HIGHLIGHT_FG_NAME:
+                    yield widget
+            return
+        if isinstance(obj, QtWidgets.QSpacerItem):
+            return
+        if isinstance(obj, QtWidgets.QLayout):
+            yield from self._iter_layout_items(obj, set())
+            return
+
+        # ------ ATTENTION ------
+        # We use explicit function call instead of binding to the parent.layout()
+        # because sometimes it is shadowed by the same name variable in `__dict__`
+        # -----------------------
+        # When a widget is in a layout, it is listed under the layout rather than under the parent widget
+        visited = set()
+        layout = QtWidgets.QWidget.layout(obj)
+        if layout is not None:
+            self._collect_layout_widgets(layout, visited)
+            yield layout
+
+        for widget in QtWidgets.QWidget.children(obj):
+            if not widget.isWidgetType() or id(widget) in visited:
+                continue
+            yield widget
+
+    def _child_ids(self, key, children: list) -> typing.List[int]:
+        """ The ids of the children of a node. Called with the lock held.
+        A spacer item is not a QObject, it gets a new wrapper each time it is listed:
+        its id is the one of its position among the spacers of its layout, rather than a handle in its wrapper.
+        """
+        ids = []
+        spacer_ids = None
+        for child in children:
+            if not isinstance(child, self._qt_widgets.QSpacerItem):
+                ids.append(self._handle_of(child))
+                continue
+            if spacer_ids is None:
+                spacer_ids = self._key_to_spacer_ids.setdefault(key, [])
+                spacer_index = 0
+            if spacer_index == len(spacer_ids):
+                spacer_ids.append(self._registry.allocate_handle())
+            ids.append(spacer_ids[spacer_index])
+            spacer_index += 1
+        return ids
+
+    def _build_infos(self, key, children: list, level: int, depth: typing.Optional[int],
+                     path_ids: typing.Set[int]) -> typing.List[typing.Dict]:
+        """ Called with the lock held. """
+        return [self._build_info(child, child_id, level, depth, path_ids)
+                for child, child_id in zip(children, self._child_ids(key, children))]
+
+    def _build_info(self, obj, handle: int, level: int, depth: typing.Optional[int], path_ids: typing.Set[int]):
+        """ Called with the lock held. """
+        children = list(self._iter_children(obj))
+        info = {
+            TreeViewKeys.OBJ_ID_KEY: handle,
+            TreeViewKeys.OBJ_NAME_KEY: self._get_object_identifier(obj),
+            TreeViewKeys.OBJ_CLS_NAME_KEY: _get_full_class_name(obj),
+            TreeViewKeys.CHILD_CNT_KEY: len(children),
+        }
+        if not children or depth is None or level < depth or self._is_on_path(obj, path_ids):
+            child_infos = self._build_infos(handle, children, level + 1, depth, path_ids)
+            info[TreeViewKeys.CHILDREN_KEY] = child_infos
+            if not children and isinstance(obj, self._qt_widgets.QSpacerItem):
+                return info  # not a QObject, it never changes
+            self._id_to_fetched[handle] = _FetchedNode(isinstance(obj, self._qt_widgets.QLayout),
+                                                       [child[TreeViewKeys.OBJ_ID_KEY] for child in child_infos])
+        else:
+            self._unfetched_ids.add(handle)
+        self._registry.register(obj)
+        return info
+
+    def _is_on_path(self, obj, path_ids: typing.Set[int]) -> bool:
+        if isinstance(obj, self._qt_widgets.QLayout):
+            return self._handle_of(obj.parentWidget()) in path_ids
+        return self._handle_of(obj) in path_ids
+
+    def get_tree(self, root_id: typing.Optional[int] = None, depth: typing.Optional[int] = None,
+                 current_widget=None) -> typing.List[typing.Dict]:
+        """ Get the info of the children of a node (the top-level widgets if ``root_id`` is None),
+        and their descendants.
+
+        :param root_id: the id of a node sent before without its children.
+            If it is None, the whole tree is sent again and the previous one is forgotten.
+        :param depth: the number of levels to include, None for the whole tree.
+            The children of the deeper nodes are omitted (no ``TreeViewKeys.CHILDREN_KEY``),
+            they are fetched later with the node as root.
+        :param current_widget: the ancestors of this widget are fully included whatever the depth,
+            so that it can be located in the tree
+        :return: the info of the children, an empty list if the root has been deleted
+        """
+        self._ensure_qt()
+        path_ids = set()
+        if current_widget is not None:
+            path_ids = {parent_id for _, parent_id, _ in get_parent_info(current_widget, self._handle_of)}
+
+        with self.lock:
+            if root_id is None:
+                self._unfetched_ids.clear()
+                self._id_to_fetched.clear()
+                self._key_to_spacer_ids.clear()
+                self._dirty_keys.clear()
+                root = None
+            else:
+                if root_id not in self._unfetched_ids:
+                    return []
+                self._unfetched_ids.discard(root_id)
+                root = self._registry.get(root_id)
+                if root is None:
+                    return []
+
+            children = list(self._iter_children(root))
+            if root is None:
+                for child in children:
+                    self._watch_top_level(child)
+            infos = self._build_infos(root_id, children, 1, depth, path_ids)
+            self._id_to_fetched[root_id] = _FetchedNode(isinstance(root, self._qt_widgets.QLayout),
+                                                        [info[TreeViewKeys.OBJ_ID_KEY] for info in infos])
+            return infos
+    # endregion
+
+    # region Tracking the changes
+    def notify_children_changed(self, obj):
+        """ Called in the GUI thread when a child is added to or removed from ``obj``. """
+        # Cheap test first, it is called for every ChildAdded/ChildRemoved event.
+        # Don't allocate a handle, the nodes sent have one.
+        key = get_own_attr(obj, _PQI_HANDLE_ATTR)
+        if key is not None and key in self._id_to_fetched:
+            self._mark_dirty(key)
+
+    def notify_parent_changed(self, obj):
+        """ Called in the GUI thread when the parent of ``obj`` has changed.
+        The old and new parents get ChildRemoved/ChildAdded events, but not the root
+        when a widget becomes a top-level widget, or stops being one.
+        """
+        root = self._id_to_fetched.get(_ROOT_KEY)
+        if root is not None and (obj.parent() is None or get_own_attr(obj, _PQI_HANDLE_ATTR) in root.child_ids):
+            self._mark_dirty(_ROOT_KEY)
+
+    def notify_shown(self, obj):
+        """ Called in the GUI thread when a window is shown, a new top-level widget is added to the root. """
+        root = self._id_to_fetched.get(_ROOT_KEY)
+        if root is None or obj.objectName() == _PQI_HIGHLIGHT_FG_NAME:
+            return
+        if get_own_attr(obj, _PQI_HANDLE_ATTR) not in root.child_ids:
+            self._mark_dirty(_ROOT_KEY)
+
+    def _watch_top_level(self, widget):
+        """ Remove a top-level widget from the root when it is destroyed, there is no event for it.
+        Called once per widget.
+        """
+        if get_own_attr(widget, _PQI_TOP_LEVEL_WATCHED_ATTR, False):
+            return
+        try:
+            widget.destroyed.connect(self._on_top_level_destroyed)
+            setattr(widget, _PQI_TOP_LEVEL_WATCHED_ATTR, True)
+        except (AttributeError, TypeError, RuntimeError):
+            pass  # shadowed, it is removed at the next change of the root
+
+    def _on_top_level_destroyed(self, *args):
+        if _ROOT_KEY in self._id_to_fetched:
+            self._mark_dirty(_ROOT_KEY)
+
+    def _mark_dirty(self, key):
+        with self.lock:
+            self._dirty_keys.add(key)
+            if self._is_delta_scheduled:
+                return
+            self._is_delta_scheduled = True
+        self._ensure_qt()
+        self._qt_core.QTimer.singleShot(self.DELTA_INTERVAL_MS, self._flush_delta)
+
+    def _flush_delta(self):
+        with self.lock:
+            self._is_delta_scheduled = False
+            dirty_keys, self._dirty_keys = self._dirty_keys, set()
+            try:
+                ops = self._compute_delta(dirty_keys)
+            except Exception:
+                pqi_log.error('Failed to compute the changes of the control tree', exc_info=True)
+                return
+            if ops:
+                self._send_delta(ops)
+
+    def _with_fetched_layouts(self, keys: typing.Set) -> typing.Set:
+        """ The children of a widget in its layouts are added to the widget, so its layouts may have changed too. """
+        result = set(keys)
+        stack = list(keys)
+        while stack:
+            node = self._id_to_fetched.get(stack.pop())
+            if node is None:
+                continue
+            for child_id in node.child_ids:
+                child = self._id_to_fetched.get(child_id)
+                if child is not None and child_id not in result and child.is_layout:
+                    result.add(child_id)
+                    stack.append(child_id)
+        return result
+
+    def _compute_delta(self, dirty_keys: typing.Set) -> typing.List[list]:
+        """ Called with the lock held. """
+        changes = []  # (key, node, new children)
+        removed_ids = set()
+        for key in self._with_fetched_layouts(dirty_keys):
+            node = self._id_to_fetched.get(key)
+            if node is None:
+                continue
+            obj = None
+            if key is not _ROOT_KEY:
+                obj = self._registry.get(key)
+                if obj is None:
+                    continue  # removed by the change of its parent
+            new_children = list(self._iter_children(obj))
+            new_ids = self._child_ids(key, new_children)
+            if new_ids == node.child_ids:
+                continue
+            removed_ids.update(set(node.child_ids).difference(new_ids))
+            changes.append((key, node, new_children, new_ids))
+
+        added_ids = set()
+        ops = []
+        for key, node, new_children, new_ids in changes:
+            # The order of the kept children on the server, maintained as the operations are added
+            new_id_set = set(new_ids)
+            server_ids = [child_id for child_id in node.child_ids if child_id in new_id_set]
+            # Insert from the end, so that the next sibling is always in the tree of the server:
+            #   the children from ``next_id`` on are in their final order
+            next_id = None
+            for child, child_id in zip(reversed(new_children), reversed(new_ids)):
+                if key is _ROOT_KEY:
+                    self._watch_top_level(child)
+                if child_id in server_ids:
+                    row = server_ids.index(child_id)
+                    if (server_ids[row + 1] if row + 1 < len(server_ids) else None) != next_id:
+                        # Reordered among the children
+                        ops.append([DeltaOps.MOVE, child_id, key, next_id])
+                        del server_ids[row]
+                        server_ids.insert(server_ids.index(next_id) if next_id is not None else len(server_ids),
+                                          child_id)
+                else:
+                    if child_id in removed_ids:
+                        ops.append([DeltaOps.MOVE, child_id, key, next_id])
+                    else:
+                        ops.append([DeltaOps.ADD, key, next_id, self._build_info(child, child_id, 1, 1, set())])
+                    added_ids.add(child_id)
+                    server_ids.insert(server_ids.index(next_id) if next_id is not None else len(server_ids),
+                                      child_id)
+                next_id = child_id
+            node.child_ids = new_ids
+
+        removals = [[DeltaOps.REMOVE, node_id] for node_id in removed_ids if node_id not in added_ids]
+        for _, node_id in removals:
+            self._forget(node_id)
+        return removals + ops
+
+    def _forget(self, node_id: int):
+        """ Forget a removed node and its descendants. Called with the lock held. """
+        self._unfetched_ids.discard(node_id)
+        self._key_to_spacer_ids.pop(node_id, None)
+        node = self._id_to_fetched.pop(node_id, None)
+        self._dirty_keys.discard(node_id)
+        if node is not None:
+            for child_id in node.child_ids:
+                self._forget(child_id)
+    # endregion
@@ -0,0 +1,103 @@
+# -*- encoding:utf-8 -*-
+# ==============================================
+# Description: Decode large JSON payloads in steps, so that a decoding thread doesn't hold the GIL for long
+# ==============================================
+# `json.loads` decodes a whole document in C without releasing the GIL: decoding a multi-megabyte control tree
+# in a background thread still freezes the GUI thread for as long. Here the outer containers are walked in Python
+# and their members are decoded one by one, the interpreter can switch threads between two members.
+import json
+import json.decoder
+import typing
+
+__all__ = [
+    'loads',
+    'INCREMENTAL_THRESHOLD',
+]
+
+# The payloads shorter than this (in characters) are decoded at once
+INCREMENTAL_THRESHOLD = 256 * 1024
+
+# The containers nested deeper than this are decoded at once.
+# For a control tree: the result, the list of top-level widgets, a widget, its children, one of them.
+_MAX_SPLIT_DEPTH = 5
+
+_decoder = json.JSONDecoder()
+_scan_once = _decoder.scan_once
+_WHITESPACE = json.decoder.WHITESPACE
+_WHITESPACE_STR = json.decoder.WHITESPACE_STR
+
+
+def loads(text: str, threshold: int = INCREMENTAL_THRESHOLD):
+    """ Same as `json.loads`, the document is decoded in steps if it is longer than ``threshold``. """
+    if len(text) < threshold:
+        return json.loads(text)
+    idx = _skip_whitespace(text, 0)
+    value, end = _decode_value(text, idx, 0)
+    end = _skip_whitespace(text, end)
+    if end != len(text):
+        raise json.JSONDecodeError('Extra data', text, end)
+    return value
+
+
+def _skip_whitespace(text: str, idx: int) -> int:
+    if idx < len(text) and text[idx] in _WHITESPACE_STR:
+        idx = _WHITESPACE.match(text, idx).end()
+    return idx
+
+
+def _decode_value(text: str, idx: int, depth: int) -> typing.Tuple[typing.Any, int]:
+    char = text[idx:idx + 1]
+    if depth < _MAX_SPLIT_DEPTH:
+        if char == '{':
+            return _decode_object(text, idx + 1, depth + 1)
+        if char == '[':
+            return _decode_array(text, idx + 1, depth + 1)
+    try:
+        return _scan_once(text, idx)
+    except StopIteration as err:
+        raise json.JSONDecodeError('Expecting value', text, err.value) from None
+
+
+def _expect(text: str, idx: int, char: str, msg: str) -> int:
+    """ Skip the whitespace and ``char``, return the index after it. """
+    idx = _skip_whitespace(text, idx)
+    if text[idx:idx + 1] != char:
+        raise json.JSONDecodeError(msg, text, idx)
+    return idx + 1
+
+
+def _decode_object(text: str, idx: int, depth: int) -> typing.Tuple[dict, int]:
+    result = {}
+    idx = _skip_whitespace(text, idx)
+    if text[idx:idx + 1] == '}':
+        return result, idx + 1
+    while True:
+        if text[idx:idx + 1] != '"':
+            raise json.JSONDecodeError('Expecting property name enclosed in double quotes', text, idx)
+        key, idx = json.decoder.scanstring(text, idx + 1)
+        idx = _skip_whitespace(text, _expect(text, idx, ':', "Expecting ':' delimiter"))
+        result[key], idx = _decode_value(text, idx, depth)
+        idx = _skip_whitespace(text, idx)
+        char = text[idx:idx + 1]
+        if char == '}':
+            return result, idx + 1
+        if char != ',':
+            raise json.JSONDecodeError("Expecting ',' delimiter", text, idx)
+        idx = _skip_whitespace(text, idx + 1)
+
+
+def _decode_array(text: str, idx: int, depth: int) -> typing.Tuple[list, int]:
+    result = []
+    idx = _skip_whitespace(text, idx)
+    if text[idx:idx + 1] == ']':
+        return result, idx + 1
+    while True:
+        value, idx = _decode_value(text, idx, depth)
+        result.append(value)
+        idx = _skip_whitespace(text, idx)
+        char = text[idx:idx + 1]
+        if char == ']':
+            return result, idx + 1
+        if char != ',':
+            raise json.JSONDecodeError("Expecting ',' delimiter", text, idx)
+        idx = _skip_whitespace(text, idx + 1)
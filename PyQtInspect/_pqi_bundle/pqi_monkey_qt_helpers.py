@@ -1,25 +1,29 @@
 # -*- encoding:utf-8 -*-
+import atexit
 import collections
 import sys
+import time
+import weakref
 from contextlib import redirect_stdout
 from io import StringIO
 import os
 
 from PyQtInspect._pqi_bundle import pqi_log
 from PyQtInspect._pqi_bundle.pqi_contants import get_global_debugger, QtWidgetClasses, IS_WINDOWS, IS_MACOS, DEFAULT_HIGHLIGHT_COLOR
-from PyQtInspect._pqi_bundle.pqi_qt_tools import get_widget_size
-from PyQtInspect._pqi_bundle.pqi_stack_tools import getStackFrame
+from PyQtInspect._pqi_bundle.pqi_stack_tools import getStackFrame, captureCompactStack, StackCaptureMode, \
+    StackCapturePolicy
 from PyQtInspect._pqi_bundle.pqi_log.log_utils import log_exception
+from PyQtInspect._pqi_common.pqi_setup_holder import SetupHolder
 from PyQtInspect._pqi_bundle.pqi_monkey_qt_props import (
     _PQI_MOCKED_EVENT_ATTR,
-    _PQI_INSPECTED_PROP_NAME,
-    _PQI_INSPECTED_PROP_NAME_BYTES,
     _PQI_WIDGET_INSPECTED_MARK,
     _PQI_HIGHLIGHT_FG_NAME,
     _PQI_CUSTOM_EVENT_IS_ENTER_ATTR,
     _PQI_CUSTOM_EVENT_IS_HIGHLIGHT_ATTR,
     _PQI_CUSTOM_EVENT_EXEC_CODE_ATTR,
     _PQI_STACK_WHEN_CREATED_ATTR,
+    _PQI_PATCHED_MARK_ATTR,
+    get_own_attr,
 )
 
 def _is_inspect_enabled():
@@ -28,11 +32,15 @@ def _is_inspect_enabled():
 
 
 def _isWidgetPatched(obj) -> bool:
-    return bool(obj.property(_PQI_INSPECTED_PROP_NAME))
+    return get_own_attr(obj, _PQI_PATCHED_MARK_ATTR, False)
 
 
 def _markPatched(widget):
-    widget.setProperty(_PQI_INSPECTED_PROP_NAME, True)
+    # The mark is kept in the wrapper rather than in a Qt property, which would send a `DynamicPropertyChange` event
+    #   to the widget (and to the filters) while its `__init__` is not finished.
+    # The wrapper is kept as long as the widget lives: by Qt for a widget created by Python and owned by C++,
+    #   by `WidgetRegistry` for a widget created by C++.
+    setattr(widget, _PQI_PATCHED_MARK_ATTR, True)
 
 
 def patch_QtWidgets(QtModule, qt_support_mode='auto', is_attach=False):
@@ -42,6 +50,7 @@ def patch_QtWidgets(QtModule, qt_support_mode='auto', is_attach=False):
 
     EventEnum = QtCore.QEvent.Type
     WidgetAttributeEnum = QtCore.Qt.WidgetAttribute
+    WindowTypeEnum = QtCore.Qt.WindowType
     MouseButtonEnum = QtCore.Qt.MouseButton
     KeyboardModifierEnum = QtCore.Qt.KeyboardModifier
     QContextMenuEventReasonEnum = QtGui.QContextMenuEvent.Reason
@@ -64,42 +73,103 @@ def patch_QtWidgets(QtModule, qt_support_mode='auto', is_attach=False):
         """
         return QtGui.QMouseEvent(event_type, QtCore.QPointF(pos), button, button, KeyboardModifierEnum.NoModifier)
 
-    def _register_widget(widget):
+    def _register_widget(widget, attach=False):
         debugger = get_global_debugger()
         if debugger is not None:
-            debugger.register_widget(widget)
+            debugger.register_widget(widget, attach)
 
-    def _get_highlight_stylesheet() -> str:
-        color_str = DEFAULT_HIGHLIGHT_COLOR
+    def _get_highlight_color_str() -> str:
         debugger = get_global_debugger()
         if debugger is not None:
-            color_str = debugger.highlight_color
+            return debugger.highlight_color
+        return DEFAULT_HIGHLIGHT_COLOR
+
+    def _parse_highlight_color(color_str: str):
         try:
             r, g, b, a = (int(x) for x in color_str.split(','))
             r, g, b, a = (max(0, min(255, v)) for v in (r, g, b, a))
-            color_css = f"rgba({r},{g},{b},{a})"
         except (ValueError, AttributeError):
-            color_css = "rgba(255,0,0,51)"
-        return f"background: transparent; background-color: {color_css};"
-
-    def _createHighlightFg(parent: QtWidgets.QWidget):
-        # Instantiate with __new__ first, then invoke the original __init__.
-        widget = QtWidgets.QWidget.__new__(QtWidgets.QWidget)
-        QtWidgets.QWidget._original_QWidget_init(widget, parent)
-        widget.setFixedSize(*get_widget_size(parent))
-        # Prevent it from responding to mouse events.
-        widget.setAttribute(WidgetAttributeEnum.WA_TransparentForMouseEvents)
-        widget.setObjectName(_PQI_HIGHLIGHT_FG_NAME)
-        # Fix for #63: Prevent repeated icon artifacts when highlighting widgets with background-image qss.
-        # -------------------------------------------------------------------------------------------------
-        # Use `background: transparent` shorthand to reset all inherited background properties
-        #   (e.g. background-image, background-color) from parent stylesheets, then apply our highlight color.
-        # -------------------------------------------------------------------------------------------------
-        # Note: `background-image: none` is ineffective here, and reversing the declaration order
-        #   will cause "background-color" to be overridden by the shorthand.
-        # -------------------------------------------------------------------------------------------------
-        widget.setStyleSheet(_get_highlight_stylesheet())
-        return widget
+            r, g, b, a = 255, 0, 0, 51
+        return QtGui.QColor(r, g, b, a)
+
+    class HighlightOverlay(QtWidgets.QWidget):
+        """ A frameless, translucent top-level window placed over the highlighted widget.
+
+        A single overlay is moved from widget to widget, rather than adding a child overlay to each widget:
+        it doesn't change the children of the inspected widgets, and it can't inherit their stylesheets (#63).
+        """
+
+        def __init__(self):
+            # Call the original __init__, the overlay must not be patched.
+            QtWidgets.QWidget._original_QWidget_init(
+                self, None,
+                WindowTypeEnum.ToolTip | WindowTypeEnum.FramelessWindowHint | WindowTypeEnum.WindowStaysOnTopHint
+                | WindowTypeEnum.WindowTransparentForInput | WindowTypeEnum.WindowDoesNotAcceptFocus
+            )
+            self.setObjectName(_PQI_HIGHLIGHT_FG_NAME)
+            # Prevent it from responding to mouse events, and from taking the focus.
+            self.setAttribute(WidgetAttributeEnum.WA_TransparentForMouseEvents)
+            self.setAttribute(WidgetAttributeEnum.WA_ShowWithoutActivating)
+            self.setAttribute(WidgetAttributeEnum.WA_TranslucentBackground)
+            self._colorStr = None
+            self._color = None
+
+        def setColorStr(self, colorStr: str):
+            if colorStr != self._colorStr:  # parsed only when the setting changes
+                self._colorStr = colorStr
+                self._color = _parse_highlight_color(colorStr)
+                self.update()
+
+        def cover(self, widget) -> bool:
+            """ Place the overlay over the visible part of the widget.
+            :return: whether any part of the widget is visible
+            """
+            rect = _visible_rect(widget)
+            if rect.isEmpty():
+                return False
+            self.setGeometry(QtCore.QRect(widget.mapToGlobal(rect.topLeft()), rect.size()))
+            return True
+
+        def paintEvent(self, event):
+            painter = QtGui.QPainter(self)
+            painter.fillRect(self.rect(), self._color)
+            painter.end()
+
+    def _visible_rect(widget):
+        """ The part of the widget which isn't clipped by its ancestors (e.g. scrolled out), in its coordinates.
+        Unlike `QWidget.visibleRegion`, the opaque children are not subtracted: a container is covered entirely.
+        """
+        rect = widget.rect()
+        offset = QtCore.QPoint(0, 0)  # the origin of the widget in the coordinates of the current ancestor
+        current = widget
+        while not current.isWindow():
+            parent = current.parentWidget()
+            if parent is None:
+                break
+            offset += current.pos()
+            rect = rect.intersected(parent.rect().translated(-offset))
+            current = parent
+        return rect
+
+    def _weak_ref(widget):
+        try:
+            return weakref.ref(widget)
+        except TypeError:  # the binding doesn't support weak references, `destroyed` still clears it
+            return lambda: widget
+
+    class HighlightTracker(QtCore.QObject):
+        """ Follow the highlighted widget and its window: the overlay is moved, hidden and shown with them. """
+
+        def eventFilter(self, obj, event):
+            eventType = event.type()
+            if eventType == EventEnum.Hide:
+                HighlightController.overlay.hide()
+            elif eventType in (EventEnum.Move, EventEnum.Resize, EventEnum.Show):
+                HighlightController.refresh()
+            return False
+
+        def onDestroyed(self, *args):
+            HighlightController.unhighlight_last()
 
     def _mark_obj_inspected(obj):
         setattr(obj, _PQI_WIDGET_INSPECTED_MARK, True)
@@ -112,7 +182,11 @@ def patch_QtWidgets(QtModule, qt_support_mode='auto', is_attach=False):
         return hasattr(obj, _PQI_WIDGET_INSPECTED_MARK)
 
     class HighlightController:
-        last_highlighted_widget = None
+        overlay = None  # created at the first highlight
+        tracker = None
+        # The widgets are held weakly, the overlay is hidden when the highlighted one is destroyed
+        _highlighted_ref = None
+        _watched_refs = ()  # the highlighted widget and its window, filtered by the tracker
         # for some widgets like QSplitter, we should not highlight them, or they will change their size
         widget_class_to_ignore = (
             QtWidgets.QSplitter,
@@ -122,34 +196,78 @@ def patch_QtWidgets(QtModule, qt_support_mode='auto', is_attach=False):
         def _is_ignored(cls, widget):
             return any(isinstance(widget, class_) for class_ in cls.widget_class_to_ignore)
 
+        @classmethod
+        def _highlighted(cls):
+            widget = cls._highlighted_ref() if cls._highlighted_ref is not None else None
+            if widget is None or isdeleted(widget):
+                return None
+            return widget
+
+        @classmethod
+        def _track(cls, widget):
+            window = widget.window()
+            watched = (widget,) if window is None or window is widget else (widget, window)
+            for w in watched:
+                w.installEventFilter(cls.tracker)
+            widget.destroyed.connect(cls.tracker.onDestroyed)
+            cls._highlighted_ref = _weak_ref(widget)
+            cls._watched_refs = tuple(_weak_ref(w) for w in watched)
+
+        @classmethod
+        def _untrack(cls):
+            widget = cls._highlighted()
+            if widget is not None:
+                try:
+                    widget.destroyed.disconnect(cls.tracker.onDestroyed)
+                except (TypeError, RuntimeError):
+                    pass
+            for ref in cls._watched_refs:
+                w = ref()
+                if w is not None and not isdeleted(w):
+                    w.removeEventFilter(cls.tracker)
+            cls._highlighted_ref = None
+            cls._watched_refs = ()
+
+        @classmethod
+        def refresh(cls):
+            """ Cover the highlighted widget again, or hide the overlay while no part of it is visible. """
+            widget = cls._highlighted()
+            if widget is None:
+                cls.unhighlight_last()
+                return
+            if not widget.isVisible() or not cls.overlay.cover(widget):
+                cls.overlay.hide()
+                return
+            cls.overlay.show()
+            cls.overlay.raise_()
+
         @classmethod
         def unhighlight_last(cls):
-            if cls.last_highlighted_widget is not None and not isdeleted(cls.last_highlighted_widget):
-                cls.last_highlighted_widget.hide()
-            cls.last_highlighted_widget = None
+            if cls.overlay is not None:
+                cls.overlay.hide()
+                cls._untrack()
 
         @classmethod
         def highlight(cls, widget):
             if cls._is_ignored(widget):
                 return
+            if not widget.isVisible():
+                cls.unhighlight_last()
+                return
 
-            if not hasattr(widget, _PQI_HIGHLIGHT_FG_NAME):
-                setattr(widget, _PQI_HIGHLIGHT_FG_NAME, _createHighlightFg(widget))
-
-            fg = getattr(widget, _PQI_HIGHLIGHT_FG_NAME)
-            fg.setFixedSize(*get_widget_size(widget))
-            fg.setStyleSheet(_get_highlight_stylesheet())
-            cls.unhighlight_last()
-            fg.show()
-            cls.last_highlighted_widget = fg
+            if cls.overlay is None:
+                cls.overlay = HighlightOverlay()
+                cls.tracker = HighlightTracker()
+            cls.overlay.setColorStr(_get_highlight_color_str())
+            if cls._highlighted() is not widget:
+                cls._untrack()
+                cls._track(widget)
+            cls.refresh()
 
         @classmethod
         def unhighlight(cls, widget):
-            fg = getattr(widget, _PQI_HIGHLIGHT_FG_NAME, None)
-            if fg is not None:
-                fg.hide()
-                if cls.last_highlighted_widget is fg:
-                    cls.last_highlighted_widget = None
+            if cls._highlighted() is widget:
+                cls.unhighlight_last()
 
     class EnteredWidgetStack:
         def __init__(self):
@@ -183,14 +301,58 @@ def patch_QtWidgets(QtModule, qt_support_mode='auto', is_attach=False):
 
     _entered_widget_stack = EnteredWidgetStack()
 
+    class HoverThrottler:
+        """ Limit how often the full info of the hovered widget is built and sent.
+
+        The full info (creation stack, parent chain, stylesheet) is sent at most every ``--hover-interval`` ms,
+        and once the cursor has rested on a widget for that long.
+        In between, only a lightweight record (id, class, geometry) is sent for each hovered widget.
+        """
+
+        def __init__(self):
+            self._interval = SetupHolder.setup.get(SetupHolder.KEY_HOVER_INTERVAL, 100)
+            self._latestWidget = None  # the full info of the latest hovered widget is not sent yet if not None
+            self._lastFullSendTime = 0.0
+            self._restTimer = None  # created in the GUI thread at the first hover
+
+        def hover(self, debugger, widget):
+            now = time.monotonic()
+            if self._interval <= 0 or (now - self._lastFullSendTime) * 1000 >= self._interval:
+                self._sendFull(debugger, widget, now)
+                return
+
+            debugger.send_hover_widget_to_server(widget)
+            self._latestWidget = widget
+            if self._restTimer is None:
+                self._restTimer = QtCore.QTimer()
+                self._restTimer.setSingleShot(True)
+                self._restTimer.timeout.connect(self.flush)
+            self._restTimer.start(self._interval)
+
+        def flush(self):
+            """ Send the full info of the latest hovered widget if only its lightweight record was sent. """
+            widget, self._latestWidget = self._latestWidget, None
+            if self._restTimer is not None:
+                self._restTimer.stop()
+            if widget is None or isdeleted(widget) or not _is_inspect_enabled():
+                return
+            self._sendFull(get_global_debugger(), widget, time.monotonic())
+
+        def _sendFull(self, debugger, widget, now: float):
+            self._latestWidget = None
+            self._lastFullSendTime = now
+            debugger.send_widget_info_to_server(widget, is_hover=True)
+
+    _hover_throttler = HoverThrottler()
+
     def _inspect_widget(debugger, widget: QtWidgets.QWidget):
         # print('inspect:', widget.__class__.__name__, widget.objectName(), widget)
-        # === send widget info === #
-        debugger.send_widget_info_to_server(widget)
-
         # === highlight widget === #
         HighlightController.highlight(widget)
 
+        # === send widget info === #
+        _hover_throttler.hover(debugger, widget)
+
         # === hook mouseReleaseEvent === #
         _mark_obj_inspected(widget)
 
@@ -209,6 +371,30 @@ def patch_QtWidgets(QtModule, qt_support_mode='auto', is_attach=False):
 
     class EventListener(QtCore.QObject):
 
+        def __init__(self, eventTypes):
+            """
+            :param eventTypes: the types of the events handled by this listener,
+                see `PERMANENT_EVENT_TYPES` and `INSPECT_EVENT_TYPES`
+            """
+            super().__init__()
+            # event type -> (handler, whether it only matters while inspecting, whether it is for the patched widgets only)
+            # The handlers return whether to intercept the event.
+            dispatchTable = {
+                EventEnum.Enter: (self._handleEnterEvent, True, True),
+                EventEnum.Leave: (self._handleLeaveEvent, True, True),
+                EventEnum.MouseButtonPress: (self._handleMousePressEvent, True, True),
+                EventEnum.MouseButtonRelease: (self._handleMouseReleaseEvent, True, True),
+                EventEnum.ContextMenu: (self._handleContextMenuEvent, True, True),
+                EventEnum.User: (self._handleCustomEvent, False, True),
+                EventEnum.ChildAdded: (self._handleHierarchyChangeEvent, False, True),
+                EventEnum.ChildRemoved: (self._handleHierarchyChangeEvent, False, True),
+                # The ancestors created by C++ are cached too (see `AncestryCache`), they are not patched
+                EventEnum.ParentChange: (self._handleHierarchyChangeEvent, False, False),
+                # The top-level widgets created by C++ (e.g. the popups) are shown in the tree too
+                EventEnum.Show: (self._handleShowEvent, False, False),
+            }
+            self._dispatchTable = {eventType: dispatchTable[eventType] for eventType in eventTypes}
+
         def _handleEnterEvent(self, obj, event):
             if not _is_inspect_enabled():
                 return
@@ -287,6 +473,8 @@ def patch_QtWidgets(QtModule, qt_support_mode='auto', is_attach=False):
                     return False
 
             # inspect finished
+            # The server must have the full info of the selected widget
+            _hover_throttler.flush()
             debugger.notify_inspect_finished(obj)
             debugger.disable_inspect()
             HighlightController.unhighlight(obj)
@@ -346,31 +534,52 @@ def patch_QtWidgets(QtModule, qt_support_mode='auto', is_attach=False):
             # Prevent the context menu from popping up
             return debugger is not None and debugger.mock_left_button_down
 
+        def _handleHierarchyChangeEvent(self, obj, event):
+            """ Track the changes of the control tree shown by the server. """
+            debugger = get_global_debugger()
+            if debugger is None:
+                return
+            if event.type() == EventEnum.ParentChange:
+                debugger.ancestry_cache.notify_parent_changed(obj)
+                debugger.control_tree.notify_parent_changed(obj)
+            # The child of a ChildRemoved event may be partially destroyed, don't touch it
+            elif event.type() == EventEnum.ChildRemoved or event.child().isWidgetType():
+                debugger.control_tree.notify_children_changed(obj)
+
+        def _handleShowEvent(self, obj, event):
+            """ A new top-level widget changes the children of the root of the control tree. """
+            debugger = get_global_debugger()
+            if debugger is not None and obj.isWidgetType() and obj.isWindow():
+                debugger.control_tree.notify_shown(obj)
+
         def eventFilter(self, obj, event):
-            # Intercept `QDynamicPropertyChange` events for properties dynamically
-            # added by PyQtInspect itself (like `_pqi_inspected`).
-            with log_exception(suppress=True):
-                if (event.type() == EventEnum.DynamicPropertyChange
-                        and bytes(event.propertyName()) == _PQI_INSPECTED_PROP_NAME_BYTES):
-                    return True
+            # Called for every event of the application: most of them (paint, timers, mouse moves...)
+            #   are not in the table, and return at the first lookup.
+            entry = self._dispatchTable.get(event.type())
+            if entry is None:
+                return False
+            handler, onlyWhenInspecting, onlyForPatched = entry
+            if onlyWhenInspecting and not _is_inspect_enabled():
+                return False
 
-                if not _isWidgetPatched(obj):
+            with log_exception(suppress=True):
+                if onlyForPatched and not _isWidgetPatched(obj):
                     return False
-
-                if event.type() == EventEnum.Enter:
-                    self._handleEnterEvent(obj, event)
-                elif event.type() == EventEnum.Leave:
-                    self._handleLeaveEvent(obj, event)
-                elif event.type() == EventEnum.MouseButtonPress:
-                    return self._handleMousePressEvent(obj, event)
-                elif event.type() == EventEnum.MouseButtonRelease:
-                    return self._handleMouseReleaseEvent(obj, event)
-                elif event.type() == EventEnum.ContextMenu:
-                    return self._handleContextMenuEvent(obj, event)
-                elif event.type() == EventEnum.User:
-                    self._handleCustomEvent(obj, event)
+                return bool(handler(obj, event))
             return False
 
+    # Handled by the listener installed for the lifetime of the application
+    PERMANENT_EVENT_TYPES = (
+        EventEnum.User,  # highlight and code execution requested by the server
+        EventEnum.ChildAdded, EventEnum.ChildRemoved, EventEnum.ParentChange, EventEnum.Show,  # control tree changes
+    )
+    # Handled by the listener installed while inspecting only
+    INSPECT_EVENT_TYPES = (
+        EventEnum.Enter, EventEnum.Leave,
+        EventEnum.MouseButtonPress, EventEnum.MouseButtonRelease,
+        EventEnum.ContextMenu,
+    )
+
     if IS_WINDOWS:
         class NativeEventListener(QtCore.QAbstractNativeEventFilter):
             """
@@ -435,6 +644,48 @@ def patch_QtWidgets(QtModule, qt_support_mode='auto', is_attach=False):
     else:
         NativeEventListener = None
 
+    class InspectSession(QtCore.QObject):
+        """ Install the event filters only needed while inspecting (hover, click...) when the inspection is enabled,
+        and remove them when it is disabled, so that the application doesn't pay for them the rest of the time.
+        """
+
+        def __init__(self):
+            super().__init__()
+            self._eventFilter = None
+            self._nativeEventFilter = None
+
+        def sync(self):
+            """ Follow the state of `PyDB.inspect_enabled`, the filters are changed in the main thread. Thread-safe. """
+            QtCore.QCoreApplication.postEvent(self, QtCore.QEvent(EventEnum.User))
+
+        def event(self, event):
+            if event.type() != EventEnum.User:
+                return super().event(event)
+            with log_exception(suppress=True):
+                if _is_inspect_enabled():
+                    self._install()
+                else:
+                    self._uninstall()
+            return True
+
+        def _install(self):
+            app = QtWidgets.QApplication.instance()
+            if self._eventFilter is None:
+                self._eventFilter = EventListener(INSPECT_EVENT_TYPES)
+                app.installEventFilter(self._eventFilter)
+            if self._nativeEventFilter is None and NativeEventListener is not None:
+                self._nativeEventFilter = NativeEventListener()
+                app.installNativeEventFilter(self._nativeEventFilter)
+
+        def _uninstall(self):
+            app = QtWidgets.QApplication.instance()
+            if self._eventFilter is not None:
+                app.removeEventFilter(self._eventFilter)
+                self._eventFilter = None
+            if self._nativeEventFilter is not None:
+                app.removeNativeEventFilter(self._nativeEventFilter)
+                self._nativeEventFilter = None
+
     def _initGlobalEventFilter():
         """ Initialize the global event filters when it does not exist """
         debugger = get_global_debugger()
@@ -457,42 +708,68 @@ def patch_QtWidgets(QtModule, qt_support_mode='auto', is_attach=False):
 
         # Global event filter
         if debugger.global_event_filter is None:
-            eventFilter = EventListener()
+            eventFilter = EventListener(PERMANENT_EVENT_TYPES)
             # We need to move the event filter to the main thread
             eventFilter.moveToThread(topLevelWgt.thread())
             debugger.global_event_filter = eventFilter
             app.installEventFilter(eventFilter)
 
-        # Global native event filter
-        if debugger.global_native_event_filter is None and NativeEventListener is not None:
-            nativeEventFilter = NativeEventListener()
-            debugger.global_native_event_filter = nativeEventFilter
-            app.installNativeEventFilter(nativeEventFilter)
+        # The filters only needed while inspecting
+        if debugger.inspect_session is None:
+            inspectSession = InspectSession()
+            inspectSession.moveToThread(topLevelWgt.thread())
+            debugger.inspect_session = inspectSession
+            inspectSession.sync()  # the inspection may have been enabled before the first widget is created
+
+    class PendingPatches:
+        """ The work to do on the new widgets once their `__init__` is finished.
+
+        Rather than a zero-timer (and a closure) per widget, the widgets are queued
+        and a single zero-timer per event loop turn processes all of them.
+        """
+
+        def __init__(self):
+            self._toMark = []
+            self._toExtraPatch = []
+
+        def mark(self, widget):
+            self._toMark.append(widget)
+            self._schedule()
+
+        def extraPatch(self, widget):
+            self._toExtraPatch.append(widget)
+            self._schedule()
+
+        def _schedule(self):
+            if len(self._toMark) + len(self._toExtraPatch) == 1:
+                QtCore.QTimer.singleShot(0, self._flush)
+
+        def _flush(self):
+            toMark, self._toMark = self._toMark, []
+            toExtraPatch, self._toExtraPatch = self._toExtraPatch, []
+            for widget in toMark:
+                # Bug Fixed 20240819: the widget may have been deleted meanwhile
+                if not isdeleted(widget):
+                    _markPatched(widget)
+            for widget in toExtraPatch:
+                with log_exception(suppress=True):
+                    _extraPatchAfterInit(widget)
+
+    _pendingPatches = PendingPatches()
 
     def _patchWidget(obj, *, attach=False):
         """ Install event listener and register widget to debugger """
         debugger = get_global_debugger()
         assert debugger is not None
         if not attach:
-            # We use the Qt property system to mark the widget inspected
-            #   because Python binding instance may change and lose the mark
-            # To avoid the situation that attributes being dynamically added inside the `__init__` method
-            #   and Qt inside directly executing the `event` method.
-            # At this point, some custom classes may not have fully initialized
-            #   and the event method can reference an uninitialized attribute.
-            # So we use the QTimer and wait for `__init__` to finish.
-            # ---
-            # Bug Fixed 20240819: when the widget is deleted, the QTimer will not be executed.
-            #   So we need to check if the widget is deleted before setting the property.
-            # ---
-            QtCore.QTimer.singleShot(0, lambda: _markPatched(obj) if not isdeleted(obj) else None)
+            # Mark the widget once its `__init__` is finished: some custom classes are not fully initialized yet,
+            #   the filters must not handle their events before.
+            _pendingPatches.mark(obj)
         else:
-            # Attach thread may be different from the main thread,
-            #   so the timer method will be invalid.
-            # We just set the property directly because the widget has been initialized.
+            # The widget has been initialized.
             _markPatched(obj)
         # === register widget === #
-        _register_widget(obj)
+        _register_widget(obj, attach)
 
 
     def _needExtraPatchAfterInit(obj):
@@ -559,6 +836,23 @@ def patch_QtWidgets(QtModule, qt_support_mode='auto', is_attach=False):
                 _patchWidget(button)
 
 
+    # The creation stack is recorded for every widget, read the options once
+    setup = SetupHolder.setup or {}
+    stack_capture_mode = setup.get(SetupHolder.KEY_STACK_CAPTURE, StackCaptureMode.FULL)
+    stack_max_depth = setup.get(SetupHolder.KEY_STACK_MAX_DEPTH, 0)
+    # `_filter_trace_stack` skips the frames of `getStackFrame` and `_new_QWidget_init`, then keeps `depth - 1` frames
+    stack_max_frames = max(stack_max_depth - 1, 0) if stack_max_depth else None
+    defer_stack_names = stack_capture_mode == StackCaptureMode.DEFERRED
+    stack_capture_policy = StackCapturePolicy.from_setup(setup)
+    if stack_capture_policy.is_unrestricted:
+        stack_capture_policy = None
+    else:
+        atexit.register(stack_capture_policy.log_counters)
+        # Also logged periodically, to follow them while the application runs
+        _debugger = get_global_debugger()
+        if _debugger is not None:
+            _debugger.add_stats_source(stack_capture_policy.format_counters)
+
     def _new_QWidget_init(self, *args, **kwargs):
         self._original_QWidget_init(*args, **kwargs)
         if not ispycreated(self):
@@ -566,8 +860,14 @@ def patch_QtWidgets(QtModule, qt_support_mode='auto', is_attach=False):
             return
 
         # === save stack when create === #
-        frames = getStackFrame()
-        setattr(self, _PQI_STACK_WHEN_CREATED_ATTR, frames)
+        # (skipped by the capture policy: `get_create_stack` returns an empty stack)
+        if stack_capture_policy is None or stack_capture_policy.should_capture(self):
+            if stack_capture_mode == StackCaptureMode.FULL:
+                frames = getStackFrame()
+            else:
+                # skip `captureCompactStack` and `_new_QWidget_init`
+                frames = captureCompactStack(stack_max_frames, defer_stack_names, skip=2)
+            setattr(self, _PQI_STACK_WHEN_CREATED_ATTR, frames)
 
         # Initialize the global filter when it does not exist
         _initGlobalEventFilter()
@@ -581,7 +881,7 @@ def patch_QtWidgets(QtModule, qt_support_mode='auto', is_attach=False):
         # These child widgets cannot be captured in the current _new_QWidget_init method.
         # We need to delay and capture these child widgets in the later loop.
         if _needExtraPatchAfterInit(self):
-            QtCore.QTimer.singleShot(0, lambda: _extraPatchAfterInit(self))
+            _pendingPatches.extraPatch(self)
 
     def _pqi_exec(self: QtWidgets.QWidget, code):
         debugger = get_global_debugger()
@@ -603,22 +903,95 @@ def patch_QtWidgets(QtModule, qt_support_mode='auto', is_attach=False):
     # ================================#
     #            ATTACH               #
     # ================================#
-    def _patch_old_widgets_when_attached():
-        # Initialize the global filter when beginning attach
-        _initGlobalEventFilter()
-        # Patch the existing widgets
-        topLevelWidgets = QtWidgets.QApplication.topLevelWidgets()
-        widgetsToPatch = collections.deque(topLevelWidgets)
-        while widgetsToPatch:  # BFS traverse
-            widget = widgetsToPatch.popleft()
+    class AttachPatcher(QtCore.QObject):
+        """ Patch the widgets existing when attached, in the main thread.
 
-            if isdeleted(widget) or not ispycreated(widget):
-                continue
+        The work is split in chunks of `CHUNK_MS`, one per event loop iteration,
+        so that the application stays responsive while tens of thousands of widgets are patched.
+        The progress is reported to the server.
+        """
+        CHUNK_MS = 10
+        PROGRESS_INTERVAL_S = 0.2
+
+        _running = set()  # keep the patchers alive until they are done
+
+        def __init__(self):
+            super().__init__()
+            # The widgets whose children are not expanded yet, seeded in the main thread.
+            # The tree is walked incrementally: a recursive `findChildren` may exceed the budget of a chunk alone.
+            self._pending = None
+            self._visited_count = 0
+            self._last_progress_time = 0
+
+        def start(self):
+            self._running.add(self)
+            self.moveToThread(QtWidgets.QApplication.instance().thread())
+            self._post_next_chunk()
+
+        def _post_next_chunk(self):
+            QtCore.QCoreApplication.postEvent(self, QtCore.QEvent(EventEnum.User))
+
+        @staticmethod
+        def _root_widgets():
+            """ The top-level widgets without a parent: a top-level widget with one (e.g. a dialog)
+            is reached from its parent, so that each widget is visited once.
+            """
+            return collections.deque(
+                widget for widget in QtWidgets.QApplication.topLevelWidgets()
+                if widget.parentWidget() is None and widget.objectName() != _PQI_HIGHLIGHT_FG_NAME
+            )
+
+        def event(self, event):
+            if event.type() != EventEnum.User:
+                return super().event(event)
+            with log_exception(suppress=True):
+                self._patch_chunk()
+            return True
 
-            # === patch widget ===
-            _patchWidget(widget, attach=True)
+        def _patch_chunk(self):
+            if self._pending is None:
+                self._pending = self._root_widgets()
+
+            deadline = time.perf_counter() + self.CHUNK_MS / 1000
+            pending = self._pending
+            while pending and time.perf_counter() < deadline:
+                widget = pending.popleft()
+                if isdeleted(widget):
+                    continue
+                self._visited_count += 1
+                pending.extend(child for child in widget.children() if isinstance(child, QtWidgets.QWidget))
+                if not ispycreated(widget) or _isWidgetPatched(widget):
+                    continue
+                _patchWidget(widget, attach=True)
+
+            done = not pending
+            now = time.monotonic()
+            if done or now - self._last_progress_time >= self.PROGRESS_INTERVAL_S:
+                self._last_progress_time = now
+                self._notify_progress(done)
+
+            if done:
+                pqi_log.info(f"Patched {self._visited_count} existing widgets.")
+                self._pending = None
+                self._running.discard(self)
+            else:
+                self._post_next_chunk()
+
+        def _notify_progress(self, done: bool):
+            debugger = get_global_debugger()
+            if debugger is not None:
+                # The total grows while the tree is walked
+                total = self._visited_count + len(self._pending)
+                debugger.send_attach_progress_message(self._visited_count, total, done)
 
-            widgetsToPatch.extend(widget.findChildren(QtWidgets.QWidget))
+    # ================================#
+    #            ATTACH               #
+    # ================================#
+    def _patch_old_widgets_when_attached():
+        # Initialize the global filter when beginning attach
+        _initGlobalEventFilter()
+        # Patch the existing widgets in the main thread, the widgets created from now on are patched by `__init__`
+        AttachPatcher().start()
 
     # For PyQt, patching the base QWidget class is sufficient.
     # For PySide, every QWidget subclass needs to be patched.
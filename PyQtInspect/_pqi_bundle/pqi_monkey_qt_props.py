@@ -5,11 +5,22 @@ def _random_suffix() -> str:
 
 _SUFFIX = _random_suffix()
 
+
+def get_own_attr(obj, name: str, default=None):
+    """ Read a mark set in the wrapper of an object.
+    `getattr` would fall back to the `__getattr__` of the class, which may recurse infinitely
+    while the `__init__` of the object is not finished (e.g. Spyder MainWindow).
+    """
+    try:
+        return object.__getattribute__(obj, name)
+    except AttributeError:
+        return default
+
 # Marks
 _PQI_MOCKED_EVENT_ATTR = f'_pqi_mocked{_SUFFIX}'
-_PQI_INSPECTED_PROP_NAME = f'_pqi_inspected{_SUFFIX}'
-_PQI_INSPECTED_PROP_NAME_BYTES = bytes(_PQI_INSPECTED_PROP_NAME, 'utf-8')
 _PQI_WIDGET_INSPECTED_MARK = f'_pqi_inspected_mark{_SUFFIX}'
+# Set in the wrapper of the patched widgets
+_PQI_PATCHED_MARK_ATTR = f'_pqi_patched_mark{_SUFFIX}'
 
 # Highlight foreground widget name
 _PQI_HIGHLIGHT_FG_NAME = f'_pqi_highlight_fg{_SUFFIX}'
@@ -17,6 +28,15 @@ _PQI_HIGHLIGHT_FG_NAME = f'_pqi_highlight_fg{_SUFFIX}'
 # Create stack
 _PQI_STACK_WHEN_CREATED_ATTR = f'_pqi_stack_when_created{_SUFFIX}'
 
+# The handle identifying the object on the wire, see `WidgetRegistry`
+_PQI_HANDLE_ATTR = f'_pqi_handle{_SUFFIX}'
+
+# Set in the wrapper of the objects whose name changes invalidate their ancestry, see `AncestryCache`
+_PQI_NAME_WATCHED_ATTR = f'_pqi_name_watched{_SUFFIX}'
+
+# Set in the wrapper of the top-level widgets whose destruction changes the control tree, see `ControlTree`
+_PQI_TOP_LEVEL_WATCHED_ATTR = f'_pqi_top_level_watched{_SUFFIX}'
+
 # Event custom attrs
 _PQI_CUSTOM_EVENT_IS_ENTER_ATTR = '_pqi_is_enter'
 _PQI_CUSTOM_EVENT_IS_HIGHLIGHT_ATTR = '_pqi_is_highlight'
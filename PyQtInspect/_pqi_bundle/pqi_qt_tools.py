@@ -2,12 +2,11 @@
 import typing
 
 from PyQtInspect._pqi_bundle import pqi_log
-from PyQtInspect._pqi_bundle.pqi_comm_constants import TreeViewKeys
 from PyQtInspect._pqi_bundle.pqi_monkey_qt_props import (
     _PQI_CUSTOM_EVENT_IS_HIGHLIGHT_ATTR, _PQI_CUSTOM_EVENT_EXEC_CODE_ATTR, _PQI_STACK_WHEN_CREATED_ATTR,
-    _PQI_HIGHLIGHT_FG_NAME,
 )
 from PyQtInspect._pqi_bundle.pqi_path_helper import find_pqi_module_path, is_relative_to
+from PyQtInspect._pqi_bundle.pqi_stack_tools import CompactStack
 
 
 def _filter_trace_stack(traceStacks):
@@ -16,7 +15,11 @@ def _filter_trace_stack(traceStacks):
     stackMaxDepth = SetupHolder.setup[SetupHolder.KEY_STACK_MAX_DEPTH]
     showPqiStack = SetupHolder.setup[SetupHolder.KEY_SHOW_PQI_STACK]
     pqi_module_path = find_pqi_module_path()
-    stacks = traceStacks[2:stackMaxDepth + 1] if stackMaxDepth != 0 else traceStacks[2:]
+    if isinstance(traceStacks, CompactStack):
+        # Already cut when recorded, see `_new_QWidget_init`
+        stacks = traceStacks.resolve()
+    else:
+        stacks = traceStacks[2:stackMaxDepth + 1] if stackMaxDepth != 0 else traceStacks[2:]
     for filename, lineno, func_name in stacks:
         if not showPqiStack and is_relative_to(filename, pqi_module_path):
             break
@@ -53,8 +56,9 @@ def find_method_by_name_and_call(obj, name, *args, **kwargs):
         raise ValueError('The object is None, cannot find method by name')
     assert obj is not None, f'obj is None, cannot find method {name}'
 
-    if callable(getattr(obj, name)):
-        return getattr(obj, name)(*args, **kwargs)
+    method = getattr(obj, name)
+    if callable(method):
+        return method(*args, **kwargs)
     else:
         # Sometimes, ``obj`` has a variable with the same name as the method
         return find_callable_var(obj, name)(obj, *args, **kwargs)
@@ -90,7 +94,8 @@ def get_widget_parent(widget):
     return find_method_by_name_and_call(widget, 'parent')
 
 
-def get_parent_info(widget):
+def get_parent_info(widget, handle_of: typing.Callable[[typing.Any], int]):
+    """ Iterate the (class name, handle, object name) of the ancestors of the widget. """
     while True:
         try:
             parent = get_widget_parent(widget)
@@ -100,23 +105,17 @@ def get_parent_info(widget):
         if parent is None:
             break
         widget = parent
-        yield get_widget_class_name(widget), id(widget), get_widget_object_name(widget)
+        yield get_widget_class_name(widget), handle_of(widget), get_widget_object_name(widget)
 
 
 def get_stylesheet(widget):
     return find_method_by_name_and_call(widget, 'styleSheet')
 
 
-def get_children_info(widget):
-    from PyQtInspect.pqi import SetupHolder
-    need_to_include_fg = SetupHolder.setup.get(SetupHolder.KEY_IS_DEBUG_MODE, False) if SetupHolder.setup else False
-
+def get_children_info(widget, handle_of: typing.Callable[[typing.Any], int]):
     children = find_method_by_name_and_call(widget, 'children')
     for child in children:
-        obj_name = get_widget_object_name(child)
-        if obj_name == _PQI_HIGHLIGHT_FG_NAME and not need_to_include_fg:
-            continue
-        yield get_widget_class_name(child), id(child), get_widget_object_name(child)
+        yield get_widget_class_name(child), handle_of(child), get_widget_object_name(child)
 
 
 def get_create_stack(widget):
@@ -131,127 +130,6 @@ def _get_full_class_name(o):
     return module + '.' + klass.__qualname__
 
 
-def get_control_tree() -> typing.List[typing.Dict]:
-    # === Helper functions ===
-    def _get_object_identifier(obj):
-        """ Get the object identifier of the obj.
-        If the widget has an objectName, return it;
-        Otherwise, return the hex id of the widget.
-        """
-        if isinstance(obj, QtWidgets.QSpacerItem):
-            return 'Spacer'
-
-        objectName = get_widget_object_name(obj)
-        if objectName:
-            return objectName
-        return hex(id(obj))
-
-    class _InfoBuilder:
-        @staticmethod
-        def _init_info(obj):
-            return {
-                TreeViewKeys.OBJ_ID_KEY: id(obj),
-                TreeViewKeys.OBJ_NAME_KEY: _get_object_identifier(obj),
-                TreeViewKeys.OBJ_CLS_NAME_KEY: _get_full_class_name(obj),
-                TreeViewKeys.CHILDREN_KEY: [],
-                TreeViewKeys.CHILD_CNT_KEY: 0,
-            }
-
-        @staticmethod
-        def build_widget_info(widget):
-            info = _InfoBuilder._init_info(widget)
-            info[TreeViewKeys.CHILD_CNT_KEY] = traverse_widget(widget, info[TreeViewKeys.CHILDREN_KEY])
-            return info
-
-        @staticmethod
-        def build_layout_info(layout, visitedWidgets):
-            info = _InfoBuilder._init_info(layout)
-            info[TreeViewKeys.CHILD_CNT_KEY] = traverse_layout(layout, visitedWidgets, info[TreeViewKeys.CHILDREN_KEY])
-            return info
-
-        @staticmethod
-        def build_spacer_info(spacer):
-            return _InfoBuilder._init_info(spacer)
-
-    def traverse_widget(parent, child_info_list) -> int:
-        """ Traverse the children of the parent widget and add the children info to the childrenInfoList.
-        :param parent: the parent widget
-        :param child_info_list: the list to store the children info
-        :return: the number of widgets in the parent widget's hierarchy
-        """
-        widget_cnt = 0
-
-        # Avoid visiting the same widget multiple times
-        # When a widget is in a layout, don't visit it again when calling parent.children()
-        visited = set()
-
-        # ------ ATTENTION ------
-        # We use explicit function call instead of binding to the parent.layout()
-        # because sometimes it is shadowed by the same name variable in `__dict__`
-        # -----------------------
-        layout = QtWidgets.QWidget.layout(parent)
-        if layout is not None:
-            # Traverse the layout first
-            layout_info = _InfoBuilder.build_layout_info(layout, visited)
-            widget_cnt += layout_info[TreeViewKeys.CHILD_CNT_KEY]
-            child_info_list.append(layout_info)
-
-        for widget in QtWidgets.QWidget.children(parent):
-            if not widget.isWidgetType() or id(widget) in visited or widget.objectName() == _PQI_HIGHLIGHT_FG_NAME:
-                continue
-            widget_cnt += 1
-
-            widget_info = _InfoBuilder.build_widget_info(widget)
-            widget_cnt += widget_info[TreeViewKeys.CHILD_CNT_KEY]
-            child_info_list.append(widget_info)
-
-        return widget_cnt
-
-    def traverse_layout(parent_layout, visited_widgets, child_info_list) -> int:
-        """ Traverse the parent layout and add the child widgets info to the child_info_list.
-        :param parent_layout: the parentLayout to traverse
-        :param visited_widgets: the set of visited widgets
-        :param child_info_list: the list to store the children info
-        :return: the number of widgets in the parentLayout
-        """
-        widget_cnt = 0
-        for i in range(parent_layout.count()):
-            item = parent_layout.itemAt(i)
-            if isinstance(item, QtWidgets.QWidgetItem):
-                widget = item.widget()
-                if widget is None or id(widget) in visited_widgets:
-                    continue
-
-                visited_widgets.add(id(widget))
-                widget_cnt += 1
-
-                widget_info = _InfoBuilder.build_widget_info(widget)
-                widget_cnt += widget_info[TreeViewKeys.CHILD_CNT_KEY]
-                child_info_list.append(widget_info)
-            elif isinstance(item, QtWidgets.QSpacerItem):
-                child_info_list.append(_InfoBuilder.build_spacer_info(item))
-            elif isinstance(item, QtWidgets.QLayoutItem):
-                layout = item.layout()
-                layout_info = _InfoBuilder.build_layout_info(layout, visited_widgets)
-                widget_cnt += layout_info[TreeViewKeys.CHILD_CNT_KEY]
-                child_info_list.append(layout_info)
-
-        return widget_cnt
-
-    from PyQtInspect.pqi import SetupHolder
-
-    QtLib = import_Qt(SetupHolder.setup[SetupHolder.KEY_QT_SUPPORT])
-    QtWidgets, QtGui = QtLib.QtWidgets, QtLib.QtGui  # noqa
-
-    top_level_widgets = QtWidgets.QApplication.topLevelWidgets()
-    res = []
-
-    for topLevelWidget in top_level_widgets:
-        widget_info = _InfoBuilder.build_widget_info(topLevelWidget)
-        res.append(widget_info)
-    return res
-
-
 def import_Qt(qt_type: str):
     """
     Import Qt libraries by type.
@@ -286,15 +164,19 @@ def import_wrap_module(qt_type: str):
     if qt_type == 'pyqt5':
         from PyQt5 import sip as wrap_module
         wrap_module._pqi_is_valid = lambda x: wrap_module.isdeleted(x) == False
+        wrap_module._pqi_is_created_by_python = wrap_module.ispycreated
     elif qt_type == 'pyqt6':
         from PyQt6 import sip as wrap_module
         wrap_module._pqi_is_valid = lambda x: wrap_module.isdeleted(x) == False
+        wrap_module._pqi_is_created_by_python = wrap_module.ispycreated
     elif qt_type == 'pyside2':
         import shiboken2 as wrap_module
         wrap_module._pqi_is_valid = wrap_module.isValid
+        wrap_module._pqi_is_created_by_python = wrap_module.createdByPython
     elif qt_type == 'pyside6':
         import shiboken6 as wrap_module
         wrap_module._pqi_is_valid = wrap_module.isValid
+        wrap_module._pqi_is_created_by_python = wrap_module.createdByPython
     else:
         raise ValueError(f'Unsupported Qt type: {qt_type}')
 
@@ -336,3 +218,13 @@ def is_wrapped_pointer_valid(ptr):
     """
     from PyQtInspect.pqi import SetupHolder
     return import_wrap_module(SetupHolder.setup[SetupHolder.KEY_QT_SUPPORT])._pqi_is_valid(ptr)
+
+
+def is_created_by_python(ptr):
+    """
+    Check if a wrapped object was created by Python (rather than by C++, e.g. the line edit of a spin box).
+
+    :param ptr: The object to check.
+    """
+    from PyQtInspect.pqi import SetupHolder
+    return import_wrap_module(SetupHolder.setup[SetupHolder.KEY_QT_SUPPORT])._pqi_is_created_by_python(ptr)
@@ -5,24 +5,51 @@ from PyQtInspect._pqi_bundle.pqi_comm_constants import WidgetPropsKeys
 from PyQtInspect._pqi_bundle.pqi_qt_tools import (
     find_method_by_name_and_call, find_method_by_name_and_safe_call
 )
-from PyQtInspect._pqi_bundle.pqi_qt_widget_props_fetcher._types_repr import get_representation
+from PyQtInspect._pqi_bundle.pqi_qt_widget_props_fetcher._types_repr import get_repr_function
 
 __all__ = [
     'WidgetPropertiesGetter',
 ]
 
 
+class _MethodCallFetcher:
+    """ A property fetcher calling a method of the object without arguments.
+    The method is resolved once per widget class when the fetch plan of the class is compiled.
+    """
+    __slots__ = ('method_name',)
+
+    def __init__(self, method_name: str):
+        self.method_name = method_name
+
+    def __call__(self, o):
+        return find_method_by_name_and_call(o, self.method_name)
+
+    def resolve(self, widget_cls) -> typing.Callable[[object], typing.Any]:
+        """ Find the unbound method in the MRO of ``widget_cls``, as `find_method_by_name_and_call` does. """
+        for base in widget_cls.__mro__:
+            cls_var = vars(base).get(self.method_name)
+            if cls_var is not None and callable(cls_var):
+                return cls_var
+        raise AttributeError(self.method_name)
+
+
 def _generate_prop_fetcher_by_calling_method(method_name: str) -> typing.Callable[[object], typing.Any]:
     """
     Generate a property fetcher function that calls a method by its name.
     :param method_name: The name of the method to call.
     :return: A function that takes an object and returns the result of calling the method on it.
     """
-    return lambda o: find_method_by_name_and_call(o, method_name)
+    return _MethodCallFetcher(method_name)
+
+
+# A compiled fetch plan: for each class with properties, from the base class to the most derived class,
+# its name and the (property name, fetcher) pairs
+_FetchPlan = typing.Tuple[typing.Tuple[str, typing.Tuple[typing.Tuple[str, typing.Callable[[object], typing.Any]], ...]], ...]
 
 
 class WidgetPropertiesGetter:
     def __init__(self):
+        self._plans = {}  # type: typing.Dict[type, _FetchPlan]
         self._fetchers = {
             'QObject': {
                 'objectName': _generate_prop_fetcher_by_calling_method('objectName'),
@@ -490,21 +517,45 @@ class WidgetPropertiesGetter:
               ...
           ]
         """
+        widget_cls = type(widget)
+        plan = self._plans.get(widget_cls)
+        if plan is None:
+            plan = self._plans[widget_cls] = self._compile_plan(widget_cls)
+
         res = []
-        for cls in reversed(type(widget).__mro__):
-            cls_name = cls.__name__
-            if cls_name in self._fetchers:
-                props = {}
-                cls_info = {
-                    WidgetPropsKeys.CLASSNAME_KEY: cls_name,
-                    WidgetPropsKeys.PROPS_KEY: props,
-                }
+        for cls_name, fetchers in plan:
+            props = {}
+            for prop, fetcher in fetchers:
+                try:
+                    val = fetcher(widget)
+                    props[prop] = get_repr_function(type(val))(val)
+                except Exception as e:  # noqa
+                    pqi_log.warning(f'Failed to fetch property {prop} of {cls_name}: {e}')
+            res.append({
+                WidgetPropsKeys.CLASSNAME_KEY: cls_name,
+                WidgetPropsKeys.PROPS_KEY: props,
+            })
+        return res
 
-                for prop, fetcher in self._fetchers[cls_name].items():
+    def _compile_plan(self, widget_cls) -> _FetchPlan:
+        """
+        Compile the fetch plan of a widget class: walk its MRO and resolve the methods to call once,
+        so that fetching the properties of its instances is a flat loop.
+        """
+        plan = []
+        for cls in reversed(widget_cls.__mro__):
+            cls_name = cls.__name__
+            if cls_name not in self._fetchers:
+                continue
+            fetchers = []
+            for prop, fetcher in self._fetchers[cls_name].items():
+                if isinstance(fetcher, _MethodCallFetcher):
                     try:
-                        val = fetcher(widget)
-                        props[prop] = get_representation(val)
-                    except Exception as e:  # noqa
+                        fetcher = fetcher.resolve(widget_cls)
+                    except AttributeError as e:
+                        # e.g. the property was introduced in a later version of Qt
                         pqi_log.warning(f'Failed to fetch property {prop} of {cls_name}: {e}')
-                res.append(cls_info)
-        return res
+                        continue
+                fetchers.append((prop, fetcher))
+            plan.append((cls_name, tuple(fetchers)))
+        return tuple(plan)
@@ -1,4 +1,4 @@
-from ._base import get_representation
+from ._base import get_representation, get_repr_function
 
 # Import all type representation modules to register them but don't pollute the namespace
 from . import _ordinary_types_reprs as _
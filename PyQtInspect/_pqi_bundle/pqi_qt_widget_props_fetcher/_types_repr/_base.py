@@ -7,6 +7,7 @@ from PyQtInspect._pqi_bundle.pqi_qt_tools import import_Qt
 __all__ = [
     'TypeRepr',
     'get_representation',
+    'get_repr_function',
 ]
 
 
@@ -55,7 +56,7 @@ class TypeRepr(abc.ABC):
                 f'Invalid __type__ attribute in {cls.__name__}. It should be a string or an iterable of strings.')
 
     @classmethod
-    @functools.lru_cache(maxsize=1)
+    @functools.lru_cache(maxsize=None)  # one instance per representation class
     def instance(cls) -> 'TypeRepr':
         """
         Get the enum representation class for this enum.
@@ -83,11 +84,25 @@ class TypeRepr(abc.ABC):
         return import_Qt(SetupHolder.setup[SetupHolder.KEY_QT_SUPPORT])
 
 
+# The representation function of each value type, resolved by the qualified name of the type once
+_type_to_repr_function = {}  # type: typing.Dict[type, typing.Callable[[typing.Any], typing.Union[str, dict]]]
+
+
+def get_repr_function(type_) -> typing.Callable[[typing.Any], typing.Union[str, dict]]:
+    """
+    Get the function giving the representation of the values of a type.
+    :param type_: The type of the values.
+    """
+    func = _type_to_repr_function.get(type_)
+    if func is None:
+        func = _type_to_repr_function[type_] = TypeRepr.get_type_repr(type_.__qualname__).instance()._repr_impl
+    return func
+
+
 def get_representation(value) -> typing.Union[str, dict]:
     """
     Get the string representation of a value.
     :param value: The value to get the representation for.
     :return: A string representation of the value.
     """
-    repr_cls = TypeRepr.get_type_repr(type(value).__qualname__)
-    return repr_cls.repr(value)
+    return get_repr_function(type(value))(value)
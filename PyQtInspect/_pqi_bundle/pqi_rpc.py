@@ -0,0 +1,256 @@
+# -*- encoding:utf-8 -*-
+# ==============================================
+# Description: Correlate the replies with their requests by sequence number
+# ==============================================
+import collections
+import heapq
+import threading
+import time
+import typing
+
+from PyQtInspect._pqi_bundle import pqi_log
+from PyQtInspect._pqi_bundle.pqi_comm_constants import CMD_REQ_WIDGET_INFO, CMD_WIDGET_INFO, CMD_REQ_CHILDREN_INFO, \
+    CMD_CHILDREN_INFO, CMD_REQ_CONTROL_TREE, CMD_CONTROL_TREE, CMD_REQ_WIDGET_PROPS, CMD_WIDGET_PROPS, ID_TO_MEANING
+
+__all__ = [
+    'REQUEST_TO_REPLY',
+    'RequestFuture',
+    'PendingRequests',
+]
+
+# The requests which are answered by a reply echoing their seq, and the command id of the reply.
+REQUEST_TO_REPLY = {
+    CMD_REQ_WIDGET_INFO: CMD_WIDGET_INFO,
+    CMD_REQ_CHILDREN_INFO: CMD_CHILDREN_INFO,
+    CMD_REQ_CONTROL_TREE: CMD_CONTROL_TREE,
+    CMD_REQ_WIDGET_PROPS: CMD_WIDGET_PROPS,
+}
+
+_REPLY_COMMANDS = frozenset(REQUEST_TO_REPLY.values())
+
+
+class RequestFuture:
+    """ The pending reply of a request.
+
+    The callbacks are called in the thread which completes the future:
+    the reader thread for a reply, the timeout thread for a timeout, or the caller of `cancel`.
+    """
+    PENDING = 'pending'
+    DONE = 'done'
+    CANCELLED = 'cancelled'
+    TIMED_OUT = 'timed-out'
+
+    def __init__(self, cmd_id: int, seq: int, owner: 'PendingRequests'):
+        self.cmd_id = cmd_id
+        self.seq = seq
+        self.state = self.PENDING
+        self._owner = owner
+        self._text = None
+        self._callbacks = []
+        self._event = threading.Event()
+
+    def done(self) -> bool:
+        return self.state != self.PENDING
+
+    def cancelled(self) -> bool:
+        return self.state == self.CANCELLED
+
+    def cancel(self) -> bool:
+        """ Cancel the request, the peer is told to skip it if it hasn't started working on it yet.
+        :return: whether the request was still pending.
+        """
+        return self._owner.cancel(self.seq)
+
+    def add_done_callback(self, fn: typing.Callable[['RequestFuture'], None]):
+        with self._owner.lock:
+            if not self.done():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def result(self, timeout: typing.Optional[float] = None) -> typing.Optional[str]:
+        """ Wait for the reply and return its text, None if the request is cancelled or timed out. """
+        self._event.wait(timeout)
+        return self._text
+
+    def _complete(self, state: str, text: typing.Optional[str] = None):
+        """ Called by the owner, which has removed the future from the pending ones. """
+        self._text = text
+        self.state = state
+        self._event.set()
+        callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception:
+                pqi_log.error('Error in the callback of request %s' % self.seq, exc_info=True)
+
+
+class _TimeoutScheduler:
+    """ Expire the requests of all the `PendingRequests` from a single thread.
+
+    There is a `PendingRequests` per client: a timeout thread each would cost a thread per client again,
+    which the selector engine exists to avoid.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._deadline_changed = threading.Condition(self._lock)
+        self._deadlines = []  # heap of (deadline, counter, owner, seq), the counter breaks the ties
+        self._counter = 0
+        self._thread = None
+
+    def schedule(self, owner: 'PendingRequests', seq: int, timeout: float):
+        with self._lock:
+            self._counter += 1
+            heapq.heappush(self._deadlines, (time.monotonic() + timeout, self._counter, owner, seq))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._expire_requests, name='pqi.RequestTimeouts')
+                self._thread.daemon = True
+                self._thread.start()
+            self._deadline_changed.notify()
+
+    def _expire_requests(self):
+        while True:
+            with self._lock:
+                expired = []
+                while not expired:
+                    now = time.monotonic()
+                    while self._deadlines and self._deadlines[0][0] <= now:
+                        _, _, owner, seq = heapq.heappop(self._deadlines)
+                        expired.append((owner, seq))
+                    if not expired:
+                        self._deadline_changed.wait(self._deadlines[0][0] - now if self._deadlines else None)
+
+            # The owners are called without the lock, they may schedule again from their callbacks
+            for owner, seq in expired:
+                owner._expire(seq)
+
+
+_timeout_scheduler = _TimeoutScheduler()
+
+
+class PendingRequests:
+    """ The requests sent to one peer and not answered yet.
+
+    A request may be registered with a ``supersede_key``: a new request with the same key
+    cancels the pending one, e.g. the props of the widget selected before.
+
+    A request which times out is reported to its callbacks, but its reply is still accepted if it comes later
+    and the request hasn't been superseded meanwhile (e.g. the control tree of a huge application).
+    """
+    # The number of timed-out requests whose late reply is still accepted, the oldest ones are forgotten
+    MAX_TIMED_OUT = 64
+
+    def __init__(self, send_cancel: typing.Callable[[int], None]):
+        """
+        :param send_cancel: called with the seq of a request which is cancelled (or superseded)
+            while pending or timed out, to tell the peer it can skip it.
+        """
+        self._send_cancel = send_cancel
+        self.lock = threading.Lock()
+        self._pending = {}  # type: typing.Dict[int, RequestFuture]
+        self._timed_out = collections.OrderedDict()  # type: collections.OrderedDict[int, None]
+        # supersede key (a command id, or a tuple such as (command id, root id)) <-> seq of the latest request
+        self._seq_by_supersede_key = {}  # type: typing.Dict[typing.Hashable, int]
+        self._supersede_key_by_seq = {}  # type: typing.Dict[int, typing.Hashable]
+
+    def add(self, cmd, supersede_key: typing.Optional[typing.Hashable] = None,
+            timeout: typing.Optional[float] = None) -> RequestFuture:
+        """ Register the request ``cmd`` (a `NetCommand`) before it is sent. """
+        future = RequestFuture(cmd.id, cmd.seq, self)
+        superseded = None
+        with self.lock:
+            if supersede_key is not None:
+                superseded = self._seq_by_supersede_key.get(supersede_key)
+                if superseded is not None:
+                    del self._supersede_key_by_seq[superseded]
+                self._seq_by_supersede_key[supersede_key] = cmd.seq
+                self._supersede_key_by_seq[cmd.seq] = supersede_key
+            self._pending[cmd.seq] = future
+        if timeout is not None:
+            _timeout_scheduler.schedule(self, cmd.seq, timeout)
+        if superseded is not None:
+            self.cancel(superseded)
+        return future
+
+    def resolve(self, cmd_id: int, seq: int, text: str, is_own_seq: typing.Callable[[int], bool]) -> bool:
+        """ Complete the request answered by a received command.
+
+        :param is_own_seq: tells whether ``seq`` was generated by this side, i.e. whether the command is a reply.
+        :return: False if the command answers a request which is not pending anymore (cancelled, superseded
+            or timed out) and must be ignored, True otherwise.
+        """
+        if cmd_id not in _REPLY_COMMANDS or not is_own_seq(seq):
+            return True  # not a reply (e.g. the info of the hovered widget) or a peer which doesn't echo the seq
+
+        with self.lock:
+            is_late = seq in self._timed_out
+            future = self._pop(seq)
+        if future is None:
+            if is_late:
+                pqi_log.info('Accepting the late reply %s (seq: %s)' % (ID_TO_MEANING.get(str(cmd_id), cmd_id), seq))
+                return True
+            pqi_log.debug('Ignoring the stale reply %s (seq: %s)' % (ID_TO_MEANING.get(str(cmd_id), cmd_id), seq))
+            return False
+        future._complete(RequestFuture.DONE, text)
+        return True
+
+    def cancel(self, seq: int) -> bool:
+        return self._finish(seq, RequestFuture.CANCELLED)
+
+    def close(self):
+        """ Cancel all the pending requests without telling the peer (the connection is closed). """
+        with self.lock:
+            futures = list(self._pending.values())
+            self._pending.clear()
+            self._timed_out.clear()
+            self._seq_by_supersede_key.clear()
+            self._supersede_key_by_seq.clear()
+        for future in futures:
+            future._complete(RequestFuture.CANCELLED)
+
+    def _finish(self, seq: int, state: str) -> bool:
+        """ :return: whether the request was still pending. """
+        with self.lock:
+            was_timed_out = seq in self._timed_out
+            future = self._pop(seq)
+        if future is None and not was_timed_out:
+            return False
+        try:
+            self._send_cancel(seq)
+        except Exception:
+            pqi_log.error('Failed to cancel request %s' % seq, exc_info=True)
+        if future is None:
+            return False
+        future._complete(state)
+        return True
+
+    def _pop(self, seq: int) -> typing.Optional[RequestFuture]:
+        """ Forget a pending or timed-out request, called with the lock held. """
+        future = self._pending.pop(seq, None)
+        if future is None and seq in self._timed_out:
+            del self._timed_out[seq]
+        self._forget_supersede_key(seq)
+        return future
+
+    def _forget_supersede_key(self, seq: int):
+        """ Called with the lock held. """
+        key = self._supersede_key_by_seq.pop(seq, None)
+        if key is not None:
+            del self._seq_by_supersede_key[key]
+
+    def _expire(self, seq: int):
+        """ Called by the timeout thread, the request may have been answered or cancelled meanwhile.
+        The peer is not told to skip it: its reply is still wanted until the request is superseded.
+        """
+        with self.lock:
+            future = self._pending.pop(seq, None)
+            if future is None:
+                return
+            # Its supersede key is kept, a newer request of the same kind still supersedes it
+            self._timed_out[seq] = None
+            while len(self._timed_out) > self.MAX_TIMED_OUT:
+                self._forget_supersede_key(self._timed_out.popitem(last=False)[0])
+        pqi_log.warning('Request %s (%s) timed out' % (seq, ID_TO_MEANING.get(str(future.cmd_id), future.cmd_id)))
+        future._complete(RequestFuture.TIMED_OUT)
@@ -0,0 +1,187 @@
+# -*- encoding:utf-8 -*-
+# ==============================================
+# Description: Record the messages received by the server to a session directory, and read them back
+# ==============================================
+# A session is a directory of chunk files. Each chunk holds the records of a few megabytes of messages,
+# compressed at once with the preferred codec of `pqi_compression` by a background thread:
+#   header: magic (8s), codec flag (B), padding (3x), record count (I)
+#   payload: the records, each one a (timestamp, dispatcher id, cmd id, seq, text length) header and the UTF-8 text
+# The oldest chunks are deleted when there are more than ``max_chunks`` of them.
+import collections
+import os
+import queue
+import struct
+import threading
+import time
+import typing
+
+from PyQtInspect._pqi_bundle import pqi_log
+from PyQtInspect._pqi_bundle.pqi_compression import available_compressions, get_codec, get_codec_by_flag, \
+    NO_COMPRESSION_FLAG
+
+__all__ = [
+    'SessionRecord',
+    'SessionRecorder',
+    'iter_session',
+    'SESSION_CHUNK_SUFFIX',
+]
+
+SESSION_CHUNK_SUFFIX = '.pqisession'
+
+_MAGIC = b'PQISESS\0'
+_CHUNK_HEADER = struct.Struct('<8sB3xI')
+_RECORD_HEADER = struct.Struct('<dIIqI')  # timestamp, dispatcher id, cmd id, seq, text length
+
+SessionRecord = collections.namedtuple('SessionRecord', 'timestamp dispatcher_id cmd_id seq text')
+
+
+def _chunk_name(index: int) -> str:
+    return f'chunk-{index:06d}{SESSION_CHUNK_SUFFIX}'
+
+
+def _list_chunks(directory: str) -> typing.List[str]:
+    """ The chunk files of a session, from the oldest. """
+    return sorted(name for name in os.listdir(directory)
+                  if name.startswith('chunk-') and name.endswith(SESSION_CHUNK_SUFFIX))
+
+
+class SessionRecorder:
+    """ Append the received messages to a session directory.
+
+    `record` is called by the threads receiving the messages, it only appends to an in-memory chunk;
+    the full chunks are compressed and written by the thread of the recorder.
+    A chunk is also written when it has been left partially filled for ``FLUSH_INTERVAL``,
+    so that the session is readable while the server is still running.
+    """
+    CHUNK_SIZE = 4 * 1024 * 1024  # in bytes, before the compression
+    MAX_CHUNKS = 256
+    FLUSH_INTERVAL = 5.0  # in seconds
+
+    def __init__(self, directory: str, chunk_size: int = CHUNK_SIZE, max_chunks: int = MAX_CHUNKS):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._chunk_size = chunk_size
+        self._max_chunks = max_chunks
+        self._codec = get_codec(available_compressions()[0])
+
+        # Continue the numbering of an existing session, the replay goes through both
+        existing = _list_chunks(directory)
+        self._next_index = int(existing[-1][len('chunk-'):-len(SESSION_CHUNK_SUFFIX)]) + 1 if existing else 0
+
+        self._lock = threading.Lock()
+        self._buffer = bytearray()
+        self._count = 0
+        self._closed = False
+        self._full_chunks = queue.Queue()  # type: queue.Queue[typing.Optional[typing.Tuple[bytes, int]]]
+        self._thread = threading.Thread(target=self._write_chunks, name='pqi.SessionRecorder')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def record(self, dispatcher_id: int, cmd_id: int, seq: int, text: str):
+        data = text.encode('utf-8', 'surrogatepass')
+        header = _RECORD_HEADER.pack(time.time(), dispatcher_id, cmd_id, seq, len(data))
+        with self._lock:
+            if self._closed:
+                return
+            self._buffer += header
+            self._buffer += data
+            self._count += 1
+            if len(self._buffer) >= self._chunk_size:
+                self._hand_over_chunk()
+
+    def flush(self):
+        """ Write the messages recorded so far, even if their chunk is not full. """
+        with self._lock:
+            if self._count:
+                self._hand_over_chunk()
+
+    def close(self):
+        """ Write the last chunk and wait for the thread of the recorder. """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            if self._count:
+                self._hand_over_chunk()
+            self._full_chunks.put(None)
+        self._thread.join()
+
+    def _hand_over_chunk(self):
+        """ Called with the lock held. """
+        self._full_chunks.put((bytes(self._buffer), self._count))
+        self._buffer.clear()
+        self._count = 0
+
+    def _write_chunks(self):
+        while True:
+            try:
+                chunk = self._full_chunks.get(timeout=self.FLUSH_INTERVAL)
+            except queue.Empty:
+                self.flush()
+                continue
+            if chunk is None:
+                return
+            try:
+                self._write_chunk(*chunk)
+            except OSError:
+                pqi_log.warning(f'Failed to write a chunk of the session {self.directory}.', exc_info=True)
+
+    def _write_chunk(self, records: bytes, count: int):
+        if self._codec is not None:
+            payload, flag = self._codec.compress(records), self._codec.flag
+        else:
+            payload, flag = records, NO_COMPRESSION_FLAG
+        path = os.path.join(self.directory, _chunk_name(self._next_index))
+        self._next_index += 1
+        # Written aside then renamed, so that a reader never sees a truncated chunk
+        with open(path + '.tmp', 'wb') as f:
+            f.write(_CHUNK_HEADER.pack(_MAGIC, flag, count))
+            f.write(payload)
+        os.replace(path + '.tmp', path)
+        self._rotate()
+
+    def _rotate(self):
+        chunks = _list_chunks(self.directory)
+        for name in chunks[:max(0, len(chunks) - self._max_chunks)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+
+def _read_chunk(path: str) -> typing.Iterator[SessionRecord]:
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < _CHUNK_HEADER.size:
+        raise ValueError(f'{path} is not a session chunk: it is truncated')
+    magic, flag, count = _CHUNK_HEADER.unpack_from(data)
+    if magic != _MAGIC:
+        raise ValueError(f'{path} is not a session chunk')
+    records = memoryview(data)[_CHUNK_HEADER.size:]
+    if flag != NO_COMPRESSION_FLAG:
+        codec = get_codec_by_flag(flag)
+        try:
+            records = memoryview(codec.decompress(records))
+        except Exception as e:
+            raise ValueError(f'{path} is corrupted: {e}') from None
+
+    offset = 0
+    for _ in range(count):
+        if offset + _RECORD_HEADER.size > len(records):
+            raise ValueError(f'{path} is corrupted: it holds less than {count} records')
+        timestamp, dispatcher_id, cmd_id, seq, length = _RECORD_HEADER.unpack_from(records, offset)
+        offset += _RECORD_HEADER.size
+        text = str(records[offset:offset + length], 'utf-8', 'surrogatepass')
+        offset += length
+        yield SessionRecord(timestamp, dispatcher_id, cmd_id, seq, text)
+
+
+def iter_session(path: str) -> typing.Iterator[SessionRecord]:
+    """ The records of a session directory (or of a single chunk file), in the order they were received.
+    Raise ValueError if a chunk is malformed, or if the codec it is compressed with is not available.
+    """
+    if os.path.isfile(path):
+        yield from _read_chunk(path)
+        return
+    for name in _list_chunks(path):
+        yield from _read_chunk(os.path.join(path, name))
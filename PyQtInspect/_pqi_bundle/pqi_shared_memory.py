@@ -0,0 +1,118 @@
+# -*- encoding:utf-8 -*-
+# ==============================================
+# Description: A shared-memory ring buffer for the bulk payloads of the local transport
+# ==============================================
+# The inspected process (the only producer) writes large payloads, such as control trees and property dumps,
+# into the ring, and only sends their position through the socket.
+# The server (the only consumer) reads them in the order of the frames and publishes how far it has read,
+# so that the producer can reuse the space. When the ring is full, the payload is simply sent inline.
+import struct
+import sys
+import typing
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python 3.7
+    shared_memory = None
+
+__all__ = [
+    'is_shared_memory_supported',
+    'SharedMemoryRing',
+]
+
+
+def is_shared_memory_supported() -> bool:
+    return shared_memory is not None
+
+
+class SharedMemoryRing:
+    """ A single-producer single-consumer ring of payloads in a `multiprocessing.shared_memory` segment.
+
+    Positions are logical (they never wrap), the physical offset is ``position % capacity``.
+    A payload is always contiguous: if it doesn't fit before the end of the segment, the producer skips to the start.
+    """
+    DEFAULT_CAPACITY = 16 * 1024 * 1024
+
+    # The consumer publishes its read position at the start of the segment, followed by the capacity
+    # (the size of an attached segment may be rounded up to the page size on some platforms).
+    # The data starts on the next cache line.
+    _READ_POS = struct.Struct('Q')
+    _CAPACITY = struct.Struct('Q')
+    _CAPACITY_OFFSET = 8
+    _DATA_OFFSET = 64
+
+    def __init__(self, shm, is_owner: bool):
+        self._shm = shm
+        self._is_owner = is_owner
+        self.capacity, = self._CAPACITY.unpack_from(shm.buf, self._CAPACITY_OFFSET)
+        self._write_pos = 0  # producer only
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @classmethod
+    def create(cls, capacity: int = DEFAULT_CAPACITY) -> 'SharedMemoryRing':
+        """ Create the segment, by the producer. """
+        shm = shared_memory.SharedMemory(create=True, size=cls._DATA_OFFSET + capacity)
+        cls._READ_POS.pack_into(shm.buf, 0, 0)
+        cls._CAPACITY.pack_into(shm.buf, cls._CAPACITY_OFFSET, capacity)
+        return cls(shm, True)
+
+    @classmethod
+    def attach(cls, name: str) -> 'SharedMemoryRing':
+        """ Attach to the segment created by the producer, by the consumer. """
+        if sys.version_info >= (3, 13):
+            shm = shared_memory.SharedMemory(name, track=False)
+        else:
+            shm = shared_memory.SharedMemory(name)
+            # The segment belongs to the producer, don't let the resource tracker of this process unlink it on exit.
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, False)
+
+    def put(self, payload: bytes) -> typing.Optional[int]:
+        """ Copy ``payload`` into the ring, by the producer.
+        :return: its position, or None if there is not enough free space (the payload must be sent inline).
+        """
+        size = len(payload)
+        if size > self.capacity:
+            return None
+
+        pos = self._write_pos
+        offset = pos % self.capacity
+        if offset + size > self.capacity:
+            pos += self.capacity - offset  # skip the tail of the segment
+            offset = 0
+        read_pos, = self._READ_POS.unpack_from(self._shm.buf, 0)
+        if pos + size - read_pos > self.capacity:
+            return None  # the consumer is lagging behind
+
+        start = self._DATA_OFFSET + offset
+        self._shm.buf[start:start + size] = payload
+        self._write_pos = pos + size
+        return pos
+
+    def read(self, pos: int, size: int) -> memoryview:
+        """ The payload at ``pos``, by the consumer. The view must be released before calling `release`. """
+        start = self._DATA_OFFSET + pos % self.capacity
+        return self._shm.buf[start:start + size]
+
+    def release(self, end_pos: int):
+        """ Give the space before ``end_pos`` back to the producer, by the consumer. """
+        self._READ_POS.pack_into(self._shm.buf, 0, end_pos)
+
+    def unlink(self):
+        """ Remove the name of the segment, by the producer. The mappings stay valid until they are closed. """
+        if self._is_owner:
+            try:
+                self._shm.unlink()
+            except OSError:
+                pass
+
+    def close(self):
+        self.unlink()
+        try:
+            self._shm.close()
+        except (OSError, BufferError):
+            pass  # still read by a thread which is exiting
@@ -4,8 +4,11 @@
 
 import sys
 import inspect
+import time
 import typing
 
+from PyQtInspect._pqi_bundle import pqi_log
+
 
 class FrameInfo(typing.NamedTuple):
     """ The information of a frame in the stack. """
@@ -48,3 +51,188 @@ def getStackFrame(useGetFrame=True) -> typing.List[FrameInfo]:
 
         return frames
     return [FrameInfo(*frame[1:4]) for frame in inspect.stack()]
+
+
+# region Compact stacks
+class StackCaptureMode:
+    """ How the creation stack of a widget is recorded in `_new_QWidget_init`. """
+    # Record every frame as a `FrameInfo`.
+    FULL = 'full'
+    # Record at most `--stack-max-depth` frames, as interned (filename, line_no, func_name) tuples.
+    FAST = 'fast'
+    # Like FAST, but record interned (code object, line_no) pairs,
+    #   the file and function names are only read when the stack is requested by the server.
+    DEFERRED = 'deferred'
+
+    ALL = (FULL, FAST, DEFERRED)
+
+
+def convert_stack_capture_mode(mode: str) -> str:
+    """Validate a stack capture mode read from the command line."""
+    mode = mode.lower()
+    if mode not in StackCaptureMode.ALL:
+        raise ValueError(f'Invalid stack capture mode: {mode}, expected one of {StackCaptureMode.ALL}')
+    return mode
+
+
+class CompactStack(tuple):
+    """ A stack recorded by `captureCompactStack`, from the innermost frame.
+
+    The frames and the stacks are interned: a call site (or a whole stack, e.g. widgets created in a loop)
+    met many times is stored once, and each widget only keeps a reference to the shared tuple.
+    """
+    __slots__ = ()
+
+    def resolve(self) -> typing.List[FrameInfo]:
+        # The deferred frames are (code object, line_no) pairs
+        return [FrameInfo(frame[0].co_filename, frame[1], frame[0].co_name) if len(frame) == 2 else FrameInfo(*frame)
+                for frame in self]
+
+
+# The interned frames, keyed by (id(code), line_no) for the deferred ones:
+#   hashing a code object hashes its bytecode and constants. The ids stay valid as the table keeps the code objects.
+_internedFrames = {}  # type: typing.Dict[tuple, tuple]
+# The interned stacks, keyed by the ids of their (interned) frames
+_internedStacks = {}  # type: typing.Dict[typing.Tuple[int, ...], CompactStack]
+# Stop interning new stacks beyond this count, e.g. for deeply recursive creations all different;
+#   the frames are bounded by the code of the application and are always interned.
+_MAX_INTERNED_STACKS = 65536
+
+
+def captureCompactStack(maxFrames: typing.Optional[int] = None, deferNames: bool = False,
+                        skip: int = 1) -> CompactStack:
+    """ Record the stack of the caller, much cheaper than `getStackFrame`.
+
+    :param maxFrames: the maximum number of frames to record, None for all of them
+    :param deferNames: record the code objects instead of reading the file and function names now
+    :param skip: the number of innermost frames to skip, 1 skips this function
+    """
+    frame = sys._getframe(skip)
+    frames = []
+    while frame is not None and (maxFrames is None or len(frames) < maxFrames):
+        code = frame.f_code
+        lineNo = frame.f_lineno  # read it now, it changes while the frame runs
+        if deferNames:
+            key = (id(code), lineNo)
+            interned = _internedFrames.get(key)
+            if interned is None:
+                interned = _internedFrames[key] = (code, lineNo)
+        else:
+            key = (code.co_filename, lineNo, code.co_name)
+            interned = _internedFrames.setdefault(key, key)
+        frames.append(interned)
+        frame = frame.f_back
+
+    stackKey = tuple(map(id, frames))
+    stack = _internedStacks.get(stackKey)
+    if stack is None:
+        stack = CompactStack(frames)
+        if len(_internedStacks) < _MAX_INTERNED_STACKS:
+            _internedStacks[stackKey] = stack
+    return stack
+# endregion
+
+
+# region Capture policy
+def convert_class_names(names: str) -> str:
+    """Normalize a comma-separated list of class names read from the command line."""
+    return ','.join(name.strip() for name in names.split(',') if name.strip())
+
+
+class StackCapturePolicy:
+    """ Decide which widgets get their creation stack recorded, to bound the cost in long runs.
+
+    - ``classes``/``excluded_classes``: comma-separated class names, plain (``QLabel``) or qualified
+      (``PyQt5.QtWidgets.QLabel``), a widget matches if one of its classes (including the bases) is listed.
+      The excluded classes win over the allowed ones, an empty allow list allows every class.
+    - ``first_n``: only record the first N instances of each class, 0 for no limit.
+    - ``max_rate``: record at most this many stacks per second (with a burst of as many, at least one),
+      0 for no limit.
+
+    Called in the GUI thread only.
+    """
+
+    def __init__(self, classes: str = '', excluded_classes: str = '', first_n: int = 0, max_rate: float = 0):
+        self._classes = frozenset(filter(None, classes.split(',')))
+        self._excluded_classes = frozenset(filter(None, excluded_classes.split(',')))
+        self._first_n = first_n
+        self._max_rate = max_rate
+        # A rate below 1 (e.g. one stack every 2 seconds) still needs a bucket holding a whole token
+        self._capacity = max(float(max_rate), 1.0)
+        self._tokens = self._capacity
+        self._last_refill = time.monotonic()
+
+        self._type_to_allowed = {}  # type: typing.Dict[type, bool]
+        self._type_to_count = {}  # type: typing.Dict[type, int]
+
+        self.recorded_count = 0
+        self.skipped_by_class_count = 0
+        self.skipped_by_limit_count = 0
+        self.skipped_by_rate_count = 0
+
+    @classmethod
+    def from_setup(cls, setup: dict) -> 'StackCapturePolicy':
+        from PyQtInspect._pqi_common.pqi_setup_holder import SetupHolder
+
+        return cls(setup.get(SetupHolder.KEY_STACK_CLASSES, ''),
+                   setup.get(SetupHolder.KEY_STACK_EXCLUDED_CLASSES, ''),
+                   setup.get(SetupHolder.KEY_STACK_FIRST_N, 0),
+                   setup.get(SetupHolder.KEY_STACK_MAX_RATE, 0))
+
+    @property
+    def is_unrestricted(self) -> bool:
+        return not (self._classes or self._excluded_classes or self._first_n or self._max_rate)
+
+    @property
+    def skipped_count(self) -> int:
+        return self.skipped_by_class_count + self.skipped_by_limit_count + self.skipped_by_rate_count
+
+    def _is_type_allowed(self, type_: type) -> bool:
+        names = set()
+        for klass in type_.__mro__:
+            names.add(klass.__name__)
+            names.add(f'{klass.__module__}.{klass.__qualname__}')
+        if not names.isdisjoint(self._excluded_classes):
+            return False
+        return not self._classes or not names.isdisjoint(self._classes)
+
+    def _take_token(self) -> bool:
+        now = time.monotonic()
+        self._tokens = min(self._tokens + (now - self._last_refill) * self._max_rate, self._capacity)
+        self._last_refill = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def should_capture(self, widget) -> bool:
+        type_ = type(widget)
+        allowed = self._type_to_allowed.get(type_)
+        if allowed is None:
+            allowed = self._type_to_allowed[type_] = self._is_type_allowed(type_)
+        if not allowed:
+            self.skipped_by_class_count += 1
+            return False
+
+        if self._first_n:
+            count = self._type_to_count.get(type_, 0)
+            if count >= self._first_n:
+                self.skipped_by_limit_count += 1
+                return False
+            self._type_to_count[type_] = count + 1
+
+        if self._max_rate and not self._take_token():
+            self.skipped_by_rate_count += 1
+            return False
+
+        self.recorded_count += 1
+        return True
+
+    def format_counters(self) -> str:
+        return (f'Creation stacks: {self.recorded_count} recorded, {self.skipped_count} skipped '
+                f'({self.skipped_by_class_count} by class, {self.skipped_by_limit_count} by the per-class limit, '
+                f'{self.skipped_by_rate_count} by the rate limit)')
+
+    def log_counters(self):
+        pqi_log.info(self.format_counters())
+# endregion
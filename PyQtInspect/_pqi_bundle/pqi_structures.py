@@ -43,6 +43,22 @@ class QWidgetInfo:
     extra: dict = dataclasses.field(default_factory=dict)
 
 
+@dataclasses.dataclass
+class QWidgetHoverInfo:
+    """A dataclass for storing the lightweight information of a QWidget hovered in inspect mode.
+    The fields have the same meaning as in `QWidgetInfo`.
+    """
+    class_name: str
+
+    object_name: str
+
+    id: int
+
+    size: tuple
+
+    pos: tuple
+
+
 @dataclasses.dataclass
 class QWidgetChildrenInfo:
     """A dataclass for storing information about a QWidget's ancestor."""
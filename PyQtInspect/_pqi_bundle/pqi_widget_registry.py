@@ -0,0 +1,134 @@
+# -*- encoding:utf-8 -*-
+# ==============================================
+# Description: The registry of the widgets the server can refer to
+# ==============================================
+# The widgets are identified on the wire by a handle, a number which is never reused,
+# so that a request about a deleted widget can't reach a newer object allocated at the same address.
+import collections
+import itertools
+import threading
+import typing
+import weakref
+
+from PyQtInspect._pqi_bundle.pqi_monkey_qt_props import _PQI_HANDLE_ATTR, get_own_attr
+from PyQtInspect._pqi_bundle.pqi_qt_tools import is_wrapped_pointer_valid, is_created_by_python
+
+__all__ = [
+    'WidgetRegistry',
+]
+
+
+class WidgetRegistry:
+    """ Map the handles to the registered widgets.
+
+    The handle of an object is stored in its wrapper. A widget created by Python is held weakly:
+    its wrapper lives as long as the C++ object, and the entry is evicted when the wrapper is collected.
+    The widgets created by C++ (such as ``QSpinBox.lineEdit()``) have no reference at the Python level,
+    their wrappers would be collected and they couldn't be found anymore: they are held strongly,
+    and evicted when their `destroyed` signal is emitted.
+    The registrations of the attach path also check a few strong entries, the deleted ones are evicted.
+    """
+    # The number of strong entries checked at each registration which sweeps
+    SWEEP_BATCH = 4
+
+    def __init__(self):
+        self._lock = threading.RLock()  # the weak reference callbacks may run in the middle of a registration
+        self._next_handle = itertools.count(1)
+        self._handle_to_ref = {}  # type: typing.Dict[int, weakref.ref]
+        self._handle_to_widget = {}  # type: typing.Dict[int, typing.Any]
+        self._sweep_queue = collections.deque()  # the strong entries to check
+
+        self.evicted_count = 0
+
+    @property
+    def size(self) -> int:
+        return len(self._handle_to_ref) + len(self._handle_to_widget)
+
+    @property
+    def strong_count(self) -> int:
+        return len(self._handle_to_widget)
+
+    def handle_of(self, obj) -> int:
+        """ The handle of an object, allocated at the first call. The object isn't registered. """
+        handle = get_own_attr(obj, _PQI_HANDLE_ATTR)
+        if handle is None:
+            with self._lock:
+                handle = get_own_attr(obj, _PQI_HANDLE_ATTR)  # allocated by another thread meanwhile
+                if handle is None:
+                    handle = next(self._next_handle)
+                    setattr(obj, _PQI_HANDLE_ATTR, handle)
+        return handle
+
+    def allocate_handle(self) -> int:
+        """ A new handle for something without a lasting wrapper to store it in (e.g. a spacer item). """
+        with self._lock:
+            return next(self._next_handle)
+
+    def format_stats(self) -> str:
+        return (f'Widget registry: {self.size} widgets ({self.strong_count} held strongly), '
+                f'{self.evicted_count} evicted')
+
+    def register(self, widget, *, sweep: bool = False) -> int:
+        """ Register a widget so that `get` finds it by its handle.
+        :param sweep: whether to check a few strong entries too
+        :return: its handle
+        """
+        handle = self.handle_of(widget)
+        with self._lock:
+            if handle in self._handle_to_ref or handle in self._handle_to_widget:
+                return handle
+            if is_created_by_python(widget):
+                try:
+                    self._handle_to_ref[handle] = weakref.ref(widget, lambda _, h=handle: self._on_collected(h))
+                    return handle
+                except TypeError:
+                    pass  # the binding doesn't support weak references
+            self._handle_to_widget[handle] = widget
+            self._watch_destroyed(widget, handle)
+            if sweep:
+                self._sweep_locked(self.SWEEP_BATCH)
+        return handle
+
+    def get(self, handle: int):
+        """ The registered widget, None if it is unknown or deleted. """
+        with self._lock:
+            ref = self._handle_to_ref.get(handle)
+            widget = ref() if ref is not None else self._handle_to_widget.get(handle)
+            if widget is None:
+                return None
+            if not is_wrapped_pointer_valid(widget):
+                self._evict_locked(handle)
+                return None
+            return widget
+
+    def _watch_destroyed(self, widget, handle: int):
+        try:
+            widget.destroyed.connect(lambda *_, h=handle: self._on_destroyed(h))
+        except (AttributeError, TypeError, RuntimeError):
+            pass  # evicted by a sweep or by `get`
+
+    def _on_destroyed(self, handle: int):
+        with self._lock:
+            self._evict_locked(handle)
+
+    def _on_collected(self, handle: int):
+        with self._lock:
+            if self._handle_to_ref.pop(handle, None) is not None:
+                self.evicted_count += 1
+
+    def _evict_locked(self, handle: int):
+        if self._handle_to_ref.pop(handle, None) is not None or self._handle_to_widget.pop(handle, None) is not None:
+            self.evicted_count += 1
+
+    def _sweep_locked(self, count: int):
+        """ Check the next ``count`` strong entries, round-robin. """
+        for _ in range(count):
+            if not self._sweep_queue:
+                self._sweep_queue.extend(self._handle_to_widget)
+                if not self._sweep_queue:
+                    return
+            handle = self._sweep_queue.popleft()
+            widget = self._handle_to_widget.get(handle)
+            if widget is not None and not is_wrapped_pointer_valid(widget):
+                del self._handle_to_widget[handle]
+                self.evicted_count += 1
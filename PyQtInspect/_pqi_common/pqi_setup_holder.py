@@ -11,10 +11,20 @@ class SetupHolder:
     KEY_IS_AUTO_DISCOVER_QT_LIB = 'is-auto-discover-qt-lib'
     KEY_STACK_MAX_DEPTH = 'stack-max-depth'
     KEY_SHOW_PQI_STACK = 'show-pqi-stack'
+    KEY_STACK_CAPTURE = 'stack-capture'
+    KEY_STACK_CLASSES = 'stack-classes'
+    KEY_STACK_EXCLUDED_CLASSES = 'stack-excluded-classes'
+    KEY_STACK_FIRST_N = 'stack-first-n'
+    KEY_STACK_MAX_RATE = 'stack-max-rate'
+    KEY_HOVER_INTERVAL = 'hover-interval'
     KEY_DIRECT = 'direct'
     KEY_FILE = 'file'
     KEY_MODULE = 'module'
     KEY_HELP = 'help'
+    KEY_WRITER_QUEUE_SIZE = 'writer-queue-size'
+    KEY_WRITER_DROP_POLICY = 'writer-drop-policy'
+    KEY_TRANSPORT = 'transport'
+    KEY_SHARED_MEMORY = 'shared-memory'
 
     KEY_IS_DEBUG_MODE = 'DEBUG'
     KEY_DEBUG_RECORD_SOCKET_READS = 'DEBUG_RECORD_SOCKET_READS'
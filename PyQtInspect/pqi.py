@@ -15,20 +15,26 @@ pyqt_inspect_module_dir = str(pathlib.Path(__file__).resolve().parent.parent)
 if pyqt_inspect_module_dir not in sys.path:
     sys.path.insert(0, pyqt_inspect_module_dir)
 
-from PyQtInspect._pqi_bundle.pqi_comm_constants import CMD_PROCESS_CREATED, CMD_QT_PATCH_SUCCESS
-from PyQtInspect._pqi_bundle.pqi_qt_tools import exec_code_in_widget, get_parent_info, get_widget_size, get_widget_pos, \
-    get_stylesheet, get_children_info, set_widget_highlight, get_widget_object_name, is_wrapped_pointer_valid, \
-    get_create_stack, get_control_tree
+from PyQtInspect._pqi_bundle.pqi_comm_constants import CMD_PROCESS_CREATED, CMD_QT_PATCH_SUCCESS, TreeViewExtraKeys
+from PyQtInspect._pqi_bundle.pqi_qt_tools import exec_code_in_widget, get_widget_size, get_widget_pos, \
+    get_stylesheet, get_children_info, set_widget_highlight, get_widget_object_name, \
+    get_create_stack
+from PyQtInspect._pqi_bundle.pqi_control_tree import ControlTree
+from PyQtInspect._pqi_bundle.pqi_widget_registry import WidgetRegistry
+from PyQtInspect._pqi_bundle.pqi_ancestry_cache import AncestryCache
 from PyQtInspect._pqi_bundle.pqi_qt_widget_props_fetcher import WidgetPropertiesGetter
 import threading
 import _thread as thread
 from PyQtInspect._pqi_bundle.pqi_contants import get_current_thread_id, SHOW_DEBUG_INFO_ENV, DebugInfoHolder, IS_WINDOWS, DEFAULT_HIGHLIGHT_COLOR
 from PyQtInspect._pqi_bundle.pqi_comm import PyDBDaemonThread, ReaderThread, get_global_debugger, set_global_debugger, \
-    WriterThread, start_client, start_server, CommunicationRole, NetCommand, NetCommandFactory
+    WriterThread, start_client, start_server, CommunicationRole, NetCommand, NetCommandFactory, CoalesceKeys, DropPolicy, \
+    is_local_socket, run_as_pydevd_daemon_thread
 from PyQtInspect._pqi_bundle.pqi_typing import OptionalDict
-from PyQtInspect._pqi_bundle.pqi_structures import QWidgetInfo, QWidgetChildrenInfo
+from PyQtInspect._pqi_bundle.pqi_structures import QWidgetInfo, QWidgetChildrenInfo, QWidgetHoverInfo
 from PyQtInspect._pqi_bundle import pqi_log
-from PyQtInspect._pqi_bundle.pqi_connect_tools import random_port
+from PyQtInspect._pqi_bundle.pqi_connect_tools import random_port, is_loopback_host, Transport
+from PyQtInspect._pqi_bundle.pqi_shared_memory import SharedMemoryRing, is_shared_memory_supported
+from PyQtInspect._pqi_bundle.pqi_compression import available_compressions
 from PyQtInspect._pqi_bundle.pqi_path_helper import find_pqi_server_gui_entry
 
 import traceback
@@ -262,6 +268,9 @@ class PyDB:
     _RECONNECT_DELAY = 1
     _RECONNECT_TRIES = 10 if IS_WINDOWS else 100
 
+    # The counters of the stats sources are logged at the debug level at this interval, in seconds
+    STATS_LOG_INTERVAL = 60
+
     def __init__(self, set_as_global=True):
         if set_as_global:
             set_global_debugger(self)
@@ -269,6 +278,8 @@ class PyDB:
 
         self._last_host = None
         self._last_port = None
+        # The ring the large payloads are put in, if the server is local and has attached to it.
+        self._shared_memory_ring = None
 
         self.reader = None
         self.writer = None
@@ -289,19 +300,22 @@ class PyDB:
         self._highlight_color = DEFAULT_HIGHLIGHT_COLOR
         self._selected_widget = None
 
-        # Mapping from QWidget object's ID to QWidget object
-        # The reason for using dict instead of WeakValueDictionary,
-        # is that for some internal child controls (such as QSpinbox.lineEdit()),
-        # there are no references at the Python level.
-        # This results in the wrapper objects being recycled by gc, and subsequently, these controls can't be found.
-        # Using dict can prolong the lifecycle of these wrappers,
-        # but each time it's accessed, it needs to check whether it is valid, if it is not, it needs to be removed.
-        self._id_to_widget = {}
+        # The widgets the server can refer to, by their handles
+        self.widget_registry = WidgetRegistry()
+        # The parent chains sent with the widget info
+        self.ancestry_cache = AncestryCache(self.widget_registry)
+        # The part of the control tree sent to the server, whose changes are pushed to it
+        self.control_tree = ControlTree(self.send_control_tree_delta, self.widget_registry)
         self.global_event_filter = None
-        self.global_native_event_filter = None
+        # Installs the event filters needed while inspecting, when the inspection is enabled
+        self.inspect_session = None
 
         self._widget_props_getter = WidgetPropertiesGetter()
 
+        # The callables returning a line of counters, see `add_stats_source`
+        self._stats_sources = [self.widget_registry.format_stats]
+        self._stats_thread_started = False
+
     def _try_reconnect(self):
         """
         Attempts to reconnect to the last host and port used for connection.
@@ -332,23 +346,48 @@ class PyDB:
     def initialize_network(self, sock):
         sock.settimeout(None)
 
-        self.writer = WriterThread(sock)
+        self.writer = WriterThread(
+            sock,
+            max_queue_size=SetupHolder.setup.get(SetupHolder.KEY_WRITER_QUEUE_SIZE, WriterThread.DEFAULT_MAX_QUEUE_SIZE),
+            drop_policy=SetupHolder.setup.get(SetupHolder.KEY_WRITER_DROP_POLICY, DropPolicy.DROP_OLDEST),
+        )
         self.reader = ReaderThread(sock)
         self.writer.start()
         self.reader.start()
+        if not self._stats_thread_started:  # the network is initialized again when reconnecting
+            self._stats_thread_started = True
+            run_as_pydevd_daemon_thread(self._log_stats_periodically)
+
+    def add_stats_source(self, source):
+        """ Log the line of counters returned by ``source`` periodically, and when `log_stats` is called. """
+        self._stats_sources.append(source)
+
+    def log_stats(self):
+        for source in self._stats_sources:
+            try:
+                pqi_log.debug(source())
+            except Exception:
+                pqi_log.debug('Failed to read the stats.', exc_info=True)
+
+    def _log_stats_periodically(self):
+        while not self._finish_debugging_session:
+            time.sleep(self.STATS_LOG_INTERVAL)
+            self.log_stats()
 
     def connect(self, host, port, *, output_connection_errors=True):
         self._last_host, self._last_port = host, port
+        transport = SetupHolder.setup.get(SetupHolder.KEY_TRANSPORT, Transport.AUTO)
         if host:
             self.communication_role = CommunicationRole.CLIENT
-            s = start_client(host, port, output_errors=output_connection_errors)
+            s = start_client(host, port, output_errors=output_connection_errors, transport=transport)
         else:
             self.communication_role = CommunicationRole.SERVER
-            s = start_server(port, output_errors=output_connection_errors)
+            s = start_server(port, output_errors=output_connection_errors, transport=transport)
 
         self.initialize_network(s)
         if host:
             self.send_process_created_message()
+            self.send_protocol_offer_message()
 
     def send_process_created_message(self):
         """Sends a message that a new process has been created.
@@ -357,11 +396,60 @@ class PyDB:
         cmd = NetCommand(CMD_PROCESS_CREATED, 0, cmdText)
         self.writer.add_command(cmd)
 
+    def send_protocol_offer_message(self):
+        """Offers the protocols we can speak, the server answers with `CMD_SWITCH_PROTOCOL` if it supports one of them.
+        Old servers just ignore the offer, and we keep using the quoted-line protocol.
+
+        Compression is only offered for remote servers, on the loopback interface it costs more than it saves.
+        A shared-memory ring is offered for a server connected through a Unix domain socket if `--shared-memory` is set.
+        """
+        is_local = is_local_socket(self.writer.sock)
+        compressions = [] if is_local or is_loopback_host(self._last_host) else available_compressions()
+
+        self._close_shared_memory_ring()  # the one of the previous connection
+        if is_local and SetupHolder.setup.get(SetupHolder.KEY_SHARED_MEMORY) and is_shared_memory_supported():
+            try:
+                self._shared_memory_ring = SharedMemoryRing.create()
+            except Exception:
+                pqi_log.warning('Failed to create the shared memory ring.', exc_info=True)
+
+        cmd = self.cmd_factory.make_protocol_offer_message(
+            compressions=compressions,
+            shared_memory=self._shared_memory_ring.name if self._shared_memory_ring is not None else None,
+        )
+        self.writer.add_command(cmd)
+
+    def on_protocol_switched(self, protocol):
+        """The server has switched its outgoing stream to `protocol` (the reader already follows it),
+        switch ours as well."""
+        pqi_log.info(f"Switching to the {protocol} protocol.")
+        self.writer.switch_protocol(protocol)
+
+    def on_compression_negotiated(self, compression):
+        pqi_log.info(f"Compressing large payloads with {compression}.")
+        self.writer.set_compression(compression)
+
+    def on_shared_memory_attached(self, name):
+        ring = self._shared_memory_ring
+        if ring is None or ring.name != name:
+            return
+        pqi_log.info(f"Putting large payloads in the shared memory {name}.")
+        self.writer.set_shared_memory(ring)
+
+    def _close_shared_memory_ring(self):
+        if self._shared_memory_ring is not None:
+            self._shared_memory_ring.close()
+            self._shared_memory_ring = None
+
     def send_qt_patch_success_message(self):
         cmdText = str(os.getpid())
         cmd = NetCommand(CMD_QT_PATCH_SUCCESS, 0, cmdText)
         self.writer.add_command(cmd)
 
+    def send_attach_progress_message(self, patched: int, total: int, done: bool):
+        cmd = self.cmd_factory.make_attach_progress_message(os.getpid(), patched, total, done)
+        self.writer.add_command(cmd)
+
     def run(self, file, globals=None, locals=None, is_module=False, set_trace=True):
         module_name = None
         entry_point_fn = ''
@@ -497,9 +585,11 @@ class PyDB:
             pass
         cmd = self.cmd_factory.make_exit_message()
         self.writer.add_command(cmd)
+        if self._shared_memory_ring is not None:
+            self._shared_memory_ring.unlink()  # the writer may still use it, only remove its name
 
-    def send_widget_message(self, widget_info: QWidgetInfo):
-        cmd = self.cmd_factory.make_widget_info_message(widget_info)
+    def send_widget_message(self, widget_info: QWidgetInfo, coalesce_key=None, seq=0):
+        cmd = self.cmd_factory.make_widget_info_message(widget_info, coalesce_key, seq)
         self.writer.add_command(cmd)
 
     # trace_dispatch = _trace_dispatch
@@ -528,10 +618,16 @@ class PyDB:
 
         if 'highlight_color' in extra_data:
             self._highlight_color = extra_data['highlight_color']
+        self._sync_inspect_session()
 
     def disable_inspect(self):
         self.inspect_enabled = False
         self._inspect_extra_data = {}
+        self._sync_inspect_session()
+
+    def _sync_inspect_session(self):
+        if self.inspect_session is not None:
+            self.inspect_session.sync()
 
     @property
     def mock_left_button_down(self) -> bool:
@@ -569,20 +665,11 @@ class PyDB:
     def notify_thread_not_alive(self, thread_id):
         ...
 
-    def register_widget(self, widget):
-        self._id_to_widget[id(widget)] = widget
+    def register_widget(self, widget, attach=False):
+        self.widget_registry.register(widget, sweep=attach)
 
     def _safe_get_widget(self, widget_id):
-        widget = self._id_to_widget.get(widget_id, None)
-
-        if widget is None:
-            return None
-
-        if not is_wrapped_pointer_valid(widget):
-            del self._id_to_widget[widget_id]
-            return None
-
-        return widget
+        return self.widget_registry.get(widget_id)
 
     def set_widget_highlight_by_id(self, widget_id: int, is_highlight: bool):
         widget = self._safe_get_widget(widget_id)
@@ -598,19 +685,26 @@ class PyDB:
 
         self.select_widget(widget)
 
-    def send_widget_info_to_server(self, widget, extra=None):
+    def send_widget_info_to_server(self, widget, extra=None, is_hover=False, seq=0):
+        """
+        Send the information of the given widget to the server.
+
+        @param is_hover: whether the info is sent because the cursor hovers the widget.
+            Such an info is superseded by the next hovered widget, so it may be coalesced by the writer.
+        @param seq: the seq of the request it replies to, 0 if it isn't requested by the server.
+        """
         if extra is None:
             extra = {}
 
-        parent_info = list(get_parent_info(widget))
+        parent_info = self.ancestry_cache.get_parent_info(widget)
         parent_classes, parent_ids, parent_obj_names = [], [], []
         if parent_info:
-            parent_classes, parent_ids, parent_obj_names = zip(*get_parent_info(widget))
+            parent_classes, parent_ids, parent_obj_names = zip(*parent_info)
 
         widget_info = QWidgetInfo(
             class_name=widget.__class__.__name__,
             object_name=get_widget_object_name(widget),
-            id=id(widget),
+            id=self.widget_registry.register(widget),
             stacks_when_create=get_create_stack(widget),
             size=get_widget_size(widget),
             pos=get_widget_pos(widget),
@@ -620,27 +714,42 @@ class PyDB:
             stylesheet=get_stylesheet(widget),
             extra=extra,
         )
-        self.send_widget_message(widget_info)
+        self.send_widget_message(widget_info, CoalesceKeys.HOVER_WIDGET_INFO if is_hover else None, seq)
+
+    def send_hover_widget_to_server(self, widget):
+        """
+        Send the lightweight information of the hovered widget to the server,
+        while the cursor moves too fast for the full information to be built for every widget.
+        """
+        hover_info = QWidgetHoverInfo(
+            class_name=widget.__class__.__name__,
+            object_name=get_widget_object_name(widget),
+            id=self.widget_registry.register(widget),
+            size=get_widget_size(widget),
+            pos=get_widget_pos(widget),
+        )
+        self.writer.add_command(self.cmd_factory.make_hover_widget_message(hover_info))
 
-    def notify_widget_info(self, widget_id, extra):
+    def notify_widget_info(self, widget_id, extra, seq=0):
         widget = self._safe_get_widget(widget_id)
         if widget is None:
             return
 
-        self.send_widget_info_to_server(widget, extra)
+        self.send_widget_info_to_server(widget, extra, seq=seq)
 
-    def notify_children_info(self, widget_id):
+    def notify_children_info(self, widget_id, seq=0):
         """
         Notify the children information of the given widget to the debugger.
 
         @param widget_id: The ID of the widget.
+        @param seq: The seq of the request, echoed by the reply.
         @note: used for the bottom hierarchy view of the server GUI program.
         """
         widget = self._safe_get_widget(widget_id)
         if widget is None:
             return
 
-        children_info_list = list(get_children_info(widget))
+        children_info_list = list(get_children_info(widget, self.widget_registry.handle_of))
         child_classes, child_ids, child_object_names = [], [], []
         if children_info_list:
             child_classes, child_ids, child_object_names = zip(*children_info_list)
@@ -652,20 +761,38 @@ class PyDB:
             child_object_names=child_object_names,
         )
 
-        cmd = self.cmd_factory.make_children_info_message(children_info)
+        cmd = self.cmd_factory.make_children_info_message(children_info, seq)
         self.writer.add_command(cmd)
 
-    def notify_control_tree(self, extra):
-        control_tree = get_control_tree()
-        cmd = self.cmd_factory.make_control_tree_message(control_tree, extra)
-        self.writer.add_command(cmd)
+    def notify_control_tree(self, extra, seq=0):
+        """
+        Notify the control tree, or the subtree of a node whose children were not fetched, to the debugger.
+
+        @param extra: may contain the id of the node to expand (`TreeViewExtraKeys.ROOT_ID`),
+            the number of levels to send (`TreeViewExtraKeys.DEPTH`)
+            and the id of the widget to locate (`TreeViewExtraKeys.CURRENT_WIDGET_ID`). It is echoed by the reply.
+        """
+        current_widget_id = extra.get(TreeViewExtraKeys.CURRENT_WIDGET_ID)
+        current_widget = self._safe_get_widget(current_widget_id) if current_widget_id is not None else None
+
+        with self.control_tree.lock:  # the changes computed after it must be sent after it
+            control_tree = self.control_tree.get_tree(
+                extra.get(TreeViewExtraKeys.ROOT_ID),
+                extra.get(TreeViewExtraKeys.DEPTH),
+                current_widget,
+            )
+            cmd = self.cmd_factory.make_control_tree_message(control_tree, extra, seq)
+            self.writer.add_command(cmd)
+
+    def send_control_tree_delta(self, ops):
+        self.writer.add_command(self.cmd_factory.make_control_tree_delta_message(ops))
 
-    def notify_widget_props(self, widget_id):
+    def notify_widget_props(self, widget_id, seq=0):
         widget = self._safe_get_widget(widget_id)
         if widget is None:
             return
         widget_props = self._widget_props_getter.get_object_properties(widget)
-        cmd = self.cmd_factory.make_widget_props_message(widget_props)
+        cmd = self.cmd_factory.make_widget_props_message(widget_props, seq)
         self.writer.add_command(cmd)
 
 
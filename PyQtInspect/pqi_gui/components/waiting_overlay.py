@@ -15,6 +15,9 @@ class WaitingOverlay(QtWidgets.QWidget):
 
         parent.installEventFilter(self)
 
+    def setMessage(self, message: str):
+        self._label.setText(message)
+
     def eventFilter(self, obj, event):
         if obj is self.parent() and event.type() == QtCore.QEvent.Resize:
             self.setGeometry(self.parent().rect())
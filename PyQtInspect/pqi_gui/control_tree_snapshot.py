@@ -0,0 +1,404 @@
+# -*- encoding:utf-8 -*-
+# ==============================================
+# Description: The storage of the control tree shown by the server, its on-disk snapshots, and their diff
+# ==============================================
+# A snapshot file holds the columns of `ControlTreeSnapshot` as raw arrays, followed by the string tables.
+# It is opened with `mmap` and the columns are read in place through typed memoryviews,
+# so reopening even a huge tree only costs decoding the (interned) names.
+import array
+import collections
+import mmap
+import struct
+import sys
+import typing
+
+__all__ = [
+    'StringTable',
+    'ControlTreeSnapshot',
+    'ChildrenState',
+    'SnapshotChangeKind',
+    'SnapshotChange',
+    'diffSnapshots',
+]
+
+
+class ChildrenState:
+    Fetched = 0
+    NotFetched = 1
+    Fetching = 2
+
+
+class StringTable:
+    """ Interned strings, referred to by their index. """
+    __slots__ = ('strings', '_lowered', '_stringToIndex')
+
+    def __init__(self, strings: typing.Optional[typing.List[str]] = None):
+        self.strings = strings if strings is not None else []  # type: list[str]
+        self._lowered = None  # type: typing.Optional[list[str]]
+        self._stringToIndex = None  # type: typing.Optional[dict[str, int]]
+
+    def intern(self, string: str) -> int:
+        if self._stringToIndex is None:
+            self._stringToIndex = {string: index for index, string in enumerate(self.strings)}
+        index = self._stringToIndex.get(string)
+        if index is None:
+            index = self._stringToIndex[string] = len(self.strings)
+            self.strings.append(string)
+            if self._lowered is not None:
+                self._lowered.append(string.lower())
+        return index
+
+    def findIndexes(self, text: str) -> typing.Set[int]:
+        """ The indexes of the strings containing ``text`` (lowercase), whatever the case. """
+        if self._lowered is None:
+            self._lowered = [string.lower() for string in self.strings]
+        return {index for index, lowered in enumerate(self._lowered) if text in lowered}
+
+
+class ControlTreeSnapshot:
+    """ The nodes of a control tree as parallel columns, a node is identified by its slot (its index in them).
+
+    The slot 0 is the invisible root, whose children are the top-level widgets.
+    The children of a node are the range ``childSlots[firstChildren[slot]:firstChildren[slot] + rowCounts[slot]]``.
+    The columns are arrays, or read-only memoryviews when the snapshot is loaded from a file.
+    The ids are the handles of the inspected process, ``pid`` tells which one (0 if it is unknown).
+    """
+    # (attribute, typecode), the node columns then `childSlots`
+    COLUMNS = (
+        ('ids', 'q'),
+        ('nameIndexes', 'i'),
+        ('classIndexes', 'i'),
+        ('childCounts', 'i'),  # the number of children reported by the client
+        ('states', 'b'),  # `ChildrenState`
+        ('parents', 'i'),
+        ('rows', 'i'),  # the row of the node under its parent
+        ('firstChildren', 'i'),
+        ('rowCounts', 'i'),  # the number of children stored
+        ('childSlots', 'i'),
+    )
+    ROOT_SLOT = 0
+    DEAD_ID = 0  # the id of the removed nodes (the ids sent by the client start from 1)
+
+    _MAGIC = b'PQITREE\0'
+    _VERSION = 2
+    # magic, version, byte order (0: little, 1: big), node count, child slot count,
+    # name count, name blob size, class count, class blob size, pid
+    _HEADER = struct.Struct('<8sHBxIIIIIII')
+    # The version 1 has no pid
+    _HEADER_V1 = struct.Struct('<8sHBxIIIIII')
+    _MAGIC_AND_VERSION = struct.Struct('<8sH')
+    _ALIGNMENT = 8
+
+    def __init__(self, columns: typing.Dict[str, typing.Sequence[int]], names: StringTable, classes: StringTable,
+                 pid: int = 0):
+        for attr, _ in self.COLUMNS:
+            setattr(self, attr, columns[attr])
+        self.names = names
+        self.classes = classes
+        self.pid = pid
+        self._mmap = None  # kept open while the columns are read from it
+
+    @classmethod
+    def empty(cls, pid: int = 0) -> 'ControlTreeSnapshot':
+        snapshot = cls({attr: array.array(typecode) for attr, typecode in cls.COLUMNS}, StringTable(), StringTable(),
+                       pid)
+        snapshot.appendNode(cls.DEAD_ID, '', '', 0, -1, 0)
+        return snapshot
+
+    @property
+    def nodeCount(self) -> int:
+        return len(self.ids)
+
+    def appendNode(self, nodeId: int, name: str, className: str, childCount: int, parentSlot: int, row: int) -> int:
+        slot = len(self.ids)
+        self.ids.append(nodeId)
+        self.nameIndexes.append(self.names.intern(name))
+        self.classIndexes.append(self.classes.intern(className))
+        self.childCounts.append(childCount)
+        self.states.append(ChildrenState.Fetched)
+        self.parents.append(parentSlot)
+        self.rows.append(row)
+        self.firstChildren.append(0)
+        self.rowCounts.append(0)
+        return slot
+
+    def setNode(self, slot: int, nodeId: int, name: str, className: str, childCount: int, parentSlot: int, row: int):
+        """ Overwrite the node at ``slot``, e.g. a removed one being reused. """
+        self.ids[slot] = nodeId
+        self.nameIndexes[slot] = self.names.intern(name)
+        self.classIndexes[slot] = self.classes.intern(className)
+        self.childCounts[slot] = childCount
+        self.states[slot] = ChildrenState.Fetched
+        self.parents[slot] = parentSlot
+        self.rows[slot] = row
+        self.firstChildren[slot] = 0
+        self.rowCounts[slot] = 0
+
+    def childrenOf(self, slot: int) -> typing.List[int]:
+        start = self.firstChildren[slot]
+        return self.childSlots[start:start + self.rowCounts[slot]].tolist()
+
+    def nameOf(self, slot: int) -> str:
+        return self.names.strings[self.nameIndexes[slot]]
+
+    def classOf(self, slot: int) -> str:
+        return self.classes.strings[self.classIndexes[slot]]
+
+    def pathOf(self, slot: int) -> str:
+        parts = []
+        while slot != self.ROOT_SLOT:
+            parts.append(f'{self.nameOf(slot)} ({self.classOf(slot)})')
+            slot = self.parents[slot]
+        return ' / '.join(reversed(parts))
+
+    def compacted(self) -> 'ControlTreeSnapshot':
+        """ A copy holding only the nodes in the tree, breadth first (the children ranges follow each other). """
+        snapshot = self.empty(self.pid)
+        queue = [(self.ROOT_SLOT, self.ROOT_SLOT)]
+        for slot, newSlot in queue:  # extended while iterated
+            children = self.childrenOf(slot)
+            snapshot.firstChildren[newSlot] = len(snapshot.childSlots)
+            snapshot.rowCounts[newSlot] = len(children)
+            for row, child in enumerate(children):
+                newChild = snapshot.appendNode(self.ids[child], self.nameOf(child), self.classOf(child),
+                                               self.childCounts[child], newSlot, row)
+                snapshot.states[newChild] = self.states[child]
+                snapshot.childSlots.append(newChild)
+                queue.append((child, newChild))
+        return snapshot
+
+    # region Files
+    @classmethod
+    def _padding(cls, size: int) -> bytes:
+        return b'\0' * (-size % cls._ALIGNMENT)
+
+    @staticmethod
+    def _encodeStrings(strings: typing.List[str]) -> typing.Tuple[bytes, bytes]:
+        """ The offsets (count + 1) and the blob of the UTF-8 strings. """
+        encoded = [string.encode('utf-8', 'surrogatepass') for string in strings]
+        offsets = array.array('I', [0])
+        for data in encoded:
+            offsets.append(offsets[-1] + len(data))
+        return offsets.tobytes(), b''.join(encoded)
+
+    def save(self, path: str):
+        """ Write the nodes in the tree to ``path``. """
+        snapshot = self.compacted()
+        nameOffsets, nameBlob = self._encodeStrings(snapshot.names.strings)
+        classOffsets, classBlob = self._encodeStrings(snapshot.classes.strings)
+        sections = [array.array(typecode, getattr(snapshot, attr)).tobytes() for attr, typecode in self.COLUMNS]
+        sections += [nameOffsets, nameBlob, classOffsets, classBlob]
+        with open(path, 'wb') as f:
+            f.write(self._HEADER.pack(self._MAGIC, self._VERSION, 0 if sys.byteorder == 'little' else 1,
+                                      snapshot.nodeCount, len(snapshot.childSlots),
+                                      len(snapshot.names.strings), len(nameBlob),
+                                      len(snapshot.classes.strings), len(classBlob), snapshot.pid))
+            f.write(self._padding(self._HEADER.size))
+            for data in sections:
+                f.write(data)
+                f.write(self._padding(len(data)))
+
+    @classmethod
+    def load(cls, path: str) -> 'ControlTreeSnapshot':
+        """ Open a snapshot written by `save`, its columns are read from the mapped file.
+        :raise ValueError: if the file is not a snapshot.
+        """
+        with open(path, 'rb') as f:
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty file
+                raise ValueError(f'{path} is not a control tree snapshot') from None
+        view = memoryview(mapped)
+        if len(view) < cls._MAGIC_AND_VERSION.size:
+            raise ValueError(f'{path} is not a control tree snapshot')
+        magic, version = cls._MAGIC_AND_VERSION.unpack_from(view)
+        header = {cls._VERSION: cls._HEADER, 1: cls._HEADER_V1}.get(version)
+        if magic != cls._MAGIC or header is None:
+            raise ValueError(f'{path} is not a control tree snapshot, or was written by another version')
+        if len(view) < header.size:
+            raise ValueError(f'{path} is truncated')
+        (magic, version, byteOrder, nodeCount, childSlotCount,
+         nameCount, nameBlobSize, classCount, classBlobSize, *pid) = header.unpack_from(view)
+        pid = pid[0] if pid else 0
+        isNativeOrder = byteOrder == (0 if sys.byteorder == 'little' else 1)
+
+        offset = header.size + len(cls._padding(header.size))
+
+        def _section(typecode: str, count: int):
+            nonlocal offset
+            size = array.array(typecode).itemsize * count
+            if offset + size > len(view):
+                raise ValueError(f'{path} is truncated')
+            data = view[offset:offset + size]
+            offset += size + len(cls._padding(size))
+            if isNativeOrder:
+                return data.cast(typecode)
+            copied = array.array(typecode, data.tobytes())  # rare: written on a machine of the other byte order
+            copied.byteswap()
+            return copied
+
+        columns = {}
+        for attr, typecode in cls.COLUMNS:
+            columns[attr] = _section(typecode, childSlotCount if attr == 'childSlots' else nodeCount)
+
+        def _strings(count: int, blobSize: int) -> StringTable:
+            offsets = _section('I', count + 1).tolist()
+            blob = _section('B', blobSize).tobytes()
+            return StringTable([blob[offsets[i]:offsets[i + 1]].decode('utf-8', 'surrogatepass')
+                                for i in range(count)])
+
+        names = _strings(nameCount, nameBlobSize)
+        classes = _strings(classCount, classBlobSize)
+        snapshot = cls(columns, names, classes, pid)
+        snapshot._mmap = mapped
+        return snapshot
+    # endregion
+
+
+class SnapshotChangeKind:
+    Added = 'Added'
+    Removed = 'Removed'
+    Moved = 'Moved'
+    Renamed = 'Renamed'
+
+
+SnapshotChange = collections.namedtuple('SnapshotChange', ['kind', 'path', 'detail'])
+
+
+def _isNamed(name: str) -> bool:
+    """ Whether the node has an object name, the others are shown with their address (see `ControlTree`). """
+    return bool(name) and not name.startswith('0x') and name != 'Spacer'
+
+
+def _areIdsComparable(old: ControlTreeSnapshot, new: ControlTreeSnapshot) -> bool:
+    """ Whether the same id means the same object, i.e. the snapshots are taken from the same process. """
+    return old.pid != 0 and old.pid == new.pid
+
+
+def _matchSiblings(old: ControlTreeSnapshot, oldSlots: typing.List[int],
+                   new: ControlTreeSnapshot, newSlots: typing.List[int]):
+    """ Pair the children of two matching nodes.
+    :return: the pairs, the unpaired old slots and the unpaired new slots
+    """
+    def _key(snapshot, slot):
+        name = snapshot.nameOf(slot)
+        return snapshot.classOf(slot), name if _isNamed(name) else None
+
+    # 1. the same class and object name (or both unnamed), in order
+    oldByKey = collections.defaultdict(collections.deque)
+    for slot in oldSlots:
+        oldByKey[_key(old, slot)].append(slot)
+    pairs, restNew = [], []
+    for slot in newSlots:
+        candidates = oldByKey.get(_key(new, slot))
+        if candidates:
+            pairs.append((candidates.popleft(), slot))
+        else:
+            restNew.append(slot)
+    restOld = [slot for candidates in oldByKey.values() for slot in candidates]
+    if not restOld or not restNew:
+        return pairs, restOld, restNew
+
+    # 2. renamed: the same object id if the snapshots are taken from the same process,
+    #   otherwise (the ids can't be compared) the same class, in order
+    pairedOld = set()
+    stillNew = []
+    if _areIdsComparable(old, new):
+        oldById = {old.ids[slot]: slot for slot in restOld}
+
+        def _pairedSlot(slot):
+            oldSlot = oldById.get(new.ids[slot])
+            return oldSlot if oldSlot is not None and old.classOf(oldSlot) == new.classOf(slot) else None
+    else:
+        oldByClass = collections.defaultdict(collections.deque)
+        for slot in restOld:
+            oldByClass[old.classOf(slot)].append(slot)
+
+        def _pairedSlot(slot):
+            candidates = oldByClass.get(new.classOf(slot))
+            return candidates.popleft() if candidates else None
+
+    for slot in restNew:
+        oldSlot = _pairedSlot(slot)
+        if oldSlot is None:
+            stillNew.append(slot)
+        else:
+            pairedOld.add(oldSlot)
+            pairs.append((oldSlot, slot))
+    return pairs, [slot for slot in restOld if slot not in pairedOld], stillNew
+
+
+def _subtreeSize(snapshot: ControlTreeSnapshot, slot: int) -> int:
+    size, stack = 0, [slot]
+    while stack:
+        slot = stack.pop()
+        size += 1
+        stack.extend(snapshot.childrenOf(slot))
+    return size
+
+
+def diffSnapshots(old: ControlTreeSnapshot, new: ControlTreeSnapshot) -> typing.List[SnapshotChange]:
+    """ The structural changes from ``old`` to ``new``.
+
+    The trees are matched level by level: the children of two matching nodes are paired by class and object name,
+    then by object id, or by class if the snapshots are not taken from the same process (renamed).
+    The unpaired nodes are paired across the tree by object id (from the same process)
+    or by a unique object name (moved), the others are added or removed, with their descendants.
+    The children of the nodes which were not fetched in either snapshot are not compared.
+    """
+    changes = []
+    unpairedOld, unpairedNew = [], []
+
+    def _matchFrom(pairs):
+        for oldSlot, newSlot in pairs:  # extended while iterated
+            if oldSlot != ControlTreeSnapshot.ROOT_SLOT:
+                oldName, newName = old.nameOf(oldSlot), new.nameOf(newSlot)
+                if oldName != newName and (_isNamed(oldName) or _isNamed(newName)):
+                    changes.append(SnapshotChange(SnapshotChangeKind.Renamed, new.pathOf(newSlot),
+                                                  f'was {oldName}'))
+            if old.states[oldSlot] != ChildrenState.Fetched or new.states[newSlot] != ChildrenState.Fetched:
+                continue
+            childPairs, restOld, restNew = _matchSiblings(old, old.childrenOf(oldSlot),
+                                                          new, new.childrenOf(newSlot))
+            pairs.extend(childPairs)
+            unpairedOld.extend(restOld)
+            unpairedNew.extend(restNew)
+
+    _matchFrom([(ControlTreeSnapshot.ROOT_SLOT, ControlTreeSnapshot.ROOT_SLOT)])
+
+    # The nodes moved to another parent
+    newById = {new.ids[slot]: slot for slot in unpairedNew} if _areIdsComparable(old, new) else {}
+    newByName = collections.defaultdict(list)
+    for slot in unpairedNew:
+        if _isNamed(new.nameOf(slot)):
+            newByName[(new.classOf(slot), new.nameOf(slot))].append(slot)
+    oldNameCounts = collections.Counter((old.classOf(slot), old.nameOf(slot)) for slot in unpairedOld)
+    movedPairs, pairedNew, removed = [], set(), []
+    oldCount, newCount = len(unpairedOld), len(unpairedNew)
+    for slot in unpairedOld:
+        newSlot = newById.get(old.ids[slot])
+        if newSlot is None or newSlot in pairedNew or new.classOf(newSlot) != old.classOf(slot):
+            key = (old.classOf(slot), old.nameOf(slot))
+            candidates = newByName.get(key)
+            newSlot = candidates[0] if candidates and len(candidates) == 1 and oldNameCounts[key] == 1 else None
+        if newSlot is None or newSlot in pairedNew:
+            removed.append(slot)
+            continue
+        pairedNew.add(newSlot)
+        movedPairs.append((slot, newSlot))
+        changes.append(SnapshotChange(SnapshotChangeKind.Moved, new.pathOf(newSlot), f'was {old.pathOf(slot)}'))
+
+    # The descendants of the moved nodes are compared with each other, their unpaired ones are added or removed
+    _matchFrom(movedPairs)
+    removed.extend(unpairedOld[oldCount:])
+    added = [slot for slot in unpairedNew[:newCount] if slot not in pairedNew] + unpairedNew[newCount:]
+
+    for slot in removed:
+        size = _subtreeSize(old, slot)
+        changes.append(SnapshotChange(SnapshotChangeKind.Removed, old.pathOf(slot),
+                                      f'with {size - 1} descendants' if size > 1 else ''))
+    for slot in added:
+        size = _subtreeSize(new, slot)
+        changes.append(SnapshotChange(SnapshotChangeKind.Added, new.pathOf(slot),
+                                      f'with {size - 1} descendants' if size > 1 else ''))
+    return changes
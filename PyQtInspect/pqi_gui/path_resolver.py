@@ -0,0 +1,120 @@
+# -*- encoding:utf-8 -*-
+# ==============================================
+# Description: Resolve the source files of the received stacks to local paths, off the main thread
+# ==============================================
+# Checking whether a file exists costs a stat() per frame of every stack received, which is slow on network
+# home directories. The results are cached for ``TTL`` seconds, and the paths not cached yet are resolved
+# by a background thread: `sigResolved` tells when they are available.
+import collections
+import os
+import queue
+import threading
+import time
+import typing
+
+from PyQt5 import QtCore
+
+from PyQtInspect.pqi_gui.settings import SettingsController
+
+# The local path of a source file (the mapped one if a mapping rule matches), and whether it exists
+ResolvedPath = collections.namedtuple('ResolvedPath', 'localPath exists')
+
+# The separator between the remote and the local prefix of a mapping rule
+MAPPING_SEPARATOR = '=>'
+
+
+def parsePathMappings(text: str) -> typing.List[typing.Tuple[str, str]]:
+    """ Parse the mapping rules, one ``remote prefix => local prefix`` per line.
+    Raise ValueError if a line is malformed.
+    """
+    mappings = []
+    for lineNo, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line:
+            continue
+        remotePrefix, sep, localPrefix = line.partition(MAPPING_SEPARATOR)
+        remotePrefix, localPrefix = remotePrefix.strip(), localPrefix.strip()
+        if not sep or not remotePrefix or not localPrefix:
+            raise ValueError(f'Line {lineNo} must be "<remote prefix> {MAPPING_SEPARATOR} <local prefix>": {line}')
+        mappings.append((remotePrefix, localPrefix))
+    return mappings
+
+
+def _normalizePrefix(prefix: str) -> str:
+    """ The prefix in the form it is compared with, the separators of both platforms are accepted. """
+    return prefix.replace('\\', '/').rstrip('/')
+
+
+class PathResolver(QtCore.QObject):
+    """ Map the remote paths with the rules of the settings, and cache whether the local paths exist. """
+    sigResolved = QtCore.pyqtSignal(str)  # the remote path whose resolution is available
+
+    TTL = 30.0  # in seconds
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._lock = threading.Lock()
+        self._cache = {}  # type: typing.Dict[str, typing.Tuple[ResolvedPath, float]]
+        self._pending = set()  # type: typing.Set[str]
+        self._mappings = []  # type: typing.List[typing.Tuple[str, str]]
+        self._generation = 0  # bumped when the mappings change, the resolutions in flight are not cached then
+        self._requests = queue.Queue()  # type: queue.Queue[str]
+        self.reloadMappings()
+
+        self._thread = threading.Thread(target=self._resolveRequests, name='pqi.PathResolver')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def reloadMappings(self):
+        """ Read the mapping rules from the settings again, the cached resolutions are dropped. """
+        try:
+            mappings = parsePathMappings(SettingsController.instance().pathMappings)
+        except ValueError:
+            mappings = []  # validated when saved, only a hand-edited settings file gets here
+        with self._lock:
+            self._mappings = [(_normalizePrefix(remote), local) for remote, local in mappings]
+            self._generation += 1
+            self._cache.clear()
+
+    def resolve(self, remotePath: str) -> typing.Optional[ResolvedPath]:
+        """ The cached resolution of the path, even if it is expired.
+        If there is none or it is expired, the path is resolved in the background and `sigResolved` is emitted.
+        """
+        with self._lock:
+            cached = self._cache.get(remotePath)
+            if cached is not None and cached[1] > time.monotonic():
+                return cached[0]
+            if remotePath not in self._pending:
+                self._pending.add(remotePath)
+                self._requests.put(remotePath)
+        return cached[0] if cached is not None else None
+
+    def resolveNow(self, remotePath: str) -> ResolvedPath:
+        """ Resolve the path in the calling thread, e.g. when the user opens it. """
+        return self._resolveAndCache(remotePath)
+
+    @staticmethod
+    def _mapPath(remotePath: str, mappings: typing.List[typing.Tuple[str, str]]) -> str:
+        normalized = remotePath.replace('\\', '/')
+        for remotePrefix, localPrefix in mappings:
+            if normalized == remotePrefix or normalized.startswith(remotePrefix + '/'):
+                return localPrefix + normalized[len(remotePrefix):]
+        return remotePath
+
+    def _resolveAndCache(self, remotePath: str) -> ResolvedPath:
+        with self._lock:
+            mappings, generation = self._mappings, self._generation
+        localPath = os.path.normpath(self._mapPath(remotePath, mappings)) if remotePath else remotePath
+        resolved = ResolvedPath(localPath, bool(localPath) and os.path.exists(localPath))
+        with self._lock:
+            if generation == self._generation:
+                self._cache[remotePath] = (resolved, time.monotonic() + self.TTL)
+        return resolved
+
+    def _resolveRequests(self):
+        while True:
+            remotePath = self._requests.get()
+            self._resolveAndCache(remotePath)
+            with self._lock:
+                self._pending.discard(remotePath)
+            self.sigResolved.emit(remotePath)
@@ -9,7 +9,7 @@ import typing
 from PyQt5 import QtCore
 
 from PyQtInspect._pqi_bundle.pqi_contants import DEFAULT_HIGHLIGHT_COLOR
-from PyQtInspect.pqi_gui.settings.enums import SupportedIDE
+from PyQtInspect.pqi_gui.settings.enums import SupportedIDE, ServerEngine
 
 T = typing.TypeVar("T")
 
@@ -48,6 +48,12 @@ class SettingsController:
         class Highlight:
             Color = "Highlight/Color"
 
+        class Server:
+            Engine = "Server/Engine"
+
+        class Paths:
+            Mappings = "Paths/Mappings"
+
     __slots__ = ('_setting',)
 
     _instance = None
@@ -83,3 +89,8 @@ class SettingsController:
 
     highlightColor = SettingField(SettingsKeys.Highlight.Color, str, DEFAULT_HIGHLIGHT_COLOR)
 
+    serverEngine = SettingField(SettingsKeys.Server.Engine, str, ServerEngine.Threads.value)
+
+    # The remote-to-local prefix mapping rules of the source files, see `pqi_gui.path_resolver`
+    pathMappings = SettingField(SettingsKeys.Paths.Mappings, str, "")
+
@@ -21,3 +21,18 @@ class SupportedIDE(enum.Enum):
             ('Cursor', SupportedIDE.Cursor),
             ('Custom', SupportedIDE.Custom),
         ]
+
+
+class ServerEngine(enum.Enum):
+    """ Enum for the engines serving the pqi-clients. """
+    Threads = 'Threads'  # a reader and a writer thread for each client
+    Selector = 'Selector'  # all the clients on a single selector loop
+
+    @staticmethod
+    def get_server_engines_for_settings() -> typing.List[typing.Tuple[str, 'ServerEngine']]:
+        """ Get the list of server engines for settings selection. """
+        return [
+            # (Display Name, Enum Value)
+            ('Threads (one pair per process)', ServerEngine.Threads),
+            ('Single event loop', ServerEngine.Selector),
+        ]
@@ -1,11 +1,17 @@
 import os
+import typing
 
 from PyQt5 import QtWidgets, QtCore, QtGui
 
 from PyQtInspect._pqi_bundle import pqi_log
 from PyQtInspect.pqi_gui.common_operators import CommonOperators
+from PyQtInspect.pqi_gui.path_resolver import PathResolver, ResolvedPath, MAPPING_SEPARATOR
+from PyQtInspect.pqi_gui.settings import SettingsController
 from PyQtInspect.pqi_gui.settings.ide_jumpers import jump_to_ide
 
+# The frame shown by an item: (index, file name in the inspected process, line number, function name)
+_FRAME_ROLE = QtCore.Qt.UserRole + 1
+
 
 class CreateStacksListWidget(QtWidgets.QListWidget):
     tab_name = "Creation Stack"
@@ -23,37 +29,95 @@ class CreateStacksListWidget(QtWidgets.QListWidget):
         self._messageBoxConfigureBtn = self._messageBox.addButton('Configure IDE', QtWidgets.QMessageBox.ButtonRole.ActionRole)
         self._messageBoxOkBtn = self._messageBox.addButton('OK', QtWidgets.QMessageBox.ButtonRole.ActionRole)
 
+        # The existence of the files is checked in the background, the items are updated when it is known
+        self._pathResolver = PathResolver(self)
+        self._pathResolver.sigResolved.connect(self._onPathResolved)
+        self._unresolvedItems = {}  # type: typing.Dict[str, typing.List[QtWidgets.QListWidgetItem]]
+
     def setStacks(self, stacks: list):
-        self.clear()
+        self.clearStacks()
         for index, stack in enumerate(stacks):
             fileName = stack.get("filename", "")
-            normalizedFileName = os.path.normpath(fileName)
-            isSrc = os.path.exists(normalizedFileName)
-
             lineNo = stack.get("lineno", "")
             funcName = stack.get("function", "")
             item = QtWidgets.QListWidgetItem()
-            item.setText(f"{index + 1}. {'' if isSrc else '<?> '}File {normalizedFileName}, line {lineNo}: {funcName}")
-            # set property
-            item.setData(QtCore.Qt.UserRole, (isSrc, normalizedFileName, lineNo))
+            item.setData(_FRAME_ROLE, (index, fileName, lineNo, funcName))
+            self._resolveItem(item)
             self.addItem(item)
 
     def clearStacks(self):
+        self._unresolvedItems.clear()
         self.clear()
 
+    def reloadPathMappings(self):
+        """ Apply the mapping rules of the settings to the stack shown. """
+        self._pathResolver.reloadMappings()
+        self._unresolvedItems.clear()
+        for row in range(self.count()):
+            self._resolveItem(self.item(row))
+
+    def _resolveItem(self, item: QtWidgets.QListWidgetItem):
+        fileName = item.data(_FRAME_ROLE)[1]
+        # Kept even if a resolution is cached: it may be expired, then it is refreshed in the background
+        self._unresolvedItems.setdefault(fileName, []).append(item)
+        self._updateItem(item, self._pathResolver.resolve(fileName))
+
+    @staticmethod
+    def _updateItem(item: QtWidgets.QListWidgetItem, resolved: typing.Optional[ResolvedPath]):
+        """ :param resolved: None if the file is not resolved yet, it is shown as not found until then. """
+        index, fileName, lineNo, funcName = item.data(_FRAME_ROLE)
+        isSrc, localFileName = (resolved.exists, resolved.localPath) if resolved else (False, os.path.normpath(fileName))
+        item.setText(f"{index + 1}. {'' if isSrc else '<?> '}File {localFileName}, line {lineNo}: {funcName}")
+        # set property
+        item.setData(QtCore.Qt.UserRole, (isSrc, localFileName, lineNo))
+
+    def _onPathResolved(self, fileName: str):
+        if fileName not in self._unresolvedItems:
+            return  # the stack has changed meanwhile
+        resolved = self._pathResolver.resolve(fileName)
+        if resolved is None:
+            return  # resolved with the mapping rules replaced since, it is resolved again
+        for item in self._unresolvedItems.pop(fileName):
+            self._updateItem(item, resolved)
+
     # double click to open file
     def mouseDoubleClickEvent(self, event: QtGui.QMouseEvent) -> None:
         super().mousePressEvent(event)
         if event.button() == QtCore.Qt.LeftButton:
             item = self.itemAt(event.pos())
             if item is not None:
+                _, remoteFileName, _, _ = item.data(_FRAME_ROLE)
+                # Checked again, the cached result may be stale (or not known yet)
+                resolved = self._pathResolver.resolveNow(remoteFileName)
+                self._updateItem(item, resolved)
                 isSrc, fileName, lineNo = item.data(QtCore.Qt.UserRole)
                 if isSrc:
                     if fileName:
                         self.openFile(fileName, lineNo)
-                else:  # we need to map to our local directory
-                    # todo add a dialog to ask user to map the file
-                    ...
+                elif remoteFileName:  # we need to map to our local directory
+                    self._askPathMapping(remoteFileName)
+
+    def _askPathMapping(self, remoteFileName: str):
+        """ Ask for the local directory of the file, and add a mapping rule from its remote directory. """
+        remoteDir = os.path.dirname(remoteFileName.replace('\\', '/'))
+        reply = QtWidgets.QMessageBox.question(
+            self, "File Not Found",
+            f"{remoteFileName} is not found on this host.\n\n"
+            f"Do you want to map its directory {remoteDir} to a local directory?",
+            QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No, QtWidgets.QMessageBox.Yes
+        )
+        if reply != QtWidgets.QMessageBox.Yes:
+            return
+        localDir = QtWidgets.QFileDialog.getExistingDirectory(self, f"Local Directory of {remoteDir}")
+        if not localDir:
+            return
+
+        settingsCtrl = SettingsController.instance()
+        # The new rule comes first, it takes precedence over a broader one
+        rules = [f"{remoteDir} {MAPPING_SEPARATOR} {localDir}", settingsCtrl.pathMappings.strip()]
+        settingsCtrl.pathMappings = "\n".join(rule for rule in rules if rule)
+        pqi_log.info(f"Path mapping added: {remoteDir} {MAPPING_SEPARATOR} {localDir}")
+        self.reloadPathMappings()
 
     def openFile(self, fileName: str, lineNo: int):
         # open in IDE
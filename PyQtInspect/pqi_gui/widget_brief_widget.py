@@ -88,6 +88,11 @@ class WidgetBriefWidget(QtWidgets.QWidget):
         self._mainLayout.addStretch(1)
 
     def setInfo(self, info):
+        self.setHoverInfo(info)
+        self._styleSheetLine.setValue(info["stylesheet"])
+
+    def setHoverInfo(self, info):
+        """ Set the fields of the lightweight info of a hovered widget, the stylesheet is unknown yet. """
         self._classNameLine.setValue(info["class_name"])
         objName = info["object_name"]
         self._objectNameLine.setValue(objName)
@@ -95,7 +100,7 @@ class WidgetBriefWidget(QtWidgets.QWidget):
         self._sizeLine.setValue(f"{width}, {height}")
         posX, posY = info["pos"]
         self._posLine.setValue(f"{posX}, {posY}")
-        self._styleSheetLine.setValue(info["stylesheet"])
+        self._styleSheetLine.setValue("")
 
     def clearInfo(self):
         self._classNameLine.setValue("")
@@ -259,6 +259,13 @@ class AttachWindow(QtWidgets.QWidget):
         self._worker.sigAttachFinished.connect(self._thread.quit)
         self._thread.start()
 
+    def notifyAttachProgress(self, pid: int, patched: int, total: int, done: bool):
+        """ The attached process patches its existing widgets in chunks, and reports its progress. """
+        if done:
+            self._consoleOutputTextBrowser.write(f"({pid}) All the {total} existing widgets are patched.")
+        else:
+            self._consoleOutputTextBrowser.write(f"({pid}) Patching the existing widgets: {patched}/{total}")
+
     def _onAttachError(self, errMsg):
         QtWidgets.QMessageBox.critical(self, "Error", errMsg)
         self._pidLine.setEnabled(True)
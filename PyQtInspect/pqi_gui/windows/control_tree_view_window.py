@@ -1,70 +1,441 @@
 # -*- coding: utf-8 -*-
+import array
+import os
 import typing
 
-from PyQt5 import QtGui, QtWidgets, QtCore
-from PyQtInspect._pqi_bundle.pqi_comm_constants import TreeViewKeys
+from PyQt5 import QtWidgets, QtCore
+from PyQtInspect._pqi_bundle.pqi_comm_constants import TreeViewKeys, DeltaOps
 from PyQtInspect.pqi_gui.components.waiting_overlay import WaitingOverlay
+from PyQtInspect.pqi_gui.control_tree_snapshot import ControlTreeSnapshot, ChildrenState, diffSnapshots
+from PyQtInspect.pqi_gui.windows.snapshot_diff_window import SnapshotDiffWindow
 
 
 class _DefaultOptions:
     HighlightWhenHover = True
+    # The number of levels requested when the tree is refreshed, the deeper nodes are fetched when expanded
+    InitialDepth = 3
+
+
+_SNAPSHOT_FILE_FILTER = "Control tree snapshots (*.pqitree);;All files (*)"
 
 
 class _CustomDataRole:
     WidgetId = QtCore.Qt.UserRole + 1
+    ChildrenState = QtCore.Qt.UserRole + 2
+
+
+class _ControlTreeModel(QtCore.QAbstractItemModel):
+    """ The read-only model of the control tree, the children of a node which were not sent are requested
+    when it is expanded.
+
+    A node is a slot in the parallel columns of a `ControlTreeSnapshot` (its id, the indexes of its name and class
+    in string tables, its parent slot, its row...), rather than three `QStandardItem` objects:
+    building the model is a linear pass over the received tree, and `data` reads the columns.
+    The internal id of a model index is the slot of its node.
+    The children of a node are a range of ``childSlots``, it is appended again when the children change.
+    The slots of the removed nodes are reused by the nodes added afterwards.
+
+    A snapshot opened from a file is shown as is: nothing is fetched, and the changes of the live tree are ignored.
+    """
+    sigFetchChildren = QtCore.pyqtSignal(int)  # node id
+
+    _HEADERS = ("Object", "Type", "Child Count")
+    _ROOT_SLOT = ControlTreeSnapshot.ROOT_SLOT
+    _DEAD_ID = ControlTreeSnapshot.DEAD_ID
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self._tree = ControlTreeSnapshot.empty()
+        self._isSnapshot = False
+        self._idToSlot = {}  # type: dict[int, int]
+        self._fetchingIdToSlot = {}  # type: dict[int, int]
+        self._garbageCount = 0  # the entries of ``childSlots`` no range refers to anymore
+        self._freeSlots = []  # type: list[int]  # the slots of the removed nodes
+
+    def _setTree(self, tree: ControlTreeSnapshot, isSnapshot: bool):
+        self._tree = tree
+        self._isSnapshot = isSnapshot
+        ids = tree.ids
+        self._idToSlot = dict(zip(ids[1:].tolist(), range(1, len(ids))))
+        self._fetchingIdToSlot.clear()
+        self._garbageCount = 0
+        self._freeSlots.clear()
+
+    @property
+    def isSnapshot(self) -> bool:
+        return self._isSnapshot
+
+    # region Storage
+    def _newSlot(self, info: typing.Dict, parentSlot: int, row: int) -> int:
+        nodeId = info[TreeViewKeys.OBJ_ID_KEY]
+        node = (nodeId, info[TreeViewKeys.OBJ_NAME_KEY], info[TreeViewKeys.OBJ_CLS_NAME_KEY],
+                info[TreeViewKeys.CHILD_CNT_KEY], parentSlot, row)
+        if self._freeSlots:
+            slot = self._freeSlots.pop()
+            self._tree.setNode(slot, *node)
+        else:
+            slot = self._tree.appendNode(*node)
+        self._idToSlot[nodeId] = slot
+        return slot
+
+    def _build(self, slot: int, childrenInfoList: typing.List[typing.Dict]):
+        """ Store the nodes and their descendants as the children of a node without children,
+        breadth first so that the children of each node are contiguous. """
+        tree = self._tree
+        queue = [(slot, childrenInfoList)]
+        for slot, infos in queue:  # extended while iterated
+            tree.firstChildren[slot] = len(tree.childSlots)
+            tree.rowCounts[slot] = len(infos)
+            for row, info in enumerate(infos):
+                childSlot = self._newSlot(info, slot, row)
+                tree.childSlots.append(childSlot)
+                if TreeViewKeys.CHILDREN_KEY in info:
+                    queue.append((childSlot, info[TreeViewKeys.CHILDREN_KEY]))
+                else:
+                    tree.states[childSlot] = ChildrenState.NotFetched
+
+    def _buildSubtree(self, parentSlot: int, info: typing.Dict) -> int:
+        """ Store a node and its descendants, it is inserted among the children of ``parentSlot`` afterwards. """
+        slot = self._newSlot(info, parentSlot, 0)
+        if TreeViewKeys.CHILDREN_KEY in info:
+            self._build(slot, info[TreeViewKeys.CHILDREN_KEY])
+        else:
+            self._tree.states[slot] = ChildrenState.NotFetched
+        return slot
+
+    def _setChildren(self, slot: int, childSlots: typing.List[int]):
+        """ Replace the range of the children of a node. """
+        tree = self._tree
+        self._garbageCount += tree.rowCounts[slot]
+        tree.firstChildren[slot] = len(tree.childSlots)
+        tree.rowCounts[slot] = len(childSlots)
+        tree.childSlots.extend(childSlots)
+        for row, childSlot in enumerate(childSlots):
+            tree.parents[childSlot] = slot
+            tree.rows[childSlot] = row
+        if tree.states[slot] == ChildrenState.Fetched:
+            tree.childCounts[slot] = len(childSlots)
+        if self._garbageCount > max(4096, len(tree.childSlots) // 2):
+            self._compactChildSlots()
+
+    def _compactChildSlots(self):
+        tree = self._tree
+        childSlots = array.array('i')
+        for slot in range(tree.nodeCount):
+            if tree.ids[slot] == self._DEAD_ID and slot != self._ROOT_SLOT:
+                continue
+            start = tree.firstChildren[slot]
+            tree.firstChildren[slot] = len(childSlots)
+            childSlots.extend(tree.childSlots[start:start + tree.rowCounts[slot]])
+        tree.childSlots = childSlots
+        self._garbageCount = 0
+
+    def _forgetSubtree(self, slot: int):
+        tree = self._tree
+        stack = [slot]
+        while stack:
+            slot = stack.pop()
+            nodeId = tree.ids[slot]
+            if self._idToSlot.get(nodeId) == slot:
+                del self._idToSlot[nodeId]
+            self._fetchingIdToSlot.pop(nodeId, None)
+            tree.ids[slot] = self._DEAD_ID
+            stack.extend(tree.childrenOf(slot))
+            self._garbageCount += tree.rowCounts[slot]
+            tree.rowCounts[slot] = 0
+            self._freeSlots.append(slot)
+
+    def _slotOf(self, index: QtCore.QModelIndex) -> int:
+        return index.internalId() if index.isValid() else self._ROOT_SLOT
+
+    def _indexOfSlot(self, slot: int, column: int = 0) -> QtCore.QModelIndex:
+        if slot == self._ROOT_SLOT:
+            return QtCore.QModelIndex()
+        return self.createIndex(self._tree.rows[slot], column, slot)
+    # endregion
+
+    # region QAbstractItemModel
+    def index(self, row, column, parent=QtCore.QModelIndex()):
+        tree = self._tree
+        parentSlot = self._slotOf(parent)
+        if not 0 <= row < tree.rowCounts[parentSlot] or not 0 <= column < len(self._HEADERS):
+            return QtCore.QModelIndex()
+        return self.createIndex(row, column, tree.childSlots[tree.firstChildren[parentSlot] + row])
+
+    def parent(self, index=QtCore.QModelIndex()):
+        if not index.isValid():
+            return QtCore.QModelIndex()
+        return self._indexOfSlot(self._tree.parents[index.internalId()])
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        return self._tree.rowCounts[self._slotOf(parent)]
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return len(self._HEADERS)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        slot = index.internalId()
+        if role == QtCore.Qt.DisplayRole:
+            column = index.column()
+            if column == 0:
+                return self._tree.nameOf(slot)
+            if column == 1:
+                return self._tree.classOf(slot)
+            return str(self._tree.childCounts[slot])
+        if role == _CustomDataRole.WidgetId:
+            return self._tree.ids[slot]
+        if role == _CustomDataRole.ChildrenState:
+            return self._tree.states[slot]
+        return None
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole and 0 <= section < len(self._HEADERS):
+            return self._HEADERS[section]
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            return QtCore.Qt.NoItemFlags
+        return QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
+
+    def hasChildren(self, parent=QtCore.QModelIndex()):
+        if parent.column() > 0:
+            return False
+        slot = self._slotOf(parent)
+        if self._tree.rowCounts[slot] > 0:
+            return True
+        return not self._isSnapshot and self._tree.states[slot] != ChildrenState.Fetched
+
+    def canFetchMore(self, parent: QtCore.QModelIndex):
+        return not self._isSnapshot and parent.isValid() and parent.column() == 0 \
+            and self._tree.states[parent.internalId()] == ChildrenState.NotFetched
+
+    def fetchMore(self, parent: QtCore.QModelIndex):
+        if not self.canFetchMore(parent):
+            return
+        slot = parent.internalId()
+        self._tree.states[slot] = ChildrenState.Fetching
+        nodeId = self._tree.ids[slot]
+        self._fetchingIdToSlot[nodeId] = slot
+        self.sigFetchChildren.emit(nodeId)
+    # endregion
+
+    def setInfo(self, controlTreeInfo: typing.List[typing.Dict], pid: int = 0):
+        """ Show the tree sent by the process ``pid`` (0 if unknown), the ids of its snapshots are its handles. """
+        self.beginResetModel()
+        self._setTree(ControlTreeSnapshot.empty(pid), False)
+        self._build(self._ROOT_SLOT, controlTreeInfo)
+        self.endResetModel()
+
+    def setSnapshot(self, snapshot: ControlTreeSnapshot):
+        """ Show a snapshot opened from a file, read-only. """
+        self.beginResetModel()
+        self._setTree(snapshot, True)
+        self.endResetModel()
+
+    def snapshot(self) -> ControlTreeSnapshot:
+        """ A copy of the tree shown. """
+        return self._tree.compacted()
+
+    def indexOfId(self, nodeId: int) -> QtCore.QModelIndex:
+        """ The index of a node in O(1), invalid if it isn't in the tree. """
+        slot = self._idToSlot.get(nodeId)
+        if slot is None:
+            return QtCore.QModelIndex()
+        return self._indexOfSlot(slot)
+
+    def findIds(self, text: str, candidates: typing.Optional[typing.Iterable[int]] = None) -> typing.List[int]:
+        """ The ids of the nodes whose object name or class name contains ``text`` (lowercase).
+        :param candidates: only search among these ids, e.g. the matches of a prefix of ``text``
+        """
+        # Search the string tables, then the nodes referring to a matching string
+        tree = self._tree
+        nameIndexes = tree.names.findIndexes(text)
+        classIndexes = tree.classes.findIndexes(text)
+        if candidates is None:
+            slots = (slot for slot in self._idToSlot.values())
+        else:
+            slots = (self._idToSlot[nodeId] for nodeId in candidates if nodeId in self._idToSlot)
+        return [tree.ids[slot] for slot in slots
+                if tree.nameIndexes[slot] in nameIndexes or tree.classIndexes[slot] in classIndexes]
+
+    def setFetchedChildren(self, nodeId: int, childrenInfoList: typing.List[typing.Dict]):
+        slot = self._fetchingIdToSlot.pop(nodeId, None)
+        if slot is None:
+            return  # the tree has been refreshed since the request, or the node has been removed
+        parent = self._indexOfSlot(slot)
+        if childrenInfoList:
+            self.beginInsertRows(parent, 0, len(childrenInfoList) - 1)
+            self._build(slot, childrenInfoList)
+            self._tree.states[slot] = ChildrenState.Fetched
+            self.endInsertRows()
+        else:
+            self._tree.states[slot] = ChildrenState.Fetched
+        # The node may have lost its children (or been deleted) since the tree was sent
+        self._tree.childCounts[slot] = len(childrenInfoList)
+        self.dataChanged.emit(parent, self._indexOfSlot(slot, len(self._HEADERS) - 1))
+
+    def _emitChildCountChanged(self, slot: int):
+        if slot != self._ROOT_SLOT:
+            countIndex = self._indexOfSlot(slot, len(self._HEADERS) - 1)
+            self.dataChanged.emit(countIndex, countIndex)
+
+    def _fetchedSlotOfId(self, parentId: typing.Optional[int]) -> typing.Optional[int]:
+        """ The slot of a node whose children are shown, None if it isn't in the tree or not fetched. """
+        if parentId is None:
+            return self._ROOT_SLOT
+        slot = self._idToSlot.get(parentId)
+        if slot is None or self._tree.states[slot] != ChildrenState.Fetched:
+            return None
+        return slot
+
+    def _rowBefore(self, parentSlot: int, nextId: typing.Optional[int]) -> int:
+        """ The row of the node ``nextId`` if it is a child of ``parentSlot``, after the last child otherwise. """
+        nextSlot = self._idToSlot.get(nextId) if nextId is not None else None
+        if nextSlot is not None and self._tree.parents[nextSlot] == parentSlot:
+            return self._tree.rows[nextSlot]
+        return self._tree.rowCounts[parentSlot]
+
+    def _insertSlot(self, parentSlot: int, nextId: typing.Optional[int], slot: int):
+        children = self._tree.childrenOf(parentSlot)
+        row = self._rowBefore(parentSlot, nextId)
+        self.beginInsertRows(self._indexOfSlot(parentSlot), row, row)
+        children.insert(row, slot)
+        self._setChildren(parentSlot, children)
+        self.endInsertRows()
+        self._emitChildCountChanged(parentSlot)
+
+    def _removeSlot(self, slot: int, forget: bool):
+        parentSlot = self._tree.parents[slot]
+        row = self._tree.rows[slot]
+        self.beginRemoveRows(self._indexOfSlot(parentSlot), row, row)
+        children = self._tree.childrenOf(parentSlot)
+        del children[row]
+        self._setChildren(parentSlot, children)
+        if forget:
+            self._forgetSubtree(slot)
+        self.endRemoveRows()
+        self._emitChildCountChanged(parentSlot)
+
+    def _moveSlot(self, slot: int, parentSlot: int, nextId: typing.Optional[int]):
+        """ Move a node among the children of ``parentSlot``, the views keep its expansion and selection. """
+        oldParentSlot = self._tree.parents[slot]
+        oldRow = self._tree.rows[slot]
+        row = self._rowBefore(parentSlot, nextId)  # counted before the node is taken out, as `beginMoveRows` expects
+        if not self.beginMoveRows(self._indexOfSlot(oldParentSlot), oldRow, oldRow, self._indexOfSlot(parentSlot), row):
+            return  # already there
+        children = self._tree.childrenOf(oldParentSlot)
+        del children[oldRow]
+        self._setChildren(oldParentSlot, children)
+        if parentSlot == oldParentSlot and row > oldRow:
+            row -= 1
+        children = self._tree.childrenOf(parentSlot)
+        children.insert(row, slot)
+        self._setChildren(parentSlot, children)
+        self.endMoveRows()
+        if parentSlot != oldParentSlot:
+            self._emitChildCountChanged(oldParentSlot)
+            self._emitChildCountChanged(parentSlot)
+
+    def applyDelta(self, ops: typing.List[list]):
+        """ Patch the tree with the changes pushed by the client, see `DeltaOps`. """
+        if self._isSnapshot:
+            return
+        for op in ops:
+            kind = op[0]
+            if kind == DeltaOps.REMOVE:
+                slot = self._idToSlot.get(op[1])
+                if slot is None:
+                    continue
+                self._removeSlot(slot, forget=True)
+            elif kind == DeltaOps.ADD:
+                _, parentId, nextId, info = op
+                parentSlot = self._fetchedSlotOfId(parentId)
+                if parentSlot is None:
+                    continue
+                self._insertSlot(parentSlot, nextId, self._buildSubtree(parentSlot, info))
+            elif kind == DeltaOps.MOVE:
+                _, nodeId, parentId, nextId = op
+                slot = self._idToSlot.get(nodeId)
+                if slot is None:
+                    continue
+                parentSlot = self._fetchedSlotOfId(parentId)
+                if parentSlot is None:
+                    # Moved under a node not fetched: forgotten, it is sent again when that node is expanded
+                    self._removeSlot(slot, forget=True)
+                else:
+                    self._moveSlot(slot, parentSlot, nextId)
+
+    def clear(self):
+        self.beginResetModel()
+        self._setTree(ControlTreeSnapshot.empty(), False)
+        self.endResetModel()
 
 
 class ControlTreeView(QtWidgets.QTreeView):
     sigMouseLeave = QtCore.pyqtSignal()
     currentRowChanged = QtCore.pyqtSignal(QtCore.QModelIndex, QtCore.QModelIndex)  # newIndex, oldIndex
+    sigReqChildren = QtCore.pyqtSignal(int)  # node id
 
     def __init__(self, parent):
         super().__init__(parent)
         self.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)  # Disable editing
 
-        self._model = QtGui.QStandardItemModel(self)
+        self._model = _ControlTreeModel(self)
+        self._model.sigFetchChildren.connect(self.sigReqChildren)
         self.setModel(self._model)
 
         self.selectionModel().currentRowChanged.connect(self.currentRowChanged)
 
-    def setInfo(self, controlTreeInfo: typing.List[typing.Dict]):
-        self._model.clear()
-        self._model.setHorizontalHeaderLabels(["Object", "Type", "Child Count"])
+    def setInfo(self, controlTreeInfo: typing.List[typing.Dict], pid: int = 0):
+        self._model.setInfo(controlTreeInfo, pid)
         self.header().setSectionResizeMode(0, QtWidgets.QHeaderView.ResizeToContents)
         self.header().setSectionResizeMode(1, QtWidgets.QHeaderView.Stretch)
-        self._addSubItems(self._model, controlTreeInfo)
-
-    def _addSubItems(self, parentItem, childrenInfoList):
-        """ Recursively add sub items to the tree view. """
-        for childInfo in childrenInfoList:
-            widgetObjNameItem = QtGui.QStandardItem(childInfo[TreeViewKeys.OBJ_NAME_KEY])
-            widgetObjNameItem.setData(childInfo[TreeViewKeys.OBJ_ID_KEY], _CustomDataRole.WidgetId)
-            widgetTypeItem = QtGui.QStandardItem(childInfo[TreeViewKeys.OBJ_CLS_NAME_KEY])
-            widgetChildCountItem = QtGui.QStandardItem(str(childInfo[TreeViewKeys.CHILD_CNT_KEY]))
-
-            parentItem.appendRow([widgetObjNameItem, widgetTypeItem, widgetChildCountItem])
-
-            self._addSubItems(widgetObjNameItem, childInfo[TreeViewKeys.CHILDREN_KEY])
-
-    def locateWidget(self, widgetId: int):
-        """ Locate the widget in the tree view. """
-        def _find_helper(cur_item: QtGui.QStandardItem) -> bool:
-            for i in range(cur_item.rowCount()):
-                res = _find_helper(cur_item.child(i))
-                if res:
-                    # expand
-                    self.setExpanded(cur_item.index(), True)
-                    return True
-
-            if cur_item.data(_CustomDataRole.WidgetId) == widgetId:
-                # select the row
-                self.setCurrentIndex(cur_item.index())
-                return True
-            return False
 
+    def setSubtreeInfo(self, nodeId: int, childrenInfo: typing.List[typing.Dict]):
+        """ Add the children of a node fetched on expansion. """
+        self._model.setFetchedChildren(nodeId, childrenInfo)
+
+    def applyDelta(self, ops: typing.List[list]):
+        self._model.applyDelta(ops)
+
+    def setSnapshot(self, snapshot: ControlTreeSnapshot):
+        self._model.setSnapshot(snapshot)
+        self.header().setSectionResizeMode(0, QtWidgets.QHeaderView.ResizeToContents)
+        self.header().setSectionResizeMode(1, QtWidgets.QHeaderView.Stretch)
+
+    def snapshot(self) -> ControlTreeSnapshot:
+        return self._model.snapshot()
+
+    def isShowingSnapshot(self) -> bool:
+        return self._model.isSnapshot
+
+    def locateWidget(self, widgetId: int) -> bool:
+        """ Locate the widget in the tree view.
+        :return: whether the widget is found among the fetched nodes
+        """
         # Firstly, clear the index
         self.selectionModel().clearCurrentIndex()
-        _find_helper(self._model.invisibleRootItem())
+        index = self._model.indexOfId(widgetId)
+        if not index.isValid():
+            return False
+
+        # expand the ancestors
+        parent = index.parent()
+        while parent.isValid():
+            self.setExpanded(parent, True)
+            parent = parent.parent()
+        # select the row
+        self.setCurrentIndex(index)
+        self.scrollTo(index)
+        return True
+
+    def findWidgetIds(self, text: str, candidates: typing.Optional[typing.Iterable[int]] = None) -> typing.List[int]:
+        return self._model.findIds(text, candidates)
 
     def getCurrentSelectedWidgetId(self) -> typing.Optional[int]:
         index = self.currentIndex()
@@ -84,16 +455,19 @@ class ControlTreeView(QtWidgets.QTreeView):
 
 
 class ControlTreeViewWithWaitingOverlay(ControlTreeView):
+    _LOADING_MESSAGE = "Loading..."
+
     def __init__(self, parent):
         super().__init__(parent)
-        self._waitingOverlay = WaitingOverlay(self, "Loading...")
+        self._waitingOverlay = WaitingOverlay(self, self._LOADING_MESSAGE)
         self._waitingOverlay.hide()
 
     def resizeEvent(self, ev):
         self._waitingOverlay.setGeometry(self.rect())
         return super().resizeEvent(ev)
 
-    def showWaitingOverlay(self):
+    def showWaitingOverlay(self, message: str = _LOADING_MESSAGE):
+        self._waitingOverlay.setMessage(message)
         self._waitingOverlay.show()
 
     def hideWaitingOverlay(self):
@@ -101,7 +475,8 @@ class ControlTreeViewWithWaitingOverlay(ControlTreeView):
 
 
 class ControlTreeWindow(QtWidgets.QWidget):
-    sigReqControlTree = QtCore.pyqtSignal(bool)  # param1: need to locate current widget
+    sigReqControlTree = QtCore.pyqtSignal(bool, int)  # param1: need to locate current widget, param2: depth
+    sigReqControlSubtree = QtCore.pyqtSignal(int)  # param1: the id of the node whose children are requested
     sigReqCurrentSelectedWidgetId = QtCore.pyqtSignal()
     sigReqInspectWidget = QtCore.pyqtSignal(object)
     sigReqHighlightWidget = QtCore.pyqtSignal(object)
@@ -135,6 +510,41 @@ class ControlTreeWindow(QtWidgets.QWidget):
         self._inspectButton.clicked.connect(self._inspectCurrentRow)
         self._buttonLayout.addWidget(self._inspectButton)
 
+        self._saveSnapshotButton = QtWidgets.QPushButton(self)
+        self._saveSnapshotButton.setText("Save...")
+        self._saveSnapshotButton.setToolTip("Save the tree shown to a snapshot file")
+        self._saveSnapshotButton.clicked.connect(self._saveSnapshot)
+        self._buttonLayout.addWidget(self._saveSnapshotButton)
+
+        self._openSnapshotButton = QtWidgets.QPushButton(self)
+        self._openSnapshotButton.setText("Open...")
+        self._openSnapshotButton.setToolTip("Show a snapshot file, Refresh to go back to the live tree")
+        self._openSnapshotButton.clicked.connect(self._openSnapshot)
+        self._buttonLayout.addWidget(self._openSnapshotButton)
+
+        self._diffSnapshotButton = QtWidgets.QPushButton(self)
+        self._diffSnapshotButton.setText("Compare...")
+        self._diffSnapshotButton.setToolTip("Compare a snapshot file with the tree shown")
+        self._diffSnapshotButton.clicked.connect(self._diffWithSnapshot)
+        self._buttonLayout.addWidget(self._diffSnapshotButton)
+        self._diffWindow = None
+
+        self._findLineEdit = QtWidgets.QLineEdit(self)
+        self._findLineEdit.setPlaceholderText("Find by object name or class (Enter for the next match)")
+        self._findLineEdit.setClearButtonEnabled(True)
+        self._findLineEdit.textChanged.connect(self._onFindTextChanged)
+        self._findLineEdit.returnPressed.connect(self._selectNextMatch)
+        self._buttonLayout.addWidget(self._findLineEdit, 1)
+
+        self._findResultLabel = QtWidgets.QLabel(self)
+        self._buttonLayout.addWidget(self._findResultLabel)
+
+        # The matches of the last search, narrowed down while the text is extended
+        self._findText = ''
+        self._findMatches = []  # type: list[int]
+        self._findPos = -1
+        self._findMatchesStale = False
+
         self._treeWidget = ControlTreeViewWithWaitingOverlay(self)
         self._treeWidget.showWaitingOverlay()
 
@@ -143,6 +553,7 @@ class ControlTreeWindow(QtWidgets.QWidget):
         self._treeWidget.entered.connect(self._onTreeViewEntered)
         self._treeWidget.sigMouseLeave.connect(self._onMouseLeave)
         self._treeWidget.currentRowChanged.connect(self._onCurrentRowChanged)
+        self._treeWidget.sigReqChildren.connect(self.sigReqControlSubtree)
 
         self._highlightWhenHoverOption = QtWidgets.QCheckBox(self)
         self._highlightWhenHoverOption.setText("Highlight the corresponding widget when hovering a tree row")
@@ -151,32 +562,57 @@ class ControlTreeWindow(QtWidgets.QWidget):
 
         self._mainLayout.addWidget(self._highlightWhenHoverOption)
 
-    def notifyControlTreeInfo(self, controlTreeInfo: typing.List[typing.Dict]):
-        self._treeWidget.setInfo(controlTreeInfo)
+    def notifyControlTreeInfo(self, controlTreeInfo: typing.List[typing.Dict], pid: int = 0):
+        self._treeWidget.setInfo(controlTreeInfo, pid)
+        self.setWindowTitle('Control Tree View')
         self._treeWidget.hideWaitingOverlay()
+        self._invalidateFindMatches()
+
+    def notifyControlTreeTimedOut(self):
+        """ The control tree requested hasn't been received in time, it is still shown if it comes later. """
+        self._treeWidget.showWaitingOverlay("The control tree is taking long to build...\n"
+                                            "It will be shown when received, or click Refresh to request it again.")
 
-    def notifyLocateWidget(self, widgetId: int):
-        """ Locate the widget in the tree view. """
-        self._treeWidget.locateWidget(widgetId)
+    def notifyControlSubtreeInfo(self, nodeId: int, childrenInfo: typing.List[typing.Dict]):
+        self._treeWidget.setSubtreeInfo(nodeId, childrenInfo)
+        self._invalidateFindMatches()
+
+    def notifyControlTreeDelta(self, ops: typing.List[list]):
+        self._treeWidget.applyDelta(ops)
+        self._invalidateFindMatches()
+
+    def notifyLocateWidget(self, widgetId: int, refreshIfNotFetched: bool = False):
+        """ Locate the widget in the tree view.
+        :param refreshIfNotFetched: if the widget is under a node not expanded yet,
+            refresh the tree with the path to the widget.
+        """
+        if not self._treeWidget.locateWidget(widgetId) and refreshIfNotFetched:
+            self.refresh()
 
     def refresh(self):
         self._treeWidget.clear()
         self._treeWidget.showWaitingOverlay()
-        self.sigReqControlTree.emit(True)
+        self.sigReqControlTree.emit(True, _DefaultOptions.InitialDepth)
 
     # region Event handlers
     def _onRefreshButtonClicked(self):
         self.refresh()
 
     def _onLocateButtonClicked(self):
+        if self._treeWidget.isShowingSnapshot():
+            return  # the ids of a snapshot may refer to another process
         self.sigReqCurrentSelectedWidgetId.emit()
 
     def _inspectCurrentRow(self):
+        if self._treeWidget.isShowingSnapshot():
+            return
         widgetId = self._treeWidget.getCurrentSelectedWidgetId()
         if widgetId is not None:
             self.sigReqInspectWidget.emit(widgetId)
 
     def _reqHighlightWidgetByIndex(self, index: QtCore.QModelIndex):
+        if self._treeWidget.isShowingSnapshot():
+            return
         first_col_sibling = index.siblingAtColumn(0)
         wgtId = first_col_sibling.data(_CustomDataRole.WidgetId)
         self.sigReqHighlightWidget.emit(wgtId)
@@ -192,6 +628,79 @@ class ControlTreeWindow(QtWidgets.QWidget):
         if curIndex.isValid():
             self._reqHighlightWidgetByIndex(curIndex)
 
+    def _onFindTextChanged(self, text: str):
+        self._updateFindMatches(text.strip().lower())
+        self._selectNextMatch()
+
+    def _updateFindMatches(self, text: str):
+        # Incremental filtering: the matches of the extended text are among those of the previous one
+        isExtended = not self._findMatchesStale and self._findText and text.startswith(self._findText)
+        candidates = self._findMatches if isExtended else None
+        self._findMatches = self._treeWidget.findWidgetIds(text, candidates) if text else []
+        self._findText = text
+        self._findPos = -1
+        self._findMatchesStale = False
+
+    def _selectNextMatch(self):
+        if self._findMatchesStale:
+            pos = self._findPos
+            self._updateFindMatches(self._findText)
+            self._findPos = pos  # continue from about the same match
+        if not self._findText:
+            self._findResultLabel.clear()
+            return
+        if not self._findMatches:
+            self._findResultLabel.setText("No match")
+            return
+        self._findPos = (self._findPos + 1) % len(self._findMatches)
+        self._treeWidget.locateWidget(self._findMatches[self._findPos])
+        self._findResultLabel.setText(f"{self._findPos + 1}/{len(self._findMatches)}")
+
+    def _invalidateFindMatches(self):
+        """ The tree has changed, the next search starts from scratch. """
+        self._findMatchesStale = True
+
+    def _saveSnapshot(self):
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Save Control Tree Snapshot", "",
+                                                        _SNAPSHOT_FILE_FILTER)
+        if not path:
+            return
+        try:
+            self._treeWidget.snapshot().save(path)
+        except OSError as e:
+            QtWidgets.QMessageBox.critical(self, "Error", f"Failed to save the snapshot: {e}")
+
+    def _loadSnapshot(self, caption: str) -> typing.Tuple[typing.Optional[ControlTreeSnapshot], str]:
+        path, _ = QtWidgets.QFileDialog.getOpenFileName(self, caption, "", _SNAPSHOT_FILE_FILTER)
+        if not path:
+            return None, path
+        try:
+            return ControlTreeSnapshot.load(path), path
+        except (OSError, ValueError) as e:
+            QtWidgets.QMessageBox.critical(self, "Error", f"Failed to open the snapshot: {e}")
+            return None, path
+
+    def _openSnapshot(self):
+        snapshot, path = self._loadSnapshot("Open Control Tree Snapshot")
+        if snapshot is None:
+            return
+        self.sigReqUnhighlightWidget.emit()
+        self._treeWidget.setSnapshot(snapshot)
+        self._treeWidget.hideWaitingOverlay()
+        self._invalidateFindMatches()
+        self.setWindowTitle(f'Control Tree View - {os.path.basename(path)}')
+
+    def _diffWithSnapshot(self):
+        snapshot, path = self._loadSnapshot("Compare with Control Tree Snapshot")
+        if snapshot is None:
+            return
+        changes = diffSnapshots(snapshot, self._treeWidget.snapshot())
+        if self._diffWindow is None:
+            self._diffWindow = SnapshotDiffWindow(self)
+        self._diffWindow.setChanges(os.path.basename(path), "tree shown", changes)
+        self._diffWindow.show()
+        self._diffWindow.raise_()
+
     def _onHighlightWhenHoverOptionChanged(self, state):
         self._treeWidget.setMouseTracking(state == QtCore.Qt.Checked)
 
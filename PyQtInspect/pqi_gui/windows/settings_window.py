@@ -13,8 +13,9 @@ from PyQtInspect._pqi_bundle import pqi_log
 from PyQtInspect._pqi_bundle.pqi_contants import IS_WINDOWS, IS_MACOS, DEFAULT_HIGHLIGHT_COLOR
 from PyQtInspect.pqi_gui._pqi_res import get_icon
 
+from PyQtInspect.pqi_gui.path_resolver import parsePathMappings, MAPPING_SEPARATOR
 from PyQtInspect.pqi_gui.settings import SettingsController
-from PyQtInspect.pqi_gui.settings.enums import SupportedIDE
+from PyQtInspect.pqi_gui.settings.enums import SupportedIDE, ServerEngine
 from PyQtInspect.pqi_gui.settings.ide_jumpers import auto_detect_ide_path
 
 
@@ -282,6 +283,76 @@ class HighlightSettingsGroupBox(QtWidgets.QGroupBox):
         self._updateOverlayPreview()
 
 
+class ServerSettingsGroupBox(QtWidgets.QGroupBox):
+    """ Server settings group box with the engine selector """
+
+    def __init__(self, parent):
+        super().__init__("Server Settings", parent)
+
+        self._mainLayout = QtWidgets.QVBoxLayout(self)
+        self._mainLayout.setContentsMargins(10, 15, 10, 10)
+        self._mainLayout.setSpacing(10)
+
+        self._engineWidget = QtWidgets.QWidget(self)
+        self._engineLayout = QtWidgets.QHBoxLayout(self._engineWidget)
+        self._engineLayout.setSpacing(10)
+
+        self._engineLabel = QtWidgets.QLabel("Engine:", self)
+        self._engineLabel.setFixedWidth(100)
+        self._engineLayout.addWidget(self._engineLabel)
+
+        self._engineComboBox = QtWidgets.QComboBox(self)
+        self._engineComboBox.setFixedHeight(32)
+        self._engineComboBox.setToolTip("Takes effect the next time the server is started.\n"
+                                        "The single event loop scales better with many inspected processes.")
+        for engineName, engine in ServerEngine.get_server_engines_for_settings():
+            self._engineComboBox.addItem(engineName, engine)
+        self._engineLayout.addWidget(self._engineComboBox)
+
+        self._mainLayout.addWidget(self._engineWidget)
+
+    def getEngine(self) -> ServerEngine:
+        return self._engineComboBox.currentData()
+
+    def setEngine(self, engine: ServerEngine):
+        index = self._engineComboBox.findData(engine)
+        if index >= 0:
+            self._engineComboBox.setCurrentIndex(index)
+
+
+class PathMappingsGroupBox(QtWidgets.QGroupBox):
+    """ Path mapping settings group box, for the source files of the processes run on another host """
+
+    def __init__(self, parent):
+        super().__init__("Path Mappings", parent)
+
+        self._mainLayout = QtWidgets.QVBoxLayout(self)
+        self._mainLayout.setContentsMargins(10, 15, 10, 10)
+        self._mainLayout.setSpacing(10)
+
+        self._mappingsTextEdit = QtWidgets.QPlainTextEdit(self)
+        self._mappingsTextEdit.setFixedHeight(80)
+        self._mappingsTextEdit.setPlaceholderText(f"One rule per line, e.g.\n"
+                                                  f"/home/user/project {MAPPING_SEPARATOR} D:/project")
+        self._mappingsTextEdit.setToolTip("The source files of the creation stacks under a remote prefix\n"
+                                          "are looked for under the local prefix.")
+        self._mainLayout.addWidget(self._mappingsTextEdit)
+
+    def getMappings(self) -> str:
+        return self._mappingsTextEdit.toPlainText().strip()
+
+    def setMappings(self, mappings: str):
+        self._mappingsTextEdit.setPlainText(mappings)
+
+    def isValid(self) -> typing.Tuple[bool, str]:
+        """ Validate the mapping rules. Returns (is_valid, error_message) """
+        try:
+            parsePathMappings(self.getMappings())
+        except ValueError as e:
+            return False, str(e)
+        return True, ""
+
+
 class _HighlightPreviewWidget(QtWidgets.QWidget):
     """ A preview widget that shows a colored overlay when the mouse hovers over it. """
 
@@ -361,6 +432,14 @@ class SettingWindow(QtWidgets.QDialog):
         self._highlightSettingsGroup = HighlightSettingsGroupBox(self)
         self._mainLayout.addWidget(self._highlightSettingsGroup)
 
+        # Server Settings GroupBox
+        self._serverSettingsGroup = ServerSettingsGroupBox(self)
+        self._mainLayout.addWidget(self._serverSettingsGroup)
+
+        # Path Mappings GroupBox
+        self._pathMappingsGroup = PathMappingsGroupBox(self)
+        self._mainLayout.addWidget(self._pathMappingsGroup)
+
         self._mainLayout.addStretch()
 
         self._buttonLayout = QtWidgets.QHBoxLayout()
@@ -399,8 +478,18 @@ class SettingWindow(QtWidgets.QDialog):
         highlightColor = settingsCtrl.highlightColor  # type: str
         self._highlightSettingsGroup.setColor(highlightColor)
 
+        try:
+            serverEngine = ServerEngine(settingsCtrl.serverEngine)
+        except ValueError:
+            serverEngine = ServerEngine.Threads
+        self._serverSettingsGroup.setEngine(serverEngine)
+
+        pathMappings = settingsCtrl.pathMappings  # type: str
+        self._pathMappingsGroup.setMappings(pathMappings)
+
         pqi_log.info(f"Settings loaded: IDE Type={ideType}, IDE Path={idePath}, Parameters={ideParameters},"
-                     f" Highlight Color={highlightColor}")
+                     f" Highlight Color={highlightColor}, Server Engine={serverEngine},"
+                     f" Path Mappings={pathMappings!r}")
 
     def saveSettings(self):
         # Validate IDE settings
@@ -410,6 +499,13 @@ class SettingWindow(QtWidgets.QDialog):
             QtWidgets.QMessageBox.critical(self, "Error", errorMessage)
             return
 
+        # Validate path mappings
+        isValid, errorMessage = self._pathMappingsGroup.isValid()
+        if not isValid:
+            pqi_log.info(f"Path mappings validation failed: {errorMessage}")
+            QtWidgets.QMessageBox.critical(self, "Error", errorMessage)
+            return
+
         # Save IDE settings
         settingsCtrl = SettingsController.instance()
         ideType = self._ideSettingsGroup.getIDEType().value  # type: str
@@ -423,8 +519,15 @@ class SettingWindow(QtWidgets.QDialog):
         highlightColor = self._highlightSettingsGroup.getColor()
         settingsCtrl.highlightColor = highlightColor
 
+        serverEngine = self._serverSettingsGroup.getEngine().value  # type: str
+        settingsCtrl.serverEngine = serverEngine
+
+        pathMappings = self._pathMappingsGroup.getMappings()
+        settingsCtrl.pathMappings = pathMappings
+
         pqi_log.info(f"Settings saved: IDE Type={ideType}, IDE Path={idePath}, Parameters={ideParameters},"
-                     f" Highlight Color={highlightColor}")
+                     f" Highlight Color={highlightColor}, Server Engine={serverEngine},"
+                     f" Path Mappings={pathMappings!r}")
 
         self.sigSettingsSaved.emit()
         self.close()
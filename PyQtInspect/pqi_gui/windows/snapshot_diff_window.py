@@ -0,0 +1,48 @@
+# -*- encoding:utf-8 -*-
+import typing
+
+from PyQt5 import QtWidgets, QtGui, QtCore
+
+from PyQtInspect.pqi_gui.control_tree_snapshot import SnapshotChange, SnapshotChangeKind
+
+_KIND_TO_COLOR = {
+    SnapshotChangeKind.Added: QtGui.QColor(40, 150, 60),
+    SnapshotChangeKind.Removed: QtGui.QColor(200, 50, 50),
+    SnapshotChangeKind.Moved: QtGui.QColor(40, 100, 200),
+    SnapshotChangeKind.Renamed: QtGui.QColor(180, 120, 20),
+}
+
+
+class SnapshotDiffWindow(QtWidgets.QWidget):
+    """ The structural changes between two control tree snapshots. """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowFlags(QtCore.Qt.Window | QtCore.Qt.CustomizeWindowHint | QtCore.Qt.WindowCloseButtonHint)
+        self.resize(900, 500)
+        self.setWindowTitle('Control Tree Diff')
+
+        self._mainLayout = QtWidgets.QVBoxLayout(self)
+        self._mainLayout.setContentsMargins(8, 8, 8, 8)
+
+        self._summaryLabel = QtWidgets.QLabel(self)
+        self._mainLayout.addWidget(self._summaryLabel)
+
+        self._changesWidget = QtWidgets.QTreeWidget(self)
+        self._changesWidget.setRootIsDecorated(False)
+        self._changesWidget.setUniformRowHeights(True)
+        self._changesWidget.setHeaderLabels(["Change", "Node", "Detail"])
+        self._changesWidget.header().setSectionResizeMode(0, QtWidgets.QHeaderView.ResizeToContents)
+        self._changesWidget.header().setSectionResizeMode(1, QtWidgets.QHeaderView.Stretch)
+        self._mainLayout.addWidget(self._changesWidget)
+
+    def setChanges(self, oldName: str, newName: str, changes: typing.List[SnapshotChange]):
+        self._summaryLabel.setText(f"{oldName} → {newName}: {len(changes)} change(s)")
+        self._changesWidget.clear()
+        items = []
+        for change in changes:
+            item = QtWidgets.QTreeWidgetItem([change.kind, change.path, change.detail])
+            item.setForeground(0, _KIND_TO_COLOR[change.kind])
+            item.setToolTip(1, change.path)
+            items.append(item)
+        self._changesWidget.addTopLevelItems(items)
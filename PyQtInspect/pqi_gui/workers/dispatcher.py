@@ -2,13 +2,56 @@
 # A dispatcher is a class that can be used to send and receive messages between pqi-server and single pqi-client.
 
 from PyQt5 import QtCore
+import json
 import threading
 
-from PyQtInspect._pqi_bundle.pqi_comm import ReaderThread, WriterThread, NetCommandFactory
+from PyQtInspect._pqi_bundle import pqi_log
+from PyQtInspect._pqi_bundle.pqi_comm import ReaderThread, WriterThread, NetCommand, NetCommandFactory, \
+    choose_protocol
+from PyQtInspect._pqi_bundle.pqi_comm_constants import CMD_PROTOCOL_OFFER, CMD_SWITCH_PROTOCOL, CMD_REQ_CONTROL_TREE, \
+    TreeViewExtraKeys, CMD_WIDGET_INFO, CMD_HOVER_WIDGET, CMD_CHILDREN_INFO, CMD_CONTROL_TREE, CMD_CONTROL_TREE_DELTA, \
+    CMD_WIDGET_PROPS, CMD_ATTACH_PROGRESS, ID_TO_MEANING
+from PyQtInspect._pqi_bundle import pqi_incremental_json
+from PyQtInspect._pqi_bundle.pqi_compression import choose_compression
 from PyQtInspect._pqi_bundle.pqi_override import overrides
+from PyQtInspect._pqi_bundle.pqi_rpc import PendingRequests, RequestFuture
+from PyQtInspect._pqi_bundle.pqi_shared_memory import SharedMemoryRing, is_shared_memory_supported
 from PyQtInspect._pqi_bundle.pqi_typing import OptionalDict
 
 
+# The commands whose text is a JSON document, decoded before reaching the main UI, and the type of the document
+_JSON_COMMAND_TO_TYPE = {
+    CMD_WIDGET_INFO: dict,
+    CMD_HOVER_WIDGET: dict,
+    CMD_CHILDREN_INFO: dict,
+    CMD_CONTROL_TREE: dict,
+    CMD_CONTROL_TREE_DELTA: list,
+    CMD_WIDGET_PROPS: list,
+    CMD_ATTACH_PROGRESS: dict,
+}
+
+_INVALID = object()
+
+
+def decodeMessageData(cmd_id, text):
+    """ Decode the JSON text of a command, in the thread of the dispatcher rather than in the main thread.
+    :return: the decoded document, None if the command doesn't carry JSON, `_INVALID` if it is malformed.
+    """
+    expectedType = _JSON_COMMAND_TO_TYPE.get(cmd_id)
+    if expectedType is None:
+        return None
+    cmdName = ID_TO_MEANING.get(str(cmd_id), cmd_id)
+    try:
+        data = pqi_incremental_json.loads(text)
+    except ValueError:
+        pqi_log.warning(f"Malformed {cmdName} received, ignored.", exc_info=True)
+        return _INVALID
+    if not isinstance(data, expectedType):
+        pqi_log.warning(f"Unexpected {cmdName} received, ignored: a {expectedType.__name__} is expected.")
+        return _INVALID
+    return data
+
+
 class DispatchReader(ReaderThread):
     def __init__(self, dispatcher):
         ReaderThread.__init__(self, dispatcher.sock)
@@ -24,24 +67,145 @@ class DispatchReader(ReaderThread):
         self.dispatcher.notifyDelete()
 
     def process_command(self, cmd_id, seq, text):
-        # unquote text
-        from urllib.parse import unquote
-        text = unquote(text)
-        self.dispatcher.notify(cmd_id, seq, text)
+        # The text has been decoded by the reader, whichever protocol is used.
+        if cmd_id in (CMD_PROTOCOL_OFFER, CMD_SWITCH_PROTOCOL):
+            # Transport negotiation is handled by the dispatcher itself, the main UI never sees it.
+            self.dispatcher.onProtocolCommand(cmd_id, text)
+            return
+        if not self.dispatcher.requests.resolve(cmd_id, seq, text, NetCommand.is_own_seq):
+            return  # the reply of a cancelled request, e.g. the props of the widget selected before
+        # Recorded once the stale replies are dropped, so that a replay delivers exactly what the UI received
+        if self.dispatcher.sessionRecorder is not None:
+            self.dispatcher.sessionRecorder.record(self.dispatcher.id, cmd_id, seq, text)
+        data = decodeMessageData(cmd_id, text)
+        if data is _INVALID:
+            return
+        self.dispatcher.notify(cmd_id, seq, text, data)
+
+
+class DispatcherMixin:
+    """ The commands exchanged with a single pqi-client, whichever server engine owns its socket.
+
+    The subclass provides ``id``, ``writer`` (a `WriterThread`), ``net_command_factory`` and ``requests``.
+    """
+    # The `SessionRecorder` the received messages are appended to, if the session is recorded
+    sessionRecorder = None
+
+    # Timeouts (in seconds) of the requests, the control tree of a large application takes a while to build.
+    REQUEST_TIMEOUT = 10.0
+    CONTROL_TREE_REQUEST_TIMEOUT = 60.0
+
+    def onProtocolCommand(self, cmd_id, text):
+        if cmd_id == CMD_PROTOCOL_OFFER:
+            offer = json.loads(text)
+            protocol = choose_protocol(offer.get('protocols', []))
+            pqi_log.info(f"Dispatcher {self.id}: using the {protocol} protocol.")
+            self.writer.switch_protocol(protocol)
+
+            compression = choose_compression(offer.get('compressions', []))
+            if compression is not None:
+                pqi_log.info(f"Dispatcher {self.id}: compressing large payloads with {compression}.")
+                self.writer.add_command(self.net_command_factory.make_set_compression_message(compression))
+                self.writer.set_compression(compression)
+
+            sharedMemory = offer.get('shared_memory')
+            if sharedMemory and is_shared_memory_supported():
+                self._attachSharedMemory(sharedMemory)
+        else:  # CMD_SWITCH_PROTOCOL, the client has switched its outgoing stream
+            # No-op as the outgoing stream has already been switched.
+            self.writer.switch_protocol(text)
+
+    def _attachSharedMemory(self, name: str):
+        """ Read the large payloads of the client from its shared-memory ring (local transport). """
+        try:
+            ring = SharedMemoryRing.attach(name)
+        except Exception:
+            pqi_log.warning(f"Dispatcher {self.id}: failed to attach to the shared memory {name}.", exc_info=True)
+            return
+        pqi_log.info(f"Dispatcher {self.id}: reading large payloads from the shared memory {name}.")
+        self.reader.shared_memory_ring = ring
+        self.writer.add_command(self.net_command_factory.make_shared_memory_attached_message(name))
+
+    def _detachSharedMemory(self):
+        if self.reader is not None and self.reader.shared_memory_ring is not None:
+            self.reader.shared_memory_ring.close()
+
+    def sendEnableInspect(self, extra: dict):
+        self.writer.add_command(self.net_command_factory.make_enable_inspect_message(extra))
+
+    def sendDisableInspect(self):
+        self.writer.add_command(self.net_command_factory.make_disable_inspect_message())
+
+    def sendExecCodeEvent(self, code: str):
+        self.writer.add_command(self.net_command_factory.make_exec_code_message(code))
+
+    def sendHighlightWidgetEvent(self, widgetId: int, isHighlight: bool):
+        self.writer.add_command(self.net_command_factory.make_set_widget_highlight_message(widgetId, isHighlight))
+
+    def sendSelectWidgetEvent(self, widgetId: int):
+        self.writer.add_command(self.net_command_factory.make_select_widget_message(widgetId))
+
+    def _sendRequest(self, cmd, timeout: float, supersedeKey=None) -> RequestFuture:
+        """ Send a request whose reply echoes its seq.
+
+        A new request supersedes the pending one of the same kind (e.g. rapid clicks through the hierarchy bar):
+        the latter is dropped from the writer queue if it hasn't been sent yet,
+        otherwise the client is told to skip it and its reply is ignored.
+
+        :param supersedeKey: what makes two requests of the same kind, the command id by default.
+        """
+        if supersedeKey is None:
+            supersedeKey = cmd.id
+        future = self.requests.add(cmd, supersede_key=supersedeKey, timeout=timeout)
+        cmd.coalesce_key = supersedeKey
+        self.writer.add_command(cmd)
+        return future
+
+    def _sendCancelRequest(self, seq: int):
+        if self.writer is not None:
+            self.writer.add_command(self.net_command_factory.make_cancel_request_message(seq))
+
+    def sendRequestWidgetInfoEvent(self, widgetId: int, extra: OptionalDict = None) -> RequestFuture:
+        return self._sendRequest(self.net_command_factory.make_req_widget_info_message(widgetId, extra),
+                                 self.REQUEST_TIMEOUT)
+
+    def sendRequestChildrenInfoEvent(self, widgetId: int) -> RequestFuture:
+        return self._sendRequest(self.net_command_factory.make_req_children_info_message(widgetId),
+                                 self.REQUEST_TIMEOUT)
+
+    def sendRequestControlTreeInfoEvent(self, extra: OptionalDict = None) -> RequestFuture:
+        # The subtrees of different nodes are expanded independently, a new request only supersedes the same subtree
+        rootId = extra.get(TreeViewExtraKeys.ROOT_ID) if extra else None
+        return self._sendRequest(self.net_command_factory.make_req_control_tree_message(extra),
+                                 self.CONTROL_TREE_REQUEST_TIMEOUT,
+                                 supersedeKey=(CMD_REQ_CONTROL_TREE, rootId))
+
+    def sendRequestWidgetPropsEvent(self, widgetId: int) -> RequestFuture:
+        return self._sendRequest(self.net_command_factory.make_req_widget_props_message(widgetId),
+                                 self.REQUEST_TIMEOUT)
+
+    def sendSettingsChanged(self, settings: dict):
+        self.writer.add_command(self.net_command_factory.make_settings_changed_message(settings))
 
 
-class Dispatcher(QtCore.QThread):
+class Dispatcher(QtCore.QThread, DispatcherMixin):
+    """ Serve a single pqi-client with its own reader and writer threads. """
     sigMsg = QtCore.pyqtSignal(int, dict)  # dispatcher_id, info
     sigClosed = QtCore.pyqtSignal(int)
 
-    def __init__(self, parent, sock, id):
+    def __init__(self, parent, sock, id, sessionRecorder=None):
         super().__init__(parent)
         self.sock = sock
         self.id = id
+        self.sessionRecorder = sessionRecorder
         self.net_command_factory = NetCommandFactory()
         self.reader = None
         self.writer = None
 
+        # The replies echo the seq of their request, make it distinct from the seqs generated by the client.
+        NetCommand.use_odd_seqs()
+        self.requests = PendingRequests(self._sendCancelRequest)
+
         # When the dispatcher is just created, the main UI may not yet be ready to process the incoming messages
         # (PQYWorker has not emitted the signal that a new dispatcher is available).
         # Buffer messages until the main UI is ready.
@@ -58,10 +222,12 @@ class Dispatcher(QtCore.QThread):
         self.reader.run()
 
     def close(self):
+        self.requests.close()
         try:
             self.writer.do_kill_pydev_thread()
             self.reader.do_kill_pydev_thread()
             self.sock.close()
+            self._detachSharedMemory()
         except:
             pass
         self.sigClosed.emit(self.id)
@@ -70,45 +236,16 @@ class Dispatcher(QtCore.QThread):
         """ The Main UI is ready and we can start processing messages.
         """
         self._mainUIReady = True
-        for cmd_id, seq, text in self._msg_buffer:
-            self.notify(cmd_id, seq, text)
+        for cmd_id, seq, text, data in self._msg_buffer:
+            self.notify(cmd_id, seq, text, data)
         self._msg_buffer.clear()
 
-    def notify(self, cmd_id, seq, text):
+    def notify(self, cmd_id, seq, text, data=None):
+        """ :param data: the decoded JSON of the text, see `decodeMessageData` """
         if not self._mainUIReady:
             # Not ready yet, buffer the message.
-            self._msg_buffer.append((cmd_id, seq, text))
-        self.sigMsg.emit(self.id, {"cmd_id": cmd_id, "seq": seq, "text": text})
-
-    def sendEnableInspect(self, extra: dict):
-        self.writer.add_command(self.net_command_factory.make_enable_inspect_message(extra))
-
-    def sendDisableInspect(self):
-        self.writer.add_command(self.net_command_factory.make_disable_inspect_message())
-
-    def sendExecCodeEvent(self, code: str):
-        self.writer.add_command(self.net_command_factory.make_exec_code_message(code))
-
-    def sendHighlightWidgetEvent(self, widgetId: int, isHighlight: bool):
-        self.writer.add_command(self.net_command_factory.make_set_widget_highlight_message(widgetId, isHighlight))
-
-    def sendSelectWidgetEvent(self, widgetId: int):
-        self.writer.add_command(self.net_command_factory.make_select_widget_message(widgetId))
-
-    def sendRequestWidgetInfoEvent(self, widgetId: int, extra: OptionalDict = None):
-        self.writer.add_command(self.net_command_factory.make_req_widget_info_message(widgetId, extra))
-
-    def sendRequestChildrenInfoEvent(self, widgetId: int):
-        self.writer.add_command(self.net_command_factory.make_req_children_info_message(widgetId))
-
-    def sendRequestControlTreeInfoEvent(self, extra: OptionalDict = None):
-        self.writer.add_command(self.net_command_factory.make_req_control_tree_message(extra))
-
-    def sendRequestWidgetPropsEvent(self, widgetId: int):
-        self.writer.add_command(self.net_command_factory.make_req_widget_props_message(widgetId))
-
-    def sendSettingsChanged(self, settings: dict):
-        self.writer.add_command(self.net_command_factory.make_settings_changed_message(settings))
+            self._msg_buffer.append((cmd_id, seq, text, data))
+        self.sigMsg.emit(self.id, {"cmd_id": cmd_id, "seq": seq, "text": text, "data": data})
 
     def notifyDelete(self):
         self.close()
@@ -1,9 +1,14 @@
 # -*- encoding:utf-8 -*-
 import sys
+import threading
 from PyQt5 import QtCore
 import traceback
+import typing
 from socket import socket, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR, SHUT_RDWR
 
+from PyQtInspect._pqi_bundle.pqi_comm import create_local_server_socket, close_local_server_socket
+from PyQtInspect._pqi_bundle.pqi_rpc import RequestFuture
+from PyQtInspect._pqi_bundle.pqi_session import SessionRecorder
 from PyQtInspect._pqi_bundle.pqi_typing import OptionalDict
 from PyQtInspect.pqi_gui.workers.dispatcher import Dispatcher
 
@@ -15,15 +20,19 @@ class PQYWorker(QtCore.QObject):
     sigAllDispatchersExited = QtCore.pyqtSignal()
     sigSocketError = QtCore.pyqtSignal(str)
 
-    def __init__(self, parent, port):
+    def __init__(self, parent, port, sessionRecorder: typing.Optional[SessionRecorder] = None):
         super().__init__(parent)
         self.port = port
+        self.sessionRecorder = sessionRecorder
 
         self.dispatchers = []  # type: list[Dispatcher]
         self.idToDispatcher = {}  # type: dict[int, Dispatcher]
 
         self._isServing = False
         self._socket = None
+        self._localSocket = None  # the Unix domain socket for the clients on the same host, accepted by its own thread
+        self._nextDispatcherId = 0
+        self._dispatcherIdLock = threading.Lock()
 
     def run(self):
         self._isServing = True
@@ -39,21 +48,15 @@ class PQYWorker(QtCore.QObject):
             self._socket.bind(('', self.port))
             self._socket.listen(1)
 
-            dispatcherId = 0
+            self._localSocket = create_local_server_socket(self.port)
+            if self._localSocket is not None:
+                localAcceptThread = threading.Thread(target=self._acceptLocalConnections, name='pqi.LocalAccept')
+                localAcceptThread.daemon = True
+                localAcceptThread.start()
 
             while self._isServing:
                 newSock, _addr = self._socket.accept()
-                # Create a new thread to handle the connection.
-                dispatcher = Dispatcher(None, newSock, dispatcherId)
-                # The connection type must be DirectConnection,
-                # otherwise the signal will be ignored because the thread event loop is not running.
-                dispatcher.sigClosed.connect(self._onDispatcherClosed, QtCore.Qt.DirectConnection)
-                self.dispatchers.append(dispatcher)
-                self.idToDispatcher[dispatcherId] = dispatcher
-
-                self.sigNewDispatcher.emit(dispatcher)
-                dispatcher.start()
-                dispatcherId += 1
+                self._addDispatcher(newSock)
 
         except Exception as e:
             if not self._isServing or getattr(e, 'errno') == 10038:
@@ -64,8 +67,49 @@ class PQYWorker(QtCore.QObject):
             traceback.print_exc()
             self.sigSocketError.emit(str(e))
 
+    def _acceptLocalConnections(self):
+        try:
+            while self._isServing:
+                newSock, _addr = self._localSocket.accept()
+                if not self._isServing:
+                    newSock.close()  # the wake-up connection of `stop`
+                    break
+                self._addDispatcher(newSock)
+        except OSError:
+            pass  # Socket closed.
+
+    def _addDispatcher(self, newSock):
+        with self._dispatcherIdLock:
+            dispatcherId = self._nextDispatcherId
+            self._nextDispatcherId += 1
+        # Create a new thread to handle the connection.
+        dispatcher = Dispatcher(None, newSock, dispatcherId, self.sessionRecorder)
+        # The connection type must be DirectConnection,
+        # otherwise the signal will be ignored because the thread event loop is not running.
+        dispatcher.sigClosed.connect(self._onDispatcherClosed, QtCore.Qt.DirectConnection)
+        self.dispatchers.append(dispatcher)
+        self.idToDispatcher[dispatcherId] = dispatcher
+
+        self.sigNewDispatcher.emit(dispatcher)
+        dispatcher.start()
+
+    def _stopAcceptingLocalConnections(self):
+        if self._localSocket is None:
+            return
+        # A blocking `accept` on a Unix domain socket isn't interrupted by closing it, connect to wake it up.
+        try:
+            from socket import AF_UNIX
+            with socket(AF_UNIX, SOCK_STREAM) as wakeUpSock:
+                wakeUpSock.settimeout(1)
+                wakeUpSock.connect(self._localSocket.getsockname())
+        except OSError:
+            pass
+        close_local_server_socket(self._localSocket)
+        self._localSocket = None
+
     def stop(self):
         self._isServing = False
+        self._stopAcceptingLocalConnections()
         for dispatcher in self.dispatchers:
             dispatcher.close()
 
@@ -123,25 +167,25 @@ class PQYWorker(QtCore.QObject):
         if dispatcher:
             dispatcher.sendSelectWidgetEvent(widgetId)
 
-    def sendRequestWidgetInfoEvent(self, dispatcherId: int, widgetId: int, extra: OptionalDict = None):
+    def sendRequestWidgetInfoEvent(self, dispatcherId: int, widgetId: int, extra: OptionalDict = None) -> typing.Optional[RequestFuture]:
         dispatcher = self.idToDispatcher.get(dispatcherId)
         if dispatcher:
-            dispatcher.sendRequestWidgetInfoEvent(widgetId, extra)
+            return dispatcher.sendRequestWidgetInfoEvent(widgetId, extra)
 
-    def sendRequestChildrenInfoEvent(self, dispatcherId: int, widgetId: int):
+    def sendRequestChildrenInfoEvent(self, dispatcherId: int, widgetId: int) -> typing.Optional[RequestFuture]:
         dispatcher = self.idToDispatcher.get(dispatcherId)
         if dispatcher:
-            dispatcher.sendRequestChildrenInfoEvent(widgetId)
+            return dispatcher.sendRequestChildrenInfoEvent(widgetId)
 
-    def sendRequestControlTreeInfoEvent(self, dispatcherId: int, extra: OptionalDict = None):
+    def sendRequestControlTreeInfoEvent(self, dispatcherId: int, extra: OptionalDict = None) -> typing.Optional[RequestFuture]:
         dispatcher = self.idToDispatcher.get(dispatcherId)
         if dispatcher:
-            dispatcher.sendRequestControlTreeInfoEvent(extra)
+            return dispatcher.sendRequestControlTreeInfoEvent(extra)
 
-    def sendRequestWidgetPropsEvent(self, dispatcherId: int, widgetId: int):
+    def sendRequestWidgetPropsEvent(self, dispatcherId: int, widgetId: int) -> typing.Optional[RequestFuture]:
         dispatcher = self.idToDispatcher.get(dispatcherId)
         if dispatcher:
-            dispatcher.sendRequestWidgetPropsEvent(widgetId)
+            return dispatcher.sendRequestWidgetPropsEvent(widgetId)
 
     def _onDispatcherClosed(self, id: int):
         try:
@@ -0,0 +1,317 @@
+# -*- encoding:utf-8 -*-
+# ==============================================
+# Description: A server engine multiplexing all the pqi-clients on a single selector loop
+# ==============================================
+# Unlike `PQYWorker`, which runs a `Dispatcher` (a reader and a writer thread) per client,
+# `SelectorWorker` serves every client from its own thread, so `--multiprocess` applications
+# spawning dozens of processes don't cost dozens of threads.
+import selectors
+import socket
+import sys
+import traceback
+import typing
+
+from PyQt5 import QtCore
+
+from PyQtInspect._pqi_bundle import pqi_log
+from PyQtInspect._pqi_bundle.pqi_comm import WriterThread, NetCommand, NetCommandFactory, FrameTooLargeError, \
+    create_local_server_socket, close_local_server_socket
+from PyQtInspect._pqi_bundle.pqi_rpc import PendingRequests, RequestFuture
+from PyQtInspect._pqi_bundle.pqi_session import SessionRecorder
+from PyQtInspect._pqi_bundle.pqi_typing import OptionalDict
+from PyQtInspect.pqi_gui.workers.dispatcher import DispatcherMixin, DispatchReader
+
+
+class _ConnectionWriter(WriterThread):
+    """ A writer which is never started: the selector loop sends what it encodes. """
+
+    def __init__(self, sock, wakeUp: typing.Callable[[], None]):
+        WriterThread.__init__(self, sock)
+        self._wakeUp = wakeUp
+
+    def add_command(self, cmd):
+        WriterThread.add_command(self, cmd)
+        self._wakeUp()
+
+
+class _Connection(DispatcherMixin):
+    """ The state of a pqi-client served by `SelectorWorker`, it plays the role of `Dispatcher` without any thread. """
+
+    def __init__(self, worker: 'SelectorWorker', sock, id: int):
+        self.sock = sock
+        self.id = id
+        self.sessionRecorder = worker.sessionRecorder
+        self.net_command_factory = NetCommandFactory()
+        self.requests = PendingRequests(self._sendCancelRequest)
+        self.writer = _ConnectionWriter(sock, worker.wakeUp)
+        self.reader = DispatchReader(self)  # never started, fed by `SelectorWorker`
+        self._worker = worker
+
+        self.outgoing = bytearray()  # encoded but not sent yet
+        self.exitRequested = False  # `CMD_EXIT` is encoded, close once sent
+
+    def notify(self, cmd_id, seq, text, data=None):
+        self._worker.pendingMessages.append((self.id, {"cmd_id": cmd_id, "seq": seq, "text": text, "data": data}))
+
+    def notifyDelete(self):
+        self._worker.closeConnection(self)
+
+    def fillOutgoing(self):
+        while not self.exitRequested:
+            data, self.exitRequested = self.writer.encode_queued()
+            if not data:
+                break
+            self.outgoing += data
+
+    def flush(self) -> bool:
+        """ Send as much as the socket accepts, return whether everything is sent. """
+        while self.outgoing:
+            try:
+                sent = self.sock.send(self.outgoing)
+            except (BlockingIOError, InterruptedError):
+                return False
+            del self.outgoing[:sent]
+        return True
+
+
+class SelectorWorker(QtCore.QObject):
+    """ Serve all the pqi-clients on one `selectors` loop.
+
+    The messages received during an iteration of the loop are delivered to the main thread
+    through a single `sigMessagesRecv` emission, a list of ``(dispatcherId, info)``.
+    It has the same sending interface as `PQYWorker`.
+    """
+    sigMessagesRecv = QtCore.pyqtSignal(list)
+    sigDispatcherExited = QtCore.pyqtSignal(int)
+    sigAllDispatchersExited = QtCore.pyqtSignal()
+    sigSocketError = QtCore.pyqtSignal(str)
+
+    def __init__(self, parent, port, sessionRecorder: typing.Optional[SessionRecorder] = None):
+        super().__init__(parent)
+        self.port = port
+        self.sessionRecorder = sessionRecorder
+
+        # The replies echo the seq of their request, make it distinct from the seqs generated by the clients.
+        NetCommand.use_odd_seqs()
+
+        self.idToDispatcher = {}  # type: dict[int, _Connection]
+        self.pendingMessages = []  # type: list[tuple[int, dict]]
+
+        self._isServing = False
+        self._socket = None
+        self._localSocket = None  # the Unix domain socket for the clients on the same host
+        self._selector = None
+        # Written by the other threads to wake up the loop when commands are queued or the worker is stopped.
+        self._wakeUpReader, self._wakeUpWriter = socket.socketpair()
+        self._wakeUpReader.setblocking(False)
+        self._wakeUpWriter.setblocking(False)
+
+    @property
+    def dispatchers(self) -> typing.List[_Connection]:
+        return list(self.idToDispatcher.values())
+
+    def wakeUp(self):
+        try:
+            self._wakeUpWriter.send(b'\0')
+        except OSError:
+            pass  # the loop has already plenty of wake-ups pending, or it has stopped
+
+    def run(self):
+        self._isServing = True
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            from socket import SO_REUSEPORT
+            self._socket.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+        except ImportError:
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            self._socket.bind(('', self.port))
+            self._socket.listen(16)
+        except Exception as e:
+            sys.stderr.write("Could not bind to port: %s\n" % (self.port,))
+            sys.stderr.flush()
+            traceback.print_exc()
+            self.sigSocketError.emit(str(e))
+            return
+        self._socket.setblocking(False)
+
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._socket, selectors.EVENT_READ)
+        self._localSocket = create_local_server_socket(self.port)
+        if self._localSocket is not None:
+            self._localSocket.setblocking(False)
+            self._selector.register(self._localSocket, selectors.EVENT_READ)
+        self._selector.register(self._wakeUpReader, selectors.EVENT_READ)
+        try:
+            self._loop()
+        except Exception as e:
+            traceback.print_exc()
+            self.sigSocketError.emit(str(e))
+        finally:
+            self._shutdown()
+
+    def _loop(self):
+        nextDispatcherId = 0
+        while self._isServing:
+            for key, events in self._selector.select():
+                if key.fileobj is self._socket or key.fileobj is self._localSocket:
+                    nextDispatcherId = self._accept(key.fileobj, nextDispatcherId)
+                elif key.fileobj is self._wakeUpReader:
+                    self._drainWakeUps()
+                else:
+                    connection = key.data  # type: _Connection
+                    if connection.id not in self.idToDispatcher:
+                        continue  # closed during this iteration
+                    if events & selectors.EVENT_READ and not self._read(connection):
+                        self.closeConnection(connection)
+
+            for connection in self.dispatchers:
+                self._write(connection)
+
+            if self.pendingMessages:
+                messages, self.pendingMessages = self.pendingMessages, []
+                self.sigMessagesRecv.emit(messages)
+
+    def _accept(self, listeningSocket, dispatcherId: int) -> int:
+        try:
+            newSock, _addr = listeningSocket.accept()
+        except (BlockingIOError, InterruptedError):
+            return dispatcherId
+        newSock.setblocking(False)
+        connection = _Connection(self, newSock, dispatcherId)
+        self.idToDispatcher[dispatcherId] = connection
+        self._selector.register(newSock, selectors.EVENT_READ, connection)
+        pqi_log.info(f"Dispatcher {dispatcherId} connected.")
+        return dispatcherId + 1
+
+    def _drainWakeUps(self):
+        try:
+            while self._wakeUpReader.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def _read(self, connection: _Connection) -> bool:
+        try:
+            return connection.reader.read_available()
+        except FrameTooLargeError as e:
+            pqi_log.warning(f"Dispatcher {connection.id}: {e}, closing the connection.")
+            return False
+        except OSError:
+            return False
+
+    def _write(self, connection: _Connection):
+        connection.fillOutgoing()
+        try:
+            allSent = connection.flush()
+        except OSError:
+            self.closeConnection(connection)
+            return
+
+        if allSent and connection.exitRequested:
+            self.closeConnection(connection)
+            return
+        events = selectors.EVENT_READ if allSent else selectors.EVENT_READ | selectors.EVENT_WRITE
+        if self._selector.get_key(connection.sock).events != events:
+            self._selector.modify(connection.sock, events, connection)
+
+    def closeConnection(self, connection: _Connection):
+        if self.idToDispatcher.pop(connection.id, None) is None:
+            return  # already closed
+        connection.requests.close()
+        connection._detachSharedMemory()
+        try:
+            self._selector.unregister(connection.sock)
+        except (KeyError, ValueError):
+            pass
+        try:
+            connection.sock.close()
+        except OSError:
+            pass
+
+        self.sigDispatcherExited.emit(connection.id)
+        if not self.idToDispatcher:
+            self.sigAllDispatchersExited.emit()
+
+    def _shutdown(self):
+        # Send what the main thread has queued before stopping (e.g. disabling the inspection), then close.
+        for connection in self.dispatchers:
+            connection.fillOutgoing()
+            try:
+                connection.sock.setblocking(True)
+                connection.sock.sendall(connection.outgoing)
+            except OSError:
+                pass
+            self.closeConnection(connection)
+
+        self._selector.close()
+        if self._localSocket is not None:
+            close_local_server_socket(self._localSocket)
+        for sock in (self._socket, self._wakeUpReader, self._wakeUpWriter):
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def stop(self):
+        self._isServing = False
+        self.wakeUp()
+
+    def sendEnableInspect(self, extra: dict):
+        for dispatcher in self.dispatchers:
+            dispatcher.sendEnableInspect(extra)
+
+    def sendEnableInspectToDispatcher(self, dispatcherId: int, extra: dict):
+        dispatcher = self.idToDispatcher.get(dispatcherId)
+        if dispatcher:
+            dispatcher.sendEnableInspect(extra)
+
+    def sendDisableInspect(self):
+        for dispatcher in self.dispatchers:
+            dispatcher.sendDisableInspect()
+
+    def sendSettingsChanged(self, settings: dict):
+        for dispatcher in self.dispatchers:
+            dispatcher.sendSettingsChanged(settings)
+
+    def sendSettingsChangedToDispatcher(self, dispatcherId: int, settings: dict):
+        dispatcher = self.idToDispatcher.get(dispatcherId)
+        if dispatcher:
+            dispatcher.sendSettingsChanged(settings)
+
+    def sendExecCodeEvent(self, dispatcherId: int, code: str):
+        dispatcher = self.idToDispatcher.get(dispatcherId)
+        if dispatcher:
+            dispatcher.sendExecCodeEvent(code)
+
+    def sendHighlightWidgetEvent(self, dispatcherId: int, widgetId: int, isHighlight: bool):
+        dispatcher = self.idToDispatcher.get(dispatcherId)
+        if dispatcher:
+            dispatcher.sendHighlightWidgetEvent(widgetId, isHighlight)
+
+    def sendSelectWidgetEvent(self, dispatcherId: int, widgetId: int):
+        dispatcher = self.idToDispatcher.get(dispatcherId)
+        if dispatcher:
+            dispatcher.sendSelectWidgetEvent(widgetId)
+
+    def sendRequestWidgetInfoEvent(self, dispatcherId: int, widgetId: int,
+                                   extra: OptionalDict = None) -> typing.Optional[RequestFuture]:
+        dispatcher = self.idToDispatcher.get(dispatcherId)
+        if dispatcher:
+            return dispatcher.sendRequestWidgetInfoEvent(widgetId, extra)
+
+    def sendRequestChildrenInfoEvent(self, dispatcherId: int, widgetId: int) -> typing.Optional[RequestFuture]:
+        dispatcher = self.idToDispatcher.get(dispatcherId)
+        if dispatcher:
+            return dispatcher.sendRequestChildrenInfoEvent(widgetId)
+
+    def sendRequestControlTreeInfoEvent(self, dispatcherId: int,
+                                        extra: OptionalDict = None) -> typing.Optional[RequestFuture]:
+        dispatcher = self.idToDispatcher.get(dispatcherId)
+        if dispatcher:
+            return dispatcher.sendRequestControlTreeInfoEvent(extra)
+
+    def sendRequestWidgetPropsEvent(self, dispatcherId: int, widgetId: int) -> typing.Optional[RequestFuture]:
+        dispatcher = self.idToDispatcher.get(dispatcherId)
+        if dispatcher:
+            return dispatcher.sendRequestWidgetPropsEvent(widgetId)
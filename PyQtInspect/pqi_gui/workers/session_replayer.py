@@ -0,0 +1,80 @@
+# -*- encoding:utf-8 -*-
+# ==============================================
+# Description: Replay a recorded session offline, as if its messages were received again
+# ==============================================
+# The messages are delivered like `SelectorWorker` delivers them (a list of ``(dispatcherId, info)`` per emission),
+# so the main UI handles them the same way: post-mortem debugging, or a reproducible load to benchmark
+# the handling of the messages without launching any pqi-client.
+import threading
+import time
+
+from PyQt5 import QtCore
+
+from PyQtInspect._pqi_bundle import pqi_log
+from PyQtInspect._pqi_bundle.pqi_comm_constants import CMD_PROTOCOL_OFFER, CMD_SWITCH_PROTOCOL
+from PyQtInspect._pqi_bundle.pqi_session import iter_session
+from PyQtInspect.pqi_gui.workers.dispatcher import decodeMessageData, _INVALID
+
+
+class SessionReplayer(QtCore.QObject):
+    """ Replay the session at ``speed`` times the recorded pace, as fast as possible if ``speed`` is 0. """
+    sigMessagesRecv = QtCore.pyqtSignal(list)
+    sigFinished = QtCore.pyqtSignal(int)  # the number of messages replayed
+    sigError = QtCore.pyqtSignal(str)
+
+    # The messages are emitted by batches when they are replayed as fast as possible
+    MAX_BATCH_SIZE = 64
+
+    def __init__(self, parent, path: str, speed: float):
+        super().__init__(parent)
+        self.path = path
+        self.speed = speed
+        self._stopEvent = threading.Event()
+
+    def run(self):
+        try:
+            count = self._replay()
+        except (OSError, ValueError) as e:
+            pqi_log.warning(f"Failed to replay the session {self.path}.", exc_info=True)
+            self.sigError.emit(str(e))
+            return
+        pqi_log.info(f"Replayed {count} messages of the session {self.path}.")
+        self.sigFinished.emit(count)
+
+    def _replay(self) -> int:
+        count = 0
+        batch = []
+        startTime = firstTimestamp = None
+        for record in iter_session(self.path):
+            if self._stopEvent.is_set():
+                break
+            if record.cmd_id in (CMD_PROTOCOL_OFFER, CMD_SWITCH_PROTOCOL):
+                continue  # handled by the dispatcher itself
+
+            if self.speed > 0:
+                if startTime is None:
+                    startTime, firstTimestamp = time.perf_counter(), record.timestamp
+                delay = startTime + (record.timestamp - firstTimestamp) / self.speed - time.perf_counter()
+                if delay > 0:
+                    self._emitBatch(batch)
+                    if self._stopEvent.wait(delay):
+                        break
+
+            data = decodeMessageData(record.cmd_id, record.text)
+            if data is _INVALID:
+                continue
+            batch.append((record.dispatcher_id, {"cmd_id": record.cmd_id, "seq": record.seq,
+                                                 "text": record.text, "data": data}))
+            count += 1
+            if len(batch) >= self.MAX_BATCH_SIZE:
+                self._emitBatch(batch)
+        self._emitBatch(batch)
+        return count
+
+    def _emitBatch(self, batch: list):
+        if batch:
+            self.sigMessagesRecv.emit(batch[:])
+            batch.clear()
+
+    def stop(self):
+        self._stopEvent.set()
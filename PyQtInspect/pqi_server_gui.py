@@ -8,11 +8,11 @@ import pathlib
 import sys
 import typing
 import argparse
-import json
 
 from PyQtInspect._pqi_bundle.pqi_contants import IS_MACOS
 from PyQtInspect.pqi_gui.common_operators import CommonOperators
 from PyQtInspect.pqi_gui.settings import SettingsController
+from PyQtInspect.pqi_gui.settings.enums import ServerEngine
 
 # ↑ DO NOT import PyQtInspect-specific modules before inserting the module path into sys.path.
 
@@ -23,6 +23,9 @@ if pyqt_inspect_module_dir not in sys.path:
 
 from PyQtInspect._pqi_bundle import pqi_log
 from PyQtInspect.pqi_gui.workers.pqy_worker import PQYWorker, DUMMY_WORKER, DummyWorker
+from PyQtInspect.pqi_gui.workers.selector_worker import SelectorWorker
+from PyQtInspect.pqi_gui.workers.session_replayer import SessionReplayer
+from PyQtInspect._pqi_bundle.pqi_session import SessionRecorder
 
 pyqt_inspect_module_dir = str(pathlib.Path(__file__).resolve().parent.parent)
 if pyqt_inspect_module_dir not in sys.path:
@@ -36,7 +39,8 @@ from PyQtInspect.pqi_gui.tabs.widget_props_tree_widget import WidgetPropsTreeCon
 from PyQtInspect._pqi_bundle.pqi_comm_constants import (
     CMD_WIDGET_INFO, CMD_INSPECT_FINISHED, CMD_EXEC_CODE_ERROR,
     CMD_EXEC_CODE_RESULT, CMD_CHILDREN_INFO, CMD_QT_PATCH_SUCCESS, CMD_CONTROL_TREE,
-    CMD_EXIT, TreeViewResultKeys, TreeViewExtraKeys, CMD_WIDGET_PROPS
+    CMD_EXIT, TreeViewResultKeys, TreeViewExtraKeys, CMD_WIDGET_PROPS, CMD_CONTROL_TREE_DELTA, CMD_ATTACH_PROGRESS,
+    CMD_HOVER_WIDGET
 )
 from PyQtInspect.pqi_gui.windows.code_window import CodeWindow
 from PyQtInspect.pqi_gui.hierarchy_bar import HierarchyBar
@@ -46,6 +50,7 @@ import PyQtInspect.pqi_gui.data_center as DataCenter
 from PyQtInspect.pqi_gui._pqi_res import get_icon
 from PyQtInspect.pqi_gui.keyboard_hook_handler import KeyboardHookHandler
 from PyQtInspect.pqi_gui.widget_brief_widget import WidgetBriefWidget
+from PyQtInspect._pqi_bundle.pqi_rpc import RequestFuture
 from PyQtInspect._pqi_common.pqi_setup_holder import SetupHolder
 from PyQtInspect import version
 
@@ -75,6 +80,8 @@ class PQIWindow(QtWidgets.QMainWindow):
     _sigInspectFinished = QtCore.pyqtSignal()
     _sigInspectBegin = QtCore.pyqtSignal()
     _sigInspectDisabled = QtCore.pyqtSignal()
+    # Emitted by the timeout thread of the requests, queued to the main thread
+    _sigControlTreeRequestTimedOut = QtCore.pyqtSignal()
 
     def __init__(self, parent=None, defaultPort: int = _DEFAULT_PORT):
         super().__init__(parent)
@@ -95,7 +102,14 @@ class PQIWindow(QtWidgets.QMainWindow):
         self._controlTreeAction = QtWidgets.QAction(self)
         self._controlTreeAction.setText("Control Tree")
         self._viewMenu.addAction(self._controlTreeAction)
-        self._viewMenu.triggered.connect(self._openControlTreeWindow)
+        self._controlTreeAction.triggered.connect(self._openControlTreeWindow)
+
+        self._viewMenu.addSeparator()
+
+        self._replaySessionAction = QtWidgets.QAction(self)
+        self._replaySessionAction.setText("Replay Session...")
+        self._viewMenu.addAction(self._replaySessionAction)
+        self._replaySessionAction.triggered.connect(self._onReplaySessionActionTriggered)
         # endregion
 
         # region -- More Menu --
@@ -134,6 +148,7 @@ class PQIWindow(QtWidgets.QMainWindow):
         self._sigInspectBegin.connect(self._keyboardHookHandler.onInspectBegin)
         self._sigInspectFinished.connect(self._keyboardHookHandler.onInspectFinished)
         self._sigInspectDisabled.connect(self._keyboardHookHandler.onInspectDisabled)
+        self._sigControlTreeRequestTimedOut.connect(self._notifyTimeoutToControlTreeViewWindow)
         self._pressF8ToFinishSelectingAction.toggled.connect(self._onPressF8ToFinishSelectingToggled)
         # keyboard hook handler -> main gui
         self._keyboardHookHandler.sigDisableInspectKeyPressed.connect(self._onInspectKeyPressed)
@@ -194,6 +209,8 @@ class PQIWindow(QtWidgets.QMainWindow):
         self._codeWindow = None
         self._attachWindow = None
         self._controlTreeViewWindow = None  # None | ControlTreeViewWindow
+        self._controlTreeDispatcherId = None  # the dispatcher whose control tree is shown
+        self._dispatcherIdToPid = {}  # the processes patched, their pids identify the control tree snapshots
         # endregion
 
         # region -- Main Container --
@@ -305,6 +322,10 @@ class PQIWindow(QtWidgets.QMainWindow):
 
         # region -- Data --
         self._worker = None
+        self._sessionRecordDir = None  # the directory the received messages are recorded to, if any
+        self._sessionRecorder = None
+        self._replayer = None
+        self._replayThread = None
         self._currDispatcherIdForSelectedWidget = None
         self._currDispatcherIdForHoveredWidget = None  # TODO: Could multiple processes have a selected widget simultaneously?
 
@@ -381,10 +402,23 @@ class PQIWindow(QtWidgets.QMainWindow):
         # self._serveButton.setEnabled(False)
         self._selectButton.setEnabled(True)
         self._attachAction.setEnabled(True)
-
-        self._worker = PQYWorker(None, port)  # The parent of worker must be None!
-        self._worker.sigWidgetInfoRecv.connect(self.onWidgetInfoRecv)
-        self._worker.sigNewDispatcher.connect(self.onNewDispatcher)
+        self._replaySessionAction.setEnabled(False)
+
+        if self._sessionRecordDir is not None:
+            try:
+                self._sessionRecorder = SessionRecorder(self._sessionRecordDir)
+                pqi_log.info(f"Recording the session to {self._sessionRecordDir}.")
+            except OSError:
+                pqi_log.warning(f"Failed to record the session to {self._sessionRecordDir}.", exc_info=True)
+
+        # The parent of worker must be None!
+        if self._getServerEngine() == ServerEngine.Selector:
+            self._worker = SelectorWorker(None, port, self._sessionRecorder)
+            self._worker.sigMessagesRecv.connect(self.onMessagesRecv)
+        else:
+            self._worker = PQYWorker(None, port, self._sessionRecorder)
+            self._worker.sigWidgetInfoRecv.connect(self.onWidgetInfoRecv)
+            self._worker.sigNewDispatcher.connect(self.onNewDispatcher)
         self._worker.sigSocketError.connect(self._onWorkerSocketError)
         self._worker.sigDispatcherExited.connect(self._onDispatcherExited)
         # Fix issue #16: use queued connection to avoid recursive call of `PQYWorker.stop`
@@ -412,19 +446,31 @@ class PQIWindow(QtWidgets.QMainWindow):
             self._workerThread.wait()
             self._workerThread = None
 
+        if self._sessionRecorder is not None:
+            self._sessionRecorder.close()
+            self._sessionRecorder = None
+
         # set buttons status to default
         self._portLineEdit.setEnabled(True)
         self._selectButton.setEnabled(False)
 
         # set action status to default
         self._attachAction.setEnabled(False)
+        self._replaySessionAction.setEnabled(True)
 
         # clear ui
         self._widgetBriefWidget.clearInfo()
         self._createStacksListWidget.clearStacks()
         self._hierarchyBar.clearData()
 
-    def _getWorker(self) -> typing.Union[PQYWorker, DummyWorker]:
+    @staticmethod
+    def _getServerEngine() -> ServerEngine:
+        try:
+            return ServerEngine(SettingsController.instance().serverEngine)
+        except ValueError:
+            return ServerEngine.Threads
+
+    def _getWorker(self) -> typing.Union[PQYWorker, SelectorWorker, DummyWorker]:
         if self._worker is None:
             return DUMMY_WORKER
         return self._worker
@@ -449,6 +495,7 @@ class PQIWindow(QtWidgets.QMainWindow):
     def _onDispatcherExited(self, dispatcherId: int):
         """ Only log the info when a dispatcher exited. """
         pqi_log.info(f"Dispatcher {dispatcherId} exited.")
+        self._dispatcherIdToPid.pop(dispatcherId, None)
 
     def _onAllDispatchersExited(self):
         """ Only log the info when all dispatchers exited. """
@@ -459,9 +506,11 @@ class PQIWindow(QtWidgets.QMainWindow):
     def onWidgetInfoRecv(self, dispatcherId: int, info: dict):
         cmdId = info.get("cmd_id")
         text = info.get("text", "")
+        data = info.get("data")  # the decoded JSON, see `decodeMessageData`
         if cmdId == CMD_QT_PATCH_SUCCESS:
             pid = int(text)
             pqi_log.info(f"Qt patched successfully, pid: {pid}")
+            self._dispatcherIdToPid[dispatcherId] = pid
 
             # Sync client-relevant settings to the newly connected client.
             self._getWorker().sendSettingsChangedToDispatcher(dispatcherId, self._buildClientSettings())
@@ -475,7 +524,10 @@ class PQIWindow(QtWidgets.QMainWindow):
         elif cmdId == CMD_WIDGET_INFO:
             # It also means the widget is selected
             self._currDispatcherIdForHoveredWidget = dispatcherId
-            self.handleWidgetInfoMsg(json.loads(text))
+            self.handleWidgetInfoMsg(data)
+        elif cmdId == CMD_HOVER_WIDGET:
+            self._currDispatcherIdForHoveredWidget = dispatcherId
+            self.handleHoverWidgetMsg(data)
         elif cmdId == CMD_INSPECT_FINISHED:
             self._currDispatcherIdForSelectedWidget = dispatcherId
             self.handleInspectFinishedMsg()
@@ -487,22 +539,39 @@ class PQIWindow(QtWidgets.QMainWindow):
             result = text
             self._notifyResultToCodeWindow(False, result)
         elif cmdId == CMD_CHILDREN_INFO:
-            childrenInfoDict = json.loads(text)
+            childrenInfoDict = data
             widgetId = childrenInfoDict["widget_id"]
             self._hierarchyBar.setMenuData(widgetId, childrenInfoDict["child_classes"],
                                            childrenInfoDict["child_object_names"],
                                            childrenInfoDict["child_ids"])
         elif cmdId == CMD_CONTROL_TREE:
-            result = json.loads(text)
+            result = data
             controlTreeInfo = result[TreeViewResultKeys.TREE_INFO_KEY]
             extra = result[TreeViewResultKeys.EXTRA_KEY]
-            self._notifyResultToControlTreeViewWindow(controlTreeInfo, extra)
+            self._notifyResultToControlTreeViewWindow(controlTreeInfo, extra, self._dispatcherIdToPid.get(dispatcherId, 0))
+        elif cmdId == CMD_CONTROL_TREE_DELTA:
+            if dispatcherId == self._controlTreeDispatcherId:
+                self._notifyDeltaToControlTreeViewWindow(data)
         elif cmdId == CMD_WIDGET_PROPS:
-            propsInfo = json.loads(text)
+            propsInfo = data
             self._notifyWidgetPropsInfoToPropsTreeWidget(propsInfo)
+        elif cmdId == CMD_ATTACH_PROGRESS:
+            self._notifyAttachProgress(data)
         elif cmdId == CMD_EXIT:  # the client has exited elegantly
             pqi_log.info(f"Dispatcher {dispatcherId} exited elegantly.")
 
+    def _notifyAttachProgress(self, progress: dict):
+        pid, patched, total = progress["pid"], progress["patched"], progress["total"]
+        if progress["done"]:
+            pqi_log.info(f"Patched the {total} existing widgets of pid {pid}.")
+        if self._attachWindow is not None:
+            self._attachWindow.notifyAttachProgress(pid, patched, total, progress["done"])
+
+    def onMessagesRecv(self, messages: list):
+        """ The messages received by `SelectorWorker` during an iteration of its loop. """
+        for dispatcherId, info in messages:
+            self.onWidgetInfoRecv(dispatcherId, info)
+
     def handleWidgetInfoMsg(self, info):
         self._curWidgetId = info["id"]
         self._widgetBriefWidget.setInfo(info)
@@ -516,11 +585,19 @@ class PQIWindow(QtWidgets.QMainWindow):
             ids = [*reversed(info["parent_ids"]), info["id"]]
             self._hierarchyBar.setData(classes, objNames, ids)
 
+    def handleHoverWidgetMsg(self, info):
+        """ Show the lightweight info sent while the cursor moves, the full info follows when it rests. """
+        self._curWidgetId = info["id"]
+        self._widgetBriefWidget.setHoverInfo(info)
+        self._createStacksListWidget.setStacks([])
+        self._hierarchyBar.setData([info["class_name"]], [info["object_name"]], [info["id"]])
+
     def handleInspectFinishedMsg(self):
         self._handleInspectFinishedFromClient()
 
     def onNewDispatcher(self, dispatcher):
-        dispatcher.sigMsg.connect(self.onWidgetInfoRecv)
+        # The messages are decoded by the thread of the dispatcher, and delivered to the main thread ready to use
+        dispatcher.sigMsg.connect(self.onWidgetInfoRecv, QtCore.Qt.QueuedConnection)
         dispatcher.registerMainUIReady()
 
     def _onInspectButtonClicked(self, checked: bool):
@@ -645,6 +722,7 @@ class PQIWindow(QtWidgets.QMainWindow):
         self._settingWindow.show()
 
     def _onSettingsSaved(self):
+        self._createStacksListWidget.reloadPathMappings()
         worker = self._getWorker()
         if worker:
             settings = self._buildClientSettings()
@@ -727,6 +805,7 @@ class PQIWindow(QtWidgets.QMainWindow):
     def cleanUp(self):
         self._disableInspect()
         self._cleanUpWhenWorkerStopped()
+        self._stopReplay()
 
     # region APIs
     def setPort(self, port: int):
@@ -744,10 +823,15 @@ class PQIWindow(QtWidgets.QMainWindow):
         """ Stop the server. """
         self._stopServer()
 
+    def setSessionRecordDir(self, directory: typing.Optional[str]):
+        """ Record the messages received from the next time the server starts, None to stop recording. """
+        self._sessionRecordDir = directory
+
     @classmethod
     def createWindow(cls, args: argparse.Namespace):
         """ A factory method to create a window. """
         window = cls(defaultPort=args.port)
+        window.setSessionRecordDir(args.record_session)
         return window
 
     # endregion
@@ -771,6 +855,7 @@ class PQIWindow(QtWidgets.QMainWindow):
             w = self._controlTreeViewWindow
             # signals
             w.sigReqControlTree.connect(self._reqControlTreeInCurrentProcess)
+            w.sigReqControlSubtree.connect(self._reqControlSubtreeInCurrentProcess)
             w.sigReqCurrentSelectedWidgetId.connect(
                 self._notifyCurrentSelectedWidgetIdToControlTreeView
             )
@@ -780,26 +865,56 @@ class PQIWindow(QtWidgets.QMainWindow):
         self._controlTreeViewWindow.show()
         self._controlTreeViewWindow.refresh()
 
-    def _reqControlTreeInCurrentProcess(self, needToLocateCurWidget: bool):
+    def _reqControlTreeInCurrentProcess(self, needToLocateCurWidget: bool, depth: int):
         worker = self._getWorker()
         if not worker or self._currDispatcherIdForSelectedWidget is None:
             return
-        extra = {}
+        extra = {TreeViewExtraKeys.DEPTH: depth}
         if needToLocateCurWidget:
-            extra = {TreeViewExtraKeys.CURRENT_WIDGET_ID: self._curWidgetId}
-        worker.sendRequestControlTreeInfoEvent(self._currDispatcherIdForSelectedWidget, extra)
+            extra[TreeViewExtraKeys.CURRENT_WIDGET_ID] = self._curWidgetId
+        self._controlTreeDispatcherId = self._currDispatcherIdForSelectedWidget
+        future = worker.sendRequestControlTreeInfoEvent(self._currDispatcherIdForSelectedWidget, extra)
+        if future is not None:
+            future.add_done_callback(self._onControlTreeRequestDone)
+
+    def _onControlTreeRequestDone(self, future: RequestFuture):
+        # A timed out request is still answered late (unless it is superseded), the window only tells it is slow
+        if future.state == RequestFuture.TIMED_OUT:
+            self._sigControlTreeRequestTimedOut.emit()
+
+    def _notifyTimeoutToControlTreeViewWindow(self):
+        if self._controlTreeViewWindow is None:
+            return
+        self._controlTreeViewWindow.notifyControlTreeTimedOut()
 
-    def _notifyResultToControlTreeViewWindow(self, controlTreeInfo: typing.List[typing.Dict], extra: typing.Dict):
+    def _reqControlSubtreeInCurrentProcess(self, nodeId: int):
+        """ Request the children of a node of the control tree, which is being expanded. """
+        worker = self._getWorker()
+        if not worker or self._controlTreeDispatcherId is None:
+            return
+        extra = {TreeViewExtraKeys.ROOT_ID: nodeId, TreeViewExtraKeys.DEPTH: 1}
+        worker.sendRequestControlTreeInfoEvent(self._controlTreeDispatcherId, extra)
+
+    def _notifyResultToControlTreeViewWindow(self, controlTreeInfo: typing.List[typing.Dict], extra: typing.Dict,
+                                             pid: int):
         if self._controlTreeViewWindow is None:
             return
-        self._controlTreeViewWindow.notifyControlTreeInfo(controlTreeInfo)
+        if TreeViewExtraKeys.ROOT_ID in extra:
+            self._controlTreeViewWindow.notifyControlSubtreeInfo(extra[TreeViewExtraKeys.ROOT_ID], controlTreeInfo)
+            return
+        self._controlTreeViewWindow.notifyControlTreeInfo(controlTreeInfo, pid)
         if TreeViewExtraKeys.CURRENT_WIDGET_ID in extra:
             self._controlTreeViewWindow.notifyLocateWidget(extra[TreeViewExtraKeys.CURRENT_WIDGET_ID])
 
+    def _notifyDeltaToControlTreeViewWindow(self, ops: typing.List[list]):
+        if self._controlTreeViewWindow is None:
+            return
+        self._controlTreeViewWindow.notifyControlTreeDelta(ops)
+
     def _notifyCurrentSelectedWidgetIdToControlTreeView(self):
         if self._controlTreeViewWindow is None:
             return
-        self._controlTreeViewWindow.notifyLocateWidget(self._curWidgetId)
+        self._controlTreeViewWindow.notifyLocateWidget(self._curWidgetId, refreshIfNotFetched=True)
     # endregion
 
     # region Widget Properties
@@ -815,6 +930,58 @@ class PQIWindow(QtWidgets.QMainWindow):
         self._objectPropertiesTreeWidget.notifyWidgetPropsInfo(propsInfo)
     # endregion
 
+    # region Session replay
+    def _onReplaySessionActionTriggered(self):
+        if self._replayer is not None:
+            self._stopReplay()
+            return
+
+        path = QtWidgets.QFileDialog.getExistingDirectory(self, "Replay Session")
+        if not path:
+            return
+        speed, ok = QtWidgets.QInputDialog.getDouble(self, "Replay Session",
+                                                     "Speed (times the recorded pace, 0 for as fast as possible):",
+                                                     10.0, 0.0, 1000.0, 1)
+        if not ok:
+            return
+        self._startReplay(path, speed)
+
+    def _startReplay(self, path: str, speed: float):
+        self._serveButton.setEnabled(False)
+        self._replaySessionAction.setText("Stop Replay")
+
+        # The parent of the replayer must be None, as the worker's
+        self._replayer = SessionReplayer(None, path, speed)
+        self._replayer.sigMessagesRecv.connect(self.onMessagesRecv)
+        self._replayer.sigFinished.connect(self._onReplayFinished)
+        self._replayer.sigError.connect(self._onReplayError)
+        self._replayThread = QtCore.QThread()
+        self._replayer.moveToThread(self._replayThread)
+        self._replayThread.started.connect(self._replayer.run)
+        self._replayThread.start()
+
+    def _stopReplay(self):
+        if self._replayer is None:
+            return
+        self._replayer.stop()
+        self._replayThread.quit()
+        self._replayThread.wait()
+        self._replayThread = None
+        self._replayer.deleteLater()
+        self._replayer = None
+
+        self._serveButton.setEnabled(True)
+        self._replaySessionAction.setText("Replay Session...")
+
+    def _onReplayFinished(self, count: int):
+        """ The count of messages replayed is logged by the replayer. """
+        self._stopReplay()
+
+    def _onReplayError(self, msg: str):
+        self._stopReplay()
+        QtWidgets.QMessageBox.critical(self, "Error", f"Failed to replay the session: {msg}")
+    # endregion
+
     # region Logging
     def _openLogDir(self):
         """ Open the log directory in the file explorer."""
@@ -855,6 +1022,7 @@ class DirectModePQIWindow(PQIWindow):
     def createWindow(cls, args: argparse.Namespace):
         """ Create a window in direct mode. """
         window = cls(defaultPort=args.port)
+        window.setSessionRecordDir(args.record_session)
         window.listen()  # start the server directly after the window is created.
 
         return window
@@ -910,6 +1078,12 @@ def main():
         help='Set the port to listen',
         default=_DEFAULT_PORT
     )
+    parser.add_argument(
+        '--record-session',
+        metavar='DIR',
+        help='Record the messages received to the directory, the session can be replayed from the Tool menu',
+        default=None
+    )
 
     args = parser.parse_args()  # type: argparse.Namespace
 
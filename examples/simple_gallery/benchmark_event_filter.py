@@ -0,0 +1,76 @@
+"""
+Measure the time spent delivering events to the widgets of the gallery, with a real QApplication.
+
+Run it once without and once with PyQtInspect, the difference is the cost of its event filters:
+
+    python benchmark_event_filter.py pyqt5
+    python -m PyQtInspect --direct --file benchmark_event_filter.py pyqt5
+"""
+import sys
+import time
+
+if len(sys.argv) != 2 or sys.argv[1] not in ('pyqt5', 'pyqt6', 'pyside2', 'pyside6'):
+    print("Usage: python benchmark_event_filter.py [pyqt5|pyqt6|pyside2|pyside6]")
+    print("Example: python benchmark_event_filter.py pyqt5")
+    print("Note: You need to install the corresponding PyQt or PySide package.")
+    sys.exit(1)
+
+if sys.argv[1] == 'pyqt5':
+    from gallery_dialog_pyqt5 import Ui_GalleryDialog
+    from PyQt5 import QtCore, QtGui, QtWidgets
+elif sys.argv[1] == 'pyqt6':
+    from gallery_dialog_pyqt6 import Ui_GalleryDialog
+    from PyQt6 import QtCore, QtGui, QtWidgets
+elif sys.argv[1] == 'pyside2':
+    from gallery_dialog_pyside2 import Ui_GalleryDialog
+    from PySide2 import QtCore, QtGui, QtWidgets
+else:
+    from gallery_dialog_pyside6 import Ui_GalleryDialog
+    from PySide6 import QtCore, QtGui, QtWidgets
+
+EVENT_COUNT = 20000
+REPEAT = 5
+
+
+def _bestTimePerEvent(sendOne) -> float:
+    """ The best of `REPEAT` runs, in nanoseconds per event. """
+    best = None
+    for _ in range(REPEAT):
+        start = time.perf_counter_ns()
+        for _ in range(EVENT_COUNT):
+            sendOne()
+        elapsed = time.perf_counter_ns() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / EVENT_COUNT
+
+
+def runBenchmark(widget):
+    """ Deliver the events the inspected applications receive the most, the filters only handle a few types. """
+    sendEvent = QtCore.QCoreApplication.sendEvent
+    center = QtCore.QPointF(widget.width() / 2, widget.height() / 2)
+    mouseMoveEvent = QtGui.QMouseEvent(QtCore.QEvent.Type.MouseMove, center, QtCore.Qt.MouseButton.NoButton,
+                                       QtCore.Qt.MouseButton.NoButton, QtCore.Qt.KeyboardModifier.NoModifier)
+    timerEvent = QtCore.QTimerEvent(0)
+    enterEvent = QtGui.QEnterEvent(center, center, center)
+
+    results = [
+        ('Paint (repaint)', _bestTimePerEvent(widget.repaint)),
+        ('MouseMove', _bestTimePerEvent(lambda: sendEvent(widget, mouseMoveEvent))),
+        ('Timer', _bestTimePerEvent(lambda: sendEvent(widget, timerEvent))),
+        ('Enter', _bestTimePerEvent(lambda: sendEvent(widget, enterEvent))),
+    ]
+    print(f'{type(widget).__name__} {widget.objectName()}, {EVENT_COUNT} events, best of {REPEAT}:')
+    for name, nanoseconds in results:
+        print(f'  {name:<16}{nanoseconds:>10.0f} ns')
+
+
+if __name__ == "__main__":
+    app = QtWidgets.QApplication(sys.argv)
+    GalleryDialog = QtWidgets.QDialog()
+    ui = Ui_GalleryDialog()
+    ui.setupUi(GalleryDialog)
+    GalleryDialog.show()
+    app.processEvents()
+
+    runBenchmark(ui.pushButton)
+    GalleryDialog.close()